@@ -0,0 +1,126 @@
+import argparse
+import time
+import warnings
+import numpy as np
+import thermal_dynamics_HVB as viewer
+from data_fingerprint import current_fingerprints
+from derived_signals import DerivedSignals
+from incremental import compute_in_pool, order_by_runs, read_results, unchanged_runs, write_results
+from run_index import load_file_ids
+
+# Bump when the KPI definitions change, so that all runs are recomputed
+kpi_version = 2  # 2: samples flagged by the data-quality checks are excluded
+
+# Default thresholds for the time-above-threshold figures
+default_thresholds = {
+    "max_temp_c": 35.0,        # Hottest cell above this temperature
+    "cell_range_c": 5.0,       # Spread between hottest and coldest cell above this
+    "layer_range_c": 2.0,      # Spread between the layer mean temperatures above this
+}
+
+# The viewer plots one sample per second, durations are reported on the same basis
+sample_period_s = 1.0
+
+def compute_kpis(temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow, thresholds):
+    """Summary KPIs of one run, computed over the whole (sensor x time) matrix at once."""
+    kpis = {"samples": int(temperatures.shape[1]), "sensors": int(temperatures.shape[0])}
+    if temperatures.size == 0:
+        return kpis
+
+    # Same derived signals as the viewer, but over the full temperature matrix even if the coolant signals are shorter
+    derived = DerivedSignals((temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow), trim=False)
+    with warnings.catch_warnings():
+        # Samples where every sensor is NaN are expected and yield NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+
+        cell_max, cell_min = derived["cell_max"], derived["cell_min"]
+        cell_range = derived["cell_range"]
+        layer_range = derived["layer_range"]
+
+        sensor_max = derived["sensor_max"]
+        hottest_sensor = sensor_identifiers[int(np.nanargmax(sensor_max))] if np.isfinite(sensor_max).any() else None
+
+        kpis.update({
+            "duration_s": temperatures.shape[1] * sample_period_s,
+            "max_temp_c": float(np.nanmax(cell_max)),
+            "min_temp_c": float(np.nanmin(cell_min)),
+            "mean_temp_c": float(np.nanmean(temperatures)),
+            "hottest_sensor": f"{hottest_sensor[0]}_BMS{hottest_sensor[1]}" if hottest_sensor else None,
+            "cell_range_max_c": float(np.nanmax(cell_range)),
+            "cell_range_mean_c": float(np.nanmean(cell_range)),
+            "layer_range_max_c": float(np.nanmax(layer_range)),
+            "layer_range_mean_c": float(np.nanmean(layer_range)),
+            "time_above_max_temp_s": float(np.count_nonzero(cell_max > thresholds["max_temp_c"]) * sample_period_s),
+            "time_above_cell_range_s": float(np.count_nonzero(cell_range > thresholds["cell_range_c"]) * sample_period_s),
+            "time_above_layer_range_s": float(np.count_nonzero(layer_range > thresholds["layer_range_c"]) * sample_period_s),
+        })
+
+        if len(derived["flow"]) > 0:
+            heat_flow = derived["heat_flow"]
+            kpis.update({
+                "heat_flow_mean_w": float(np.nanmean(heat_flow)),
+                "heat_flow_max_w": float(np.nanmax(heat_flow)),
+                "heat_energy_kwh": float(np.nansum(heat_flow) * sample_period_s / 3.6e6),
+                "inlet_mean_c": float(np.nanmean(derived["inlet"])),
+                "outlet_max_c": float(np.nanmax(derived["outlet"])),
+            })
+    return kpis
+
+def compute_run_kpis(db_path, lookup_table_path, file_id, fingerprint, thresholds, quality_thresholds=None):
+    """Worker: load one run through the extract cache and compute its KPIs."""
+    start_time = time.perf_counter()
+    temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow = viewer.load_run(
+        db_path, lookup_table_path, file_id, quality_thresholds=quality_thresholds)
+    row = {"file_id": file_id, "fingerprint": fingerprint}
+    row.update(compute_kpis(temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow, thresholds))
+    row["compute_s"] = time.perf_counter() - start_time
+    return row
+
+def run_batch(db_path, lookup_table_path, output_path, thresholds=None, workers=None, force=False, quality_thresholds=None):
+    """Compute the KPIs of every run in the lookup table, reusing the results of unchanged runs."""
+    import pandas as pd
+
+    thresholds = dict(default_thresholds, **(thresholds or {}))
+    file_ids = load_file_ids(lookup_table_path)
+    fingerprints = current_fingerprints(db_path, lookup_table_path, file_ids,
+                                        thresholds=thresholds, quality=quality_thresholds, version=kpi_version)
+    previous = read_results(output_path)
+    previous_by_id = {row["file_id"]: row for row in previous.to_dict("records")} if not previous.empty else {}
+
+    # A run is up to date if its data and the thresholds are unchanged since the last batch
+    unchanged = unchanged_runs(fingerprints, {file_id: row.get("fingerprint") for file_id, row in previous_by_id.items()}, force)
+    rows = [previous_by_id[file_id] for file_id in file_ids if file_id in unchanged]
+    todo = {file_id: (db_path, lookup_table_path, file_id, fingerprints[file_id], thresholds, quality_thresholds)
+            for file_id in file_ids if file_id not in unchanged}
+
+    print(f"{len(file_ids)} runs, {len(todo)} to (re)compute, {len(rows)} unchanged.")
+    rows.extend(compute_in_pool(compute_run_kpis, todo, workers, span_name="kpi.batch", action="computing KPIs for").values())
+
+    results = order_by_runs(pd.DataFrame(rows), file_ids)
+    write_results(results, output_path)
+    print(f"KPI results for {len(results)} runs saved to {output_path}")
+    return results
+
+if __name__ == "__main__":
+    config_data = viewer.load_config("config.json") or {}
+
+    parser = argparse.ArgumentParser(description="Compute per-run temperature and heat-flow KPIs for all runs.")
+    parser.add_argument("--db-path", default=config_data.get("db_path", "mf4_data.db"))
+    parser.add_argument("--lookup-table-path", default=config_data.get("lookup_table_path", "db_lookup_table.parquet"))
+    parser.add_argument("--output", default="kpi_results.parquet", help="Result table (.parquet or .csv)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Recompute all runs")
+    parser.add_argument("--max-temp", type=float, default=default_thresholds["max_temp_c"], help="Threshold for time above max temperature [°C]")
+    parser.add_argument("--cell-range", type=float, default=default_thresholds["cell_range_c"], help="Threshold for time above cell range [°C]")
+    parser.add_argument("--layer-range", type=float, default=default_thresholds["layer_range_c"], help="Threshold for time above layer range [°C]")
+    args = parser.parse_args()
+
+    run_batch(
+        args.db_path,
+        args.lookup_table_path,
+        args.output,
+        thresholds={"max_temp_c": args.max_temp, "cell_range_c": args.cell_range, "layer_range_c": args.layer_range},
+        workers=args.workers,
+        force=args.force,
+        quality_thresholds=config_data.get("quality_thresholds"),
+    )
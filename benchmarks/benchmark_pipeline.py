@@ -0,0 +1,348 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import pickle
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Make the top-level modules and the helper scripts importable
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+sys.path.insert(0, os.path.join(repo_dir, "helper_scripts"))
+
+import matplotlib
+matplotlib.use("Agg")
+
+import pandas as pd
+import synthetic_data_generator as generator
+from generate_lookup_table import generate_lookup_table
+
+# Data sizes to benchmark: the real runs are roughly "medium", "large" is 10x the run length
+sizes = {
+    "small": {"duration": 600.0, "sample_rate": 1.0, "sensor_count": 96},
+    "medium": {"duration": 3600.0, "sample_rate": 1.0, "sensor_count": 96},
+    "large": {"duration": 36000.0, "sample_rate": 1.0, "sensor_count": 96},
+}
+
+# The importer is slow, so it is benchmarked on a capped run length
+importer_max_duration = 600.0
+
+
+def timed(func, *args, **kwargs):
+    """Call func with stdout suppressed and return (result, elapsed seconds)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start_time
+    return result, elapsed
+
+
+def latency_summary(samples):
+    samples = np.asarray(samples)
+    return {
+        "count": int(len(samples)),
+        "mean_s": float(np.mean(samples)),
+        "median_s": float(np.median(samples)),
+        "p95_s": float(np.percentile(samples, 95)),
+        "max_s": float(np.max(samples)),
+    }
+
+
+def benchmark_importer(workdir, run_options):
+    """Rows per second of database_importer.import_mf4_file on a generated MF4 file."""
+    try:
+        from database_importer import import_mf4_file
+    except ImportError as e:
+        return {"skipped": f"asammdf not available: {e}"}
+
+    options = dict(run_options, duration=min(run_options["duration"], importer_max_duration))
+    run = generator.generate_run(seed=1, **options)
+    mf4_path = os.path.join(workdir, "BENCH_Run1_01.MF4")
+    generator.write_run_to_mf4(mf4_path, run)
+
+    conn = sqlite3.connect(os.path.join(workdir, "import_benchmark.db"))
+    try:
+        rows, elapsed = timed(import_mf4_file, conn, mf4_path, [])
+    finally:
+        conn.close()
+    return {"rows": rows, "seconds": elapsed, "rows_per_second": rows / elapsed if elapsed else None}
+
+
+def warm_lazy_imports():
+    """Import the modules the viewer only imports on a cache miss, so that the cold timings measure the database."""
+    importlib.import_module("sqlalchemy")
+
+
+def benchmark_extraction(db_path, lookup_table, file_id):
+    """Cold (database) and warm (cache) latency of both extract functions, plus the raw cache load time."""
+    import thermal_dynamics_HVB as viewer
+
+    warm_lazy_imports()
+
+    temp_cache_filename = os.path.join("data", f"temp_data_{file_id}.pkl")
+    flow_cache_filename = os.path.join("data", f"flow_data_{file_id}.pkl")
+    results = {}
+
+    (temperatures, sensor_identifiers), results["extract_temperatures_cold_s"] = timed(
+        viewer.extract_temperatures_and_sensor_numbers, db_path, lookup_table, file_id,
+        cache_filename=temp_cache_filename, force_refresh=True)
+    _, results["extract_temperatures_warm_s"] = timed(
+        viewer.extract_temperatures_and_sensor_numbers, db_path, lookup_table, file_id,
+        cache_filename=temp_cache_filename)
+
+    flow_data, results["extract_inlet_outlet_flow_cold_s"] = timed(
+        viewer.extract_inlet_outlet_flow, db_path, file_id, lookup_table,
+        cache_filename=flow_cache_filename, force_refresh=True)
+    _, results["extract_inlet_outlet_flow_warm_s"] = timed(
+        viewer.extract_inlet_outlet_flow, db_path, file_id, lookup_table,
+        cache_filename=flow_cache_filename)
+
+    start_time = time.perf_counter()
+    for cache_filename in (temp_cache_filename, flow_cache_filename):
+        with open(cache_filename, "rb") as f:
+            pickle.load(f)
+    results["cache_load_s"] = time.perf_counter() - start_time
+    results["cache_size_bytes"] = sum(os.path.getsize(p) for p in (temp_cache_filename, flow_cache_filename))
+    results["temperature_matrix_shape"] = list(temperatures.shape)
+    return results, (temperatures, sensor_identifiers) + tuple(flow_data)
+
+
+def benchmark_cache_codecs(run_data):
+    """Size, load time and largest decoding error of the extract cache with each fixed-point codec."""
+    import fixed_point
+
+    temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow = run_data
+    cache_contents = {"temp": (temperatures, sensor_identifiers), "flow": (inlet_temp, outlet_temp, flow)}
+    results = {}
+    for codec in fixed_point.cache_codecs:
+        payloads = {name: pickle.dumps(fixed_point.pack(data, codec)) for name, data in cache_contents.items()}
+        start_time = time.perf_counter()
+        loaded = {name: pickle.loads(payload) for name, payload in payloads.items()}
+        load_s = time.perf_counter() - start_time
+        with np.errstate(invalid="ignore"):
+            max_error = float(np.nanmax(np.abs(loaded["temp"][0] - temperatures))) if temperatures.size else 0.0
+        results[codec] = {
+            "cache_size_bytes": sum(len(payload) for payload in payloads.values()),
+            "cache_load_s": load_s,
+            "max_abs_error_c": max_error,
+        }
+    return results
+
+
+def benchmark_frames(run_data, frame_count):
+    """Per-frame latency of plot_battery_layout and of the viewer's update() on the Agg backend."""
+    import matplotlib.pyplot as plt
+    import thermal_dynamics_HVB as viewer
+
+    temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow = run_data
+    (fig, slider, ani), _ = timed(
+        viewer.interactive_battery_layout, temperatures, sensor_identifiers,
+        viewer.sensors_per_module_list, viewer.strings_count, viewer.custom_sensor_order,
+        inlet_temp, outlet_temp, flow, 15.0, 40.0, file_id="benchmark", show=False)
+    total_frames = int(slider.valmax) + 1
+    frame_indices = np.linspace(0, total_frames - 1, frame_count).astype(int)
+    layer_axes = fig.axes[:viewer.strings_count]
+
+    plot_latencies = []
+    smooth_latencies = []
+    update_latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for t_index in frame_indices:
+            start_time = time.perf_counter()
+            viewer.plot_battery_layout(
+                temperatures, sensor_identifiers, viewer.sensors_per_module_list, viewer.strings_count,
+                t_index, total_frames, layer_axes, [None], viewer.custom_sensor_order, fig=fig)
+            plot_latencies.append(time.perf_counter() - start_time)
+
+        for t_index in frame_indices:
+            start_time = time.perf_counter()
+            viewer.plot_battery_layout(
+                temperatures, sensor_identifiers, viewer.sensors_per_module_list, viewer.strings_count,
+                t_index, total_frames, layer_axes, [None], viewer.custom_sensor_order, fig=fig, smooth=True)
+            smooth_latencies.append(time.perf_counter() - start_time)
+
+        for t_index in frame_indices:
+            start_time = time.perf_counter()
+            slider.set_val(t_index)
+            fig.canvas.draw()
+            update_latencies.append(time.perf_counter() - start_time)
+    plt.close(fig)
+
+    # The interpolation alone: one mat-vec per layer on a layer grid
+    from smooth_heatmap import layer_interpolator
+    interpolator = layer_interpolator((4, 4 * viewer.sensors_per_module_list[0]), (100.0, 586.0, 50.0, 262.0))
+    layer_values = temperatures[:4 * 4 * viewer.sensors_per_module_list[0], 0]
+    start_time = time.perf_counter()
+    for _ in range(100):
+        interpolator.field(layer_values)
+    field_s = (time.perf_counter() - start_time) / 100
+
+    return {
+        "plot_battery_layout": latency_summary(plot_latencies),
+        "plot_battery_layout_smooth": latency_summary(smooth_latencies),
+        "smooth_field_per_layer_s": field_s,
+        "update_and_draw": latency_summary(update_latencies),
+    }
+
+
+def benchmark_startup(db_path, lookup_table_path, file_id):
+    """Cold-start timings of the entry points in fresh interpreters, with the extract cache already warm."""
+    import run_index
+
+    env = dict(os.environ, PYTHONPATH=repo_dir, MPLBACKEND="Agg")
+    results = {}
+
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import thermal_dynamics_HVB"], env=env, check=True, capture_output=True)
+    results["import_viewer_s"] = time.perf_counter() - start_time
+
+    # Under Agg the first draw has to be triggered explicitly, it then reports the time to first window
+    script = (
+        "import matplotlib.pyplot as plt, thermal_dynamics_HVB as viewer\n"
+        f"viewer.main({db_path!r}, {lookup_table_path!r}, {file_id!r}, 15.0, 40.0)\n"
+        "plt.gcf().canvas.draw()\n"
+    )
+    start_time = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", script], env=env, check=True, capture_output=True, text=True).stdout
+    results["first_window_process_s"] = time.perf_counter() - start_time
+    for line in output.splitlines():
+        if line.startswith("Time to first window:"):
+            results["first_window_reported_s"] = float(line.split(":")[1].split()[0])
+
+    index_path = os.path.join("data", "benchmark_run_index.json")
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    _, results["settings_load_file_ids_cold_s"] = timed(run_index.load_file_ids, lookup_table_path, index_path)
+    _, results["settings_load_file_ids_cached_s"] = timed(run_index.load_file_ids, lookup_table_path, index_path)
+    return results
+
+
+def benchmark_server(db_path, lookup_table_path, file_id, frame_count):
+    """Per-request latency of the HTTP frame server: JSON frames, PNG frames (rendered and from the LRU) and a time window."""
+    import threading
+    import urllib.request
+    from urllib.parse import quote
+    import frame_server
+
+    server = frame_server.make_server(frame_server.FrameServer(db_path, lookup_table_path), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/runs/{quote(file_id)}"
+
+    def fetch(path):
+        start_time = time.perf_counter()
+        with urllib.request.urlopen(base_url + path) as response:
+            response.read()
+        return time.perf_counter() - start_time
+
+    results = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["first_request_s"] = fetch("")  # Loads the run into the server's run cache
+            total_frames = json.loads(urllib.request.urlopen(base_url).read())["frames"]
+            frame_indices = np.linspace(0, total_frames - 1, frame_count).astype(int)
+            results["frame_json"] = latency_summary([fetch(f"/frames/{t_index}") for t_index in frame_indices])
+            results["frame_png_rendered"] = latency_summary([fetch(f"/frames/{t_index}.png") for t_index in frame_indices])
+            results["frame_png_cached"] = latency_summary([fetch(f"/frames/{t_index}.png") for t_index in frame_indices])
+            results["window_600_frames_s"] = fetch("/window?start=0&end=600&grids=1")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def benchmark_size(name, run_options, frame_count):
+    print(f"Benchmarking size '{name}' ({run_options})")
+    workdir = tempfile.mkdtemp(prefix=f"bat_temp_bench_{name}_")
+    previous_dir = os.getcwd()
+    # The extract cache is always written to ./data, so run inside the scratch directory
+    os.chdir(workdir)
+    os.makedirs("data", exist_ok=True)
+    try:
+        db_path = os.path.join(workdir, "mf4_data.db")
+        lookup_table_path = os.path.join(workdir, "db_lookup_table.parquet")
+        lookup_table, generate_s = timed(
+            generator.generate_synthetic_database, db_path, lookup_table_path, run_count=1, **run_options)
+        file_id = lookup_table["File.ID"].iloc[0]
+
+        results = {"run_options": run_options, "generate_s": generate_s}
+        results["importer"] = benchmark_importer(workdir, run_options)
+        _, results["lookup_table_generation_s"] = timed(generate_lookup_table, db_path)
+
+        extraction, run_data = benchmark_extraction(db_path, pd.read_parquet(lookup_table_path), file_id)
+        results.update(extraction)
+        results["cache_codecs"] = benchmark_cache_codecs(run_data)
+        results["startup"] = benchmark_startup(db_path, lookup_table_path, file_id)
+        results["frames"] = benchmark_frames(run_data, frame_count)
+        results["server"] = benchmark_server(db_path, lookup_table_path, file_id, frame_count)
+        return results
+    finally:
+        os.chdir(previous_dir)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    # {"a": {"b": 1}} -> {"a.b": 1}, numeric values only
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare_results(current, baseline):
+    """Print the ratio current/baseline of every timing that exists in both result files."""
+    current_flat = flatten(current["sizes"])
+    baseline_flat = flatten(baseline["sizes"])
+    print(f"\nComparison against {baseline.get('git_revision')} ({baseline.get('timestamp')}):")
+    for key, value in current_flat.items():
+        if key.endswith("_s") and key in baseline_flat and baseline_flat[key] > 0:
+            ratio = value / baseline_flat[key]
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print(f"  {key:70s} {baseline_flat[key]:10.4f} -> {value:10.4f} s  (x{ratio:.2f}){flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingest, extraction, cache load and frame update.")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated subset of {', '.join(sizes)}")
+    parser.add_argument("--frames", type=int, default=20, help="Number of frames to render per size")
+    parser.add_argument("--output", default=None, help="Result JSON file (default: benchmarks/results/benchmark_<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="Previous result JSON to compare against")
+    args = parser.parse_args()
+
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    results = {
+        "timestamp": timestamp,
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sizes": {},
+    }
+    for name in args.sizes.split(","):
+        results["sizes"][name] = benchmark_size(name, sizes[name], args.frames)
+
+    output = args.output or os.path.join(repo_dir, "benchmarks", "results", f"benchmark_{timestamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Benchmark results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(results, json.load(f))
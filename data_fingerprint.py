@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from run_index import db_path_column, db_paths
+
+# Fingerprints of the runs' data, valid while the databases and the lookup table are unchanged
+fingerprint_cache_path = os.path.join("data", "run_fingerprints.json")
+
+# Bump when the fingerprint changes, so that cached fingerprints are recomputed
+fingerprint_version = 2  # 2: sum of the looked-up signals per table
+
+def table_stats(db_path, channels_by_table):
+    """[(file_id, table, rows, first time, last time, value sum)] of every run in the given tables of one database.
+
+    channels_by_table is {table: [channel]}; the value sum is the sum of those channels over the run's rows.
+    """
+    stats = []
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        for table_name in sorted(channels_by_table):
+            value_sum = " + ".join(f"TOTAL({channel})" for channel in sorted(channels_by_table[table_name])) or "0"
+            # One pass per table for all runs
+            cursor.execute(f"SELECT file_id, COUNT(*), MIN(time), MAX(time), {value_sum} FROM {table_name} GROUP BY file_id")
+            stats.extend((file_id, table_name, *values) for file_id, *values in cursor.fetchall())
+    return stats
+
+def run_fingerprint(data_fingerprint, **settings):
+    """Hash of a run's data fingerprint and the settings a result of it was computed with (thresholds, version, ...)."""
+    payload = json.dumps(dict(settings, data=data_fingerprint), sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+def current_fingerprints(db_path, lookup_table_path, file_ids, **settings):
+    """{file_id: run_fingerprint} of the given runs, all with the same settings."""
+    data_fingerprints = load_data_fingerprints(db_path, lookup_table_path)
+    return {file_id: run_fingerprint(data_fingerprints.get(file_id), **settings) for file_id in file_ids}
+
+def compute_data_fingerprints(db_path, lookup_table):
+    """Hash of every run's lookup entries and its row count, time span and sum of the looked-up signals in each table.
+
+    The hash only changes when the run's own data changes, unlike the mtimes of the databases and caches,
+    which change with every import. The sum makes corrected values count as a change even if the run keeps its
+    length; only a correction that leaves every table's sum exactly as it was goes unnoticed.
+    """
+    paths = db_paths(db_path)
+    channels_by_table = []
+    for path in paths:
+        rows = lookup_table[lookup_table[db_path_column] == path] if db_path_column in lookup_table else lookup_table
+        channels_by_table.append({table_name: channels.unique().tolist() for table_name, channels in rows.groupby('Table.Name')['Channel.Name']})
+    # The databases are read in parallel, sqlite3 releases the GIL while it runs a query
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        stats_per_db = list(executor.map(table_stats, paths, channels_by_table))
+
+    tables_by_run = {}
+    for path, stats in zip(paths, stats_per_db):
+        source_ids = set(lookup_table.loc[lookup_table[db_path_column] == path, 'File.ID']) if db_path_column in lookup_table else None
+        for file_id, table_name, *values in stats:
+            # A run that is also in another database only counts where the lookup table takes it from
+            if source_ids is None or file_id in source_ids:
+                tables_by_run.setdefault(file_id, []).append([table_name, *values])
+
+    fingerprints = {}
+    for file_id, run_lookup in lookup_table.groupby('File.ID'):
+        payload = json.dumps({"lookup": run_lookup.sort_values(['Table.Name', 'Channel.Name'])[['Channel.Name', 'Table.Name']].values.tolist(),
+                              "tables": tables_by_run.get(file_id, [])}, sort_keys=True, default=str)
+        fingerprints[file_id] = hashlib.sha1(payload.encode()).hexdigest()
+    return fingerprints
+
+def file_key(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_mtime, stat.st_size]
+
+def load_data_fingerprints(db_path, lookup_table_path, lookup_table=None, cache_path=fingerprint_cache_path):
+    """{file_id: data fingerprint} of all runs, computed once per change of the databases or the lookup table.
+
+    precompute.py computes them after every import, so the batch tools normally read them from the cache.
+    """
+    key = {"lookup_table": file_key(lookup_table_path), "databases": [file_key(path) for path in db_paths(db_path)],
+           "version": fingerprint_version}
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["fingerprints"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    if lookup_table is None:
+        from thermal_dynamics_HVB import load_lookup_table
+        lookup_table = load_lookup_table(lookup_table_path)
+    fingerprints = compute_data_fingerprints(db_path, lookup_table)
+    try:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump({"key": key, "fingerprints": fingerprints}, f, indent=4)
+    except OSError as e:
+        print(f"Could not write run fingerprints {cache_path}: {e}")
+    return fingerprints
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import warnings
+import numpy as np
+from instrumentation import span, count
+
+# Bump when the checks change, so that cached quality masks are rebuilt
+quality_version = 1
+
+# Default limits of the quality checks
+default_quality_thresholds = {
+    "min_valid_c": -30.0,          # Readings below this are out of range (open or shorted sensor)
+    "max_valid_c": 100.0,          # Readings above this are out of range
+    "spike_c": 3.0,                # Single sample differing from both neighbours by more than this, in the same direction
+    "stuck_samples": 600,          # A value repeated for at least this many samples ...
+    "stuck_pack_change_c": 2.0,    # ... while the pack mean changes by more than this is a stuck sensor
+}
+
+# Bits of the per-sample quality mask, a sample is valid if no bit is set
+quality_flags = {"dropout": 1, "out_of_range": 2, "spike": 4, "stuck": 8}
+
+# Sensors processed at a time, bounds the temporary memory for long runs
+rows_per_block = 16
+
+summary_dtype = np.dtype([("dropout", np.int64), ("out_of_range", np.int64), ("spike", np.int64), ("stuck", np.int64),
+                          ("masked", np.int64), ("masked_fraction", np.float64), ("longest_stuck", np.int64)])
+
+def stuck_runs(block, pack_mean, thresholds):
+    """Boolean (rows x time) of the samples in runs of equal values that count as stuck, and the longest such run per row."""
+    n_rows, n_samples = block.shape
+    values = block.ravel()
+    change = np.ones(values.size, dtype=bool)
+    change[1:] = values[1:] != values[:-1]  # NaN != NaN, so every missing sample is a run of its own
+    change[::n_samples] = True
+    starts = np.flatnonzero(change)
+    lengths = np.diff(np.append(starts, values.size))
+
+    # Change of the pack mean over each long run; reduceat over (start, end) pairs, every second result is a gap
+    stuck = (lengths >= thresholds["stuck_samples"]) & ~np.isnan(values[starts])
+    long_starts = starts[stuck] % n_samples
+    if len(long_starts):
+        bounds = np.column_stack([long_starts, long_starts + lengths[stuck]]).ravel()
+        padded_mean = np.append(pack_mean, np.nan)
+        pack_change = np.fmax.reduceat(padded_mean, bounds)[::2] - np.fmin.reduceat(padded_mean, bounds)[::2]
+        stuck[stuck] = pack_change > thresholds["stuck_pack_change_c"]
+
+    longest = np.zeros(n_rows, dtype=np.int64)
+    np.maximum.at(longest, starts[stuck] // n_samples, lengths[stuck])
+    return np.repeat(stuck, lengths).reshape(n_rows, n_samples), longest
+
+def check_quality(temperatures, thresholds=None):
+    """Quality mask (sensor x time, bits of quality_flags) and per-sensor summary of a temperature matrix."""
+    thresholds = dict(default_quality_thresholds, **(thresholds or {}))
+    n_sensors, n_samples = temperatures.shape
+    mask = np.zeros((n_sensors, n_samples), dtype=np.uint8)
+    summary = np.zeros(n_sensors, dtype=summary_dtype)
+    if temperatures.size == 0:
+        return mask, summary
+
+    with warnings.catch_warnings():
+        # Samples where every sensor is NaN are expected and yield NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        in_range = (temperatures >= thresholds["min_valid_c"]) & (temperatures <= thresholds["max_valid_c"])
+        pack_mean = np.nanmean(np.where(in_range, temperatures, np.nan), axis=0)
+
+    for start in range(0, n_sensors, rows_per_block):
+        stop = min(start + rows_per_block, n_sensors)
+        block = temperatures[start:stop]
+        block_mask = mask[start:stop]
+
+        missing = np.isnan(block)
+        block_mask[missing] |= quality_flags["dropout"]
+        block_mask[~missing & ~in_range[start:stop]] |= quality_flags["out_of_range"]
+
+        if n_samples > 2:
+            to_previous = block[:, 1:-1] - block[:, :-2]
+            to_next = block[:, 1:-1] - block[:, 2:]
+            spike = ((np.abs(to_previous) > thresholds["spike_c"]) & (np.abs(to_next) > thresholds["spike_c"])
+                     & (np.sign(to_previous) == np.sign(to_next)))
+            block_mask[:, 1:-1][spike] |= quality_flags["spike"]
+
+        stuck, summary["longest_stuck"][start:stop] = stuck_runs(block, pack_mean, thresholds)
+        block_mask[stuck] |= quality_flags["stuck"]
+
+    for name, bit in quality_flags.items():
+        summary[name] = np.count_nonzero(mask & bit, axis=1)
+    summary["masked"] = np.count_nonzero(mask, axis=1)
+    summary["masked_fraction"] = summary["masked"] / n_samples
+    return mask, summary
+
+def apply_quality_mask(temperatures, mask):
+    """Set every flagged sample to NaN, in place, so that all nan-aware statistics skip it."""
+    temperatures[mask != 0] = np.nan
+    return temperatures
+
+def quality_cache_filename(file_id):
+    return os.path.join("data", f"quality_{file_id}.npz")
+
+def load_quality(file_id, temperatures, thresholds=None, force_refresh=False):
+    """Quality mask and summary of a run, read from data/quality_<file_id>.npz while it is newer than the run's temperature cache."""
+    thresholds = dict(default_quality_thresholds, **(thresholds or {}))
+    settings = json.dumps({"version": quality_version, "thresholds": thresholds}, sort_keys=True)
+    cache_filename = quality_cache_filename(file_id)
+    temp_cache_filename = os.path.join("data", f"temp_data_{file_id}.pkl")
+    has_temp_cache = file_id is not None and os.path.exists(temp_cache_filename)
+
+    if (not force_refresh and has_temp_cache and os.path.exists(cache_filename)
+            and os.path.getmtime(cache_filename) > os.path.getmtime(temp_cache_filename)):
+        with span("quality.load"), np.load(cache_filename) as stored:
+            if str(stored["settings"]) == settings and stored["mask"].shape == temperatures.shape:
+                count("quality.cache.hit")
+                return stored["mask"], stored["summary"]
+
+    count("quality.cache.miss")
+    with span("quality.check", samples=temperatures.shape[1]):
+        mask, summary = check_quality(temperatures, thresholds)
+    if has_temp_cache:
+        # The mask is mostly zeros and compresses to a small fraction of its size
+        np.savez_compressed(cache_filename, mask=mask, summary=summary, settings=np.array(settings))
+    return mask, summary
+
+def summary_table(summary, sensor_identifiers):
+    """Per-sensor quality summary as a DataFrame, worst sensors first."""
+    import pandas as pd
+    table = pd.DataFrame(summary)
+    table.insert(0, "SensorNumber", [sensor_number for sensor_number, _ in sensor_identifiers])
+    table.insert(1, "BMS_ID", [bms_id for _, bms_id in sensor_identifiers])
+    return table.sort_values("masked", ascending=False, kind="stable").reset_index(drop=True)
+
+def describe_quality(summary):
+    flagged = np.count_nonzero(summary["masked"] - summary["dropout"])
+    total = summary["masked_fraction"].mean() * 100 if len(summary) else 0.0
+    return f"{flagged} of {len(summary)} sensors with invalid readings, {total:.2f}% of all samples masked"
+
+if __name__ == "__main__":
+    import thermal_dynamics_HVB as viewer
+
+    config_data = viewer.load_config("config.json") or {}
+
+    parser = argparse.ArgumentParser(description="Check the sensor data of a run for dropouts, stuck values, spikes and out-of-range readings.")
+    parser.add_argument("--db-path", default=config_data.get("db_path", "mf4_data.db"))
+    parser.add_argument("--lookup-table-path", default=config_data.get("lookup_table_path", "db_lookup_table.parquet"))
+    parser.add_argument("--file-id", default=config_data.get("file_id", "TCP0014_Run17_01.MF4"))
+    parser.add_argument("--output", default=None, help="Also save the per-sensor summary (.parquet or .csv)")
+    parser.add_argument("--force", action="store_true", help="Recheck even if the mask is cached")
+    args = parser.parse_args()
+
+    temperatures, sensor_identifiers, _, _, _ = viewer.load_run(args.db_path, args.lookup_table_path, args.file_id, apply_quality=False)
+    mask, summary = load_quality(args.file_id, temperatures, config_data.get("quality_thresholds"), force_refresh=args.force)
+    table = summary_table(summary, sensor_identifiers)
+    print(describe_quality(summary))
+    print(table[table["masked"] > 0].to_string(index=False))
+    if args.output:
+        if args.output.endswith(".parquet"):
+            table.to_parquet(args.output, index=False)
+        else:
+            table.to_csv(args.output, index=False)
+        print(f"Quality summary saved to {args.output}")
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import warnings
+import numpy as np
+from instrumentation import span, count
+
+# The viewer plots one sample per second, rates are per second on the same basis
+sample_period_s = 1.0
+
+# Inputs every derived signal is computed from
+base_signals = ["temperatures", "inlet", "outlet", "flow", "layer_rows"]
+
+# Bump when a stored signal changes, so that data/derived_<file_id>.npz is rewritten
+derived_version = 1
+
+# Per-sample signals stored by the precompute pipeline (precompute.py), so that opening a run only loads them
+stored_signals = ["cell_max", "cell_min", "cell_mean", "cell_std", "cell_range", "layer_mean", "layer_max", "layer_min",
+                  "layer_std", "layer_range", "heat_flow"]
+
+# Registered derived signals: name -> (function, names of the signals it is computed from)
+derived_signal_functions = {}
+
+def derived_signal(function):
+    """Register function as a derived signal. Its parameter names are the signals it depends on."""
+    dependencies = function.__code__.co_varnames[:function.__code__.co_argcount]
+    derived_signal_functions[function.__name__] = (function, dependencies)
+    return function
+
+def nan_reduce(reduction, values, axis):
+    with warnings.catch_warnings():
+        # Samples where every sensor is NaN are expected and yield NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return reduction(values, axis=axis)
+
+def per_layer(reduction, temperatures, layer_rows):
+    """(layers x time) reduction over the sensors of each layer, NaN for layers without sensors."""
+    return np.vstack([nan_reduce(reduction, temperatures[rows], axis=0) if rows else np.full(temperatures.shape[1], np.nan)
+                      for rows in layer_rows])
+
+@derived_signal
+def flow_m3_s(flow):
+    """Coolant flow in m^3/s (the signal is in L/min)."""
+    return flow / 60000
+
+@derived_signal
+def heat_flow(flow_m3_s, inlet, outlet):
+    """Q_HVB in W, heat taken up by the coolant."""
+    from thermal_dynamics_HVB import calculation_heat_flux
+    # calculation_heat_flux is linear in the flow and the temperature difference
+    return flow_m3_s * (outlet - inlet) * calculation_heat_flux(1.0, 0.0, 1.0)
+
+@derived_signal
+def cell_max(temperatures):
+    return nan_reduce(np.nanmax, temperatures, axis=0)
+
+@derived_signal
+def cell_min(temperatures):
+    return nan_reduce(np.nanmin, temperatures, axis=0)
+
+@derived_signal
+def cell_mean(temperatures):
+    return nan_reduce(np.nanmean, temperatures, axis=0)
+
+@derived_signal
+def cell_std(temperatures):
+    return nan_reduce(np.nanstd, temperatures, axis=0)
+
+@derived_signal
+def cell_range(cell_max, cell_min):
+    """Hottest minus coldest cell."""
+    return cell_max - cell_min
+
+@derived_signal
+def layer_mean(temperatures, layer_rows):
+    return per_layer(np.nanmean, temperatures, layer_rows)
+
+@derived_signal
+def layer_max(temperatures, layer_rows):
+    return per_layer(np.nanmax, temperatures, layer_rows)
+
+@derived_signal
+def layer_min(temperatures, layer_rows):
+    return per_layer(np.nanmin, temperatures, layer_rows)
+
+@derived_signal
+def layer_std(temperatures, layer_rows):
+    return per_layer(np.nanstd, temperatures, layer_rows)
+
+@derived_signal
+def layer_range(layer_mean):
+    """Spread between the layer mean temperatures."""
+    return nan_reduce(np.nanmax, layer_mean, axis=0) - nan_reduce(np.nanmin, layer_mean, axis=0)
+
+@derived_signal
+def sensor_max(temperatures):
+    """Highest temperature of every sensor over the run."""
+    return nan_reduce(np.nanmax, temperatures, axis=1)
+
+@derived_signal
+def dT_dt(temperatures):
+    """Temperature rate of every sensor in °C/s (central differences)."""
+    if temperatures.shape[1] < 2:
+        return np.full(temperatures.shape, np.nan)
+    return np.gradient(temperatures, sample_period_s, axis=1)
+
+@derived_signal
+def sensor_minus_inlet(temperatures, inlet):
+    """Every sensor minus the coolant inlet temperature, over the samples both have."""
+    length = min(temperatures.shape[1], len(inlet))
+    return temperatures[:, :length] - inlet[:length]
+
+@derived_signal
+def trace_pyramid(temperatures):
+    """Min/max decimation pyramid of the sensors, for drawing whole-run traces (see sensor_trace.py)."""
+    from sensor_trace import DecimationPyramid
+    return DecimationPyramid(temperatures)
+
+@derived_signal
+def coolant_pyramid(inlet, outlet):
+    """Decimation pyramid of the inlet (row 0) and outlet (row 1) temperatures."""
+    from sensor_trace import DecimationPyramid
+    return DecimationPyramid(np.vstack([inlet, outlet]))
+
+class DerivedSignals:
+    """Derived signals of one run. Each is computed over the whole run on first use and kept until an input changes.
+
+    With trim (the viewer's behaviour) all signals end with the run's shortest signal. Without it the temperatures
+    keep their length and only the coolant signals are trimmed to each other.
+    """
+
+    def __init__(self, run_data, trim=True, sensors_per_module_list=None, custom_sensor_order=None, file_id=None):
+        import thermal_dynamics_HVB as viewer
+
+        temperatures, self.sensor_identifiers, inlet, outlet, flow = run_data
+        signals = [np.asarray(signal, dtype=float) for signal in (inlet, outlet, flow)]
+        signal_length = min(len(signal) for signal in signals)
+        if trim:
+            signal_length = min(signal_length, temperatures.shape[1])
+            temperatures = temperatures[:, :signal_length]
+        inlet, outlet, flow = (signal[:signal_length] for signal in signals)
+
+        layer_rows = viewer.layer_sensor_rows(self.sensor_identifiers, sensors_per_module_list or viewer.sensors_per_module_list,
+                                              custom_sensor_order or viewer.custom_sensor_order)
+        self._values = {"temperatures": temperatures, "inlet": inlet, "outlet": outlet, "flow": flow, "layer_rows": layer_rows}
+
+        # Signals stored by precompute.py only hold for the viewer's trimming and the default layout
+        if file_id is not None and trim and sensors_per_module_list is None and custom_sensor_order is None:
+            self._values.update(load_signals(file_id, self))
+
+    @property
+    def total_frames(self):
+        return self._values["temperatures"].shape[1]
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def get(self, name):
+        """Value of a base or derived signal, computing it (and what it depends on) if needed."""
+        if name in self._values:
+            count("derived.hit")
+            return self._values[name]
+        if name not in derived_signal_functions:
+            raise KeyError(f"Unknown signal {name!r}, expected one of {base_signals + sorted(derived_signal_functions)}")
+        function, dependencies = derived_signal_functions[name]
+        arguments = [self.get(dependency) for dependency in dependencies]
+        count("derived.miss")
+        with span("derived.compute", signal=name):
+            self._values[name] = function(*arguments)
+        return self._values[name]
+
+    def dependents(self, name):
+        """Names of the derived signals computed from name, directly or indirectly."""
+        result = set()
+        for signal, (_, dependencies) in derived_signal_functions.items():
+            if name in dependencies:
+                result.add(signal)
+                result |= self.dependents(signal)
+        return result
+
+    def invalidate(self, name):
+        """Drop name (if derived) and every signal computed from it."""
+        for signal in self.dependents(name) | ({name} if name in derived_signal_functions else set()):
+            self._values.pop(signal, None)
+
+    def set_base(self, name, values):
+        """Replace one of base_signals and drop what was computed from it."""
+        if name not in base_signals:
+            raise KeyError(f"{name!r} is not a base signal, expected one of {base_signals}")
+        self._values[name] = values
+        self.invalidate(name)
+
+    @property
+    def nbytes(self):
+        """Memory held by the computed signals (the inputs belong to the run)."""
+        return sum(value.nbytes for name, value in self._values.items() if name in derived_signal_functions)
+
+def derived_cache_filename(file_id):
+    return os.path.join("data", f"derived_{file_id}.npz")
+
+def derived_cache_settings(derived):
+    return json.dumps({"version": derived_version, "shape": list(derived["temperatures"].shape),
+                       "sensors": [list(sensor_identifier) for sensor_identifier in derived.sensor_identifiers]})
+
+def save_signals(file_id, derived):
+    """Compute stored_signals and write them to data/derived_<file_id>.npz."""
+    with span("derived.save", file_id=file_id):
+        np.savez(derived_cache_filename(file_id), settings=np.array(derived_cache_settings(derived)),
+                 **{name: derived[name] for name in stored_signals})
+
+def load_signals(file_id, derived):
+    """stored_signals of the run as a dict, or an empty dict if the file is missing or older than the run's
+    extract cache or quality mask."""
+    cache_filename = derived_cache_filename(file_id)
+    sources = [os.path.join("data", f"{name}_{file_id}.{extension}") for name, extension in
+               (("temp_data", "pkl"), ("flow_data", "pkl"), ("quality", "npz"))]
+    if not os.path.exists(cache_filename) or not all(
+            os.path.getmtime(cache_filename) > os.path.getmtime(source) for source in sources if os.path.exists(source)):
+        return {}
+    with span("derived.load", file_id=file_id), np.load(cache_filename) as stored:
+        if str(stored["settings"]) != derived_cache_settings(derived):
+            return {}
+        count("derived.stored")
+        return {name: stored[name] for name in stored_signals}
+
+def signal_table(derived, names):
+    """DataFrame of the given signals over time: one column per 1-D signal, per layer or per sensor for the others."""
+    import pandas as pd
+
+    columns = {"time_s": np.arange(derived.total_frames) * sample_period_s}
+    for name in names:
+        values = derived[name]
+        if values.ndim == 1:
+            columns[name] = values
+        elif name.startswith("layer_"):
+            columns.update({f"{name}_layer{layer + 1}": row for layer, row in enumerate(values)})
+        else:
+            columns.update({f"{name}_{sensor_number}_BMS{bms_id}": row
+                            for (sensor_number, bms_id), row in zip(derived.sensor_identifiers, values)})
+    length = min(len(values) for values in columns.values())
+    return pd.DataFrame({name: values[:length] for name, values in columns.items()})
+
+if __name__ == "__main__":
+    import thermal_dynamics_HVB as viewer
+
+    config_data = viewer.load_config("config.json") or {}
+
+    parser = argparse.ArgumentParser(description="Export derived signals of a run (over time) as Parquet or CSV.")
+    parser.add_argument("--db-path", default=config_data.get("db_path", "mf4_data.db"))
+    parser.add_argument("--lookup-table-path", default=config_data.get("lookup_table_path", "db_lookup_table.parquet"))
+    parser.add_argument("--file-id", default=config_data.get("file_id", "TCP0014_Run17_01.MF4"))
+    parser.add_argument("--signals", default="cell_mean,cell_max,cell_min,cell_range,layer_range,heat_flow",
+                        help=f"Comma-separated subset of {', '.join(sorted(derived_signal_functions))}")
+    parser.add_argument("--output", default="derived_signals.parquet", help="Output file (.parquet or .csv)")
+    args = parser.parse_args()
+
+    run_data = viewer.load_run(args.db_path, args.lookup_table_path, args.file_id,
+                               quality_thresholds=config_data.get("quality_thresholds"))
+    table = signal_table(DerivedSignals(run_data, file_id=args.file_id), args.signals.split(","))
+    if args.output.endswith(".parquet"):
+        table.to_parquet(args.output, index=False)
+    else:
+        table.to_csv(args.output, index=False)
+    print(f"{len(table.columns) - 1} columns over {len(table)} samples saved to {args.output}")
@@ -0,0 +1,201 @@
+import json
+import os
+import warnings
+import numpy as np
+from instrumentation import span, count
+
+# Bump when the event definitions change, so that cached event indexes are rebuilt
+event_index_version = 1
+
+# Default thresholds of the detected events
+default_event_thresholds = {
+    "cell_range_c": 5.0,      # Hottest minus coldest cell
+    "layer_range_c": 2.0,     # Spread between the layer mean temperatures
+    "gradient_c": 3.0,        # Difference between neighbouring sensors on the cooling plate
+    "hotspot_c": 3.0,         # Single sensor above the mean of its layer
+    "rise_c_per_s": 0.2,      # Temperature rise of a single sensor, averaged over rise_window
+}
+
+# Event kinds, stored by their position in this list
+event_kinds = ["cell_range", "layer_range", "gradient", "hotspot", "fast_rise"]
+threshold_keys = {"cell_range": "cell_range_c", "layer_range": "layer_range_c", "gradient": "gradient_c",
+                  "hotspot": "hotspot_c", "fast_rise": "rise_c_per_s"}
+
+rise_window = 10      # Samples over which a fast rise is measured
+min_event_gap = 30    # A crossing after a shorter dip below the threshold belongs to the previous event
+sample_period_s = 1.0  # The viewer plots one sample per second
+
+# Samples processed at a time, bounds the temporary memory for long runs
+chunk_size = 20000
+
+event_dtype = np.dtype([("t_index", np.int32), ("kind", np.uint8), ("sensor", np.int16), ("value", np.float32)])
+
+def layer_grids(sensor_identifiers, sensors_per_module_list, custom_sensor_order):
+    """Matrix row of the sensor at each position of every layer's 4 x (4 * modules) grid, -1 where there is none."""
+    row_of = {sensor_identifier: row for row, sensor_identifier in enumerate(sensor_identifiers)}
+    grids = []
+    start_index = 0
+    for sensors_per_module in sensors_per_module_list:
+        width = 4 * sensors_per_module
+        grid = np.full((4, width), -1, dtype=np.int64)
+        for local_index, sensor in enumerate(custom_sensor_order[start_index:start_index + 4 * width]):
+            grid[local_index // width, local_index % width] = row_of.get(sensor, -1)
+        grids.append(grid)
+        start_index += 4 * width
+    return grids
+
+def neighbour_pairs(grids):
+    """(row, row) pairs of horizontally or vertically adjacent sensors."""
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    for grid in grids:
+        for first, second in ((grid[:, :-1], grid[:, 1:]), (grid[:-1, :], grid[1:, :])):
+            both = (first >= 0) & (second >= 0)
+            pairs.append(np.column_stack([first[both], second[both]]))
+    return np.vstack(pairs)
+
+def rising_edges(condition, min_gap):
+    """(row, sample) where each row of condition becomes true, ignoring dips shorter than min_gap samples."""
+    condition = np.atleast_2d(condition)
+    padded = np.zeros((condition.shape[0], condition.shape[1] + 2), dtype=bool)
+    padded[:, 1:-1] = condition
+    change = np.diff(padded.view(np.int8), axis=1)
+    rise_rows, rise_samples = np.nonzero(change == 1)
+    _, fall_samples = np.nonzero(change == -1)
+
+    # Rises and falls alternate within a row, so the fall before rise k is fall k - 1
+    keep = np.ones(len(rise_rows), dtype=bool)
+    keep[1:] = (rise_rows[1:] != rise_rows[:-1]) | (rise_samples[1:] - fall_samples[:-1] >= min_gap)
+    return rise_rows[keep], rise_samples[keep]
+
+def make_events(kind, t_indices, sensors, values):
+    events = np.empty(len(t_indices), dtype=event_dtype)
+    events["t_index"] = t_indices
+    events["kind"] = event_kinds.index(kind)
+    events["sensor"] = sensors
+    events["value"] = values
+    return events
+
+def detect_events(temperatures, sensor_identifiers, sensors_per_module_list, custom_sensor_order, thresholds=None):
+    """All threshold crossings of a (sensor x time) matrix, sorted by sample index.
+
+    Pack events (cell range, layer range, neighbour gradient) have sensor -1, sensor events (hotspot, fast rise)
+    the row of the sensor in the matrix.
+    """
+    thresholds = dict(default_event_thresholds, **(thresholds or {}))
+    n_sensors, n_samples = temperatures.shape
+    grids = layer_grids(sensor_identifiers, sensors_per_module_list, custom_sensor_order)
+    layers = [grid[grid >= 0] for grid in grids]
+    pairs = neighbour_pairs(grids)
+    layer_of = np.full(n_sensors, -1)
+    for layer, rows in enumerate(layers):
+        layer_of[rows] = layer
+    in_layer = layer_of >= 0
+
+    cell_range = np.full(n_samples, np.nan)
+    layer_range = np.full(n_samples, np.nan)
+    gradient = np.full(n_samples, np.nan)
+    layer_means = np.full((len(layers), n_samples), np.nan)
+    hotspot = np.zeros((n_sensors, n_samples), dtype=bool)
+    fast_rise = np.zeros((n_sensors, n_samples), dtype=bool)
+
+    with warnings.catch_warnings():
+        # Samples where every sensor is NaN are expected and yield NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for start in range(0, n_samples, chunk_size):
+            stop = min(start + chunk_size, n_samples)
+            block = temperatures[:, start:stop]
+            cell_range[start:stop] = np.nanmax(block, axis=0) - np.nanmin(block, axis=0)
+            for layer, rows in enumerate(layers):
+                if len(rows):
+                    layer_means[layer, start:stop] = np.nanmean(block[rows], axis=0)
+            if layers:
+                layer_range[start:stop] = np.nanmax(layer_means[:, start:stop], axis=0) - np.nanmin(layer_means[:, start:stop], axis=0)
+            if len(pairs):
+                gradient[start:stop] = np.nanmax(np.abs(block[pairs[:, 0]] - block[pairs[:, 1]]), axis=0)
+
+            hotspot[in_layer, start:stop] = block[in_layer] - layer_means[layer_of[in_layer], start:stop] > thresholds["hotspot_c"]
+
+            rise_start = max(start, rise_window)
+            if rise_start < stop:
+                rise = temperatures[:, rise_start:stop] - temperatures[:, rise_start - rise_window:stop - rise_window]
+                fast_rise[:, rise_start:stop] = rise / (rise_window * sample_period_s) > thresholds["rise_c_per_s"]
+
+    events = []
+    for kind, metric in (("cell_range", cell_range), ("layer_range", layer_range), ("gradient", gradient)):
+        _, t_indices = rising_edges(metric > thresholds[threshold_keys[kind]], min_event_gap)
+        events.append(make_events(kind, t_indices, -1, metric[t_indices]))
+
+    rows, t_indices = rising_edges(hotspot, min_event_gap)
+    events.append(make_events("hotspot", t_indices, rows, temperatures[rows, t_indices] - layer_means[layer_of[rows], t_indices]))
+
+    rows, t_indices = rising_edges(fast_rise, min_event_gap)
+    rise = (temperatures[rows, t_indices] - temperatures[rows, t_indices - rise_window]) / (rise_window * sample_period_s)
+    events.append(make_events("fast_rise", t_indices, rows, rise))
+
+    events = np.concatenate(events)
+    events.sort(order=["t_index", "kind", "sensor"])
+    return events
+
+class EventIndex:
+    """Events of one run sorted by sample index; next/previous lookups are binary searches."""
+
+    def __init__(self, events, sensor_identifiers):
+        self.events = events
+        self.sensor_identifiers = sensor_identifiers
+
+    def __len__(self):
+        return len(self.events)
+
+    def truncate(self, total_frames):
+        """Index without the events at or after total_frames."""
+        return EventIndex(self.events[self.events["t_index"] < total_frames], self.sensor_identifiers)
+
+    def next_event(self, t_index):
+        """Position of the first event after t_index, or None."""
+        position = int(np.searchsorted(self.events["t_index"], t_index, side="right"))
+        return position if position < len(self.events) else None
+
+    def previous_event(self, t_index):
+        """Position of the last event before t_index, or None."""
+        position = int(np.searchsorted(self.events["t_index"], t_index, side="left")) - 1
+        return position if position >= 0 else None
+
+    def describe(self, position):
+        event = self.events[position]
+        kind = event_kinds[event["kind"]]
+        text = f"Event {position + 1}/{len(self.events)} at {event['t_index']} s: {kind.replace('_', ' ')}"
+        if event["sensor"] >= 0:
+            sensor_number, bms_id = self.sensor_identifiers[event["sensor"]]
+            text += f" (Sensor {sensor_number}, BMS {bms_id})"
+        unit = "°C/s" if kind == "fast_rise" else "°C"
+        return f"{text} {event['value']:.2f} {unit}"
+
+def event_cache_filename(file_id):
+    return os.path.join("data", f"events_{file_id}.npz")
+
+def load_event_index(file_id, temperatures, sensor_identifiers, sensors_per_module_list, custom_sensor_order, thresholds=None, force_refresh=False):
+    """Event index of a run, read from data/events_<file_id>.npz while it is newer than the run's temperature cache
+    and quality mask."""
+    thresholds = dict(default_event_thresholds, **(thresholds or {}))
+    settings = json.dumps({"version": event_index_version, "thresholds": thresholds,
+                           "rise_window": rise_window, "min_event_gap": min_event_gap}, sort_keys=True)
+    cache_filename = event_cache_filename(file_id)
+    temp_cache_filename = os.path.join("data", f"temp_data_{file_id}.pkl")
+    has_temp_cache = file_id is not None and os.path.exists(temp_cache_filename)
+    # Masked samples are NaN in the temperatures, so a new quality mask also invalidates the events
+    quality_filename = os.path.join("data", f"quality_{file_id}.npz")
+    source_filenames = [filename for filename in (temp_cache_filename, quality_filename) if os.path.exists(filename)]
+
+    if (not force_refresh and has_temp_cache and os.path.exists(cache_filename)
+            and all(os.path.getmtime(cache_filename) > os.path.getmtime(filename) for filename in source_filenames)):
+        with span("events.load"), np.load(cache_filename) as stored:
+            if str(stored["settings"]) == settings:
+                count("events.cache.hit")
+                return EventIndex(stored["events"], sensor_identifiers)
+
+    count("events.cache.miss")
+    with span("events.detect", samples=temperatures.shape[1]):
+        events = detect_events(temperatures, sensor_identifiers, sensors_per_module_list, custom_sensor_order, thresholds)
+    if has_temp_cache:
+        np.savez(cache_filename, events=events, settings=np.array(settings))
+    return EventIndex(events, sensor_identifiers)
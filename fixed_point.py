@@ -0,0 +1,88 @@
+import os
+import zlib
+import numpy as np
+from instrumentation import count
+
+# Temperatures are stored in steps of 0.01 °C as int16, which covers -327.67 to +327.67 °C
+codes_per_unit = 100
+nan_code = np.iinfo(np.int16).min
+max_code = np.iinfo(np.int16).max
+
+# Encodings of the extract cache:
+#   none              float64, as returned by the extract functions
+#   int16             fixed-point, 2 bytes per sample
+#   int16-delta-zlib  fixed-point, differences along time, zlib compressed
+cache_codecs = ["none", "int16", "int16-delta-zlib"]
+default_cache_codec = "none"
+
+# Kept in the environment, so that worker processes of the batch tools use the same encoding
+cache_codec_variable = "BAT_TEMP_CACHE_CODEC"
+
+def set_cache_codec(codec):
+    if codec not in cache_codecs:
+        raise ValueError(f"Unknown cache codec {codec!r}, expected one of {cache_codecs}")
+    os.environ[cache_codec_variable] = codec
+
+def get_cache_codec():
+    return os.environ.get(cache_codec_variable, default_cache_codec)
+
+class EncodedArray:
+    """Fixed-point copy of a float array. It unpickles directly to the decoded float64 array."""
+
+    def __init__(self, payload, shape, delta, compressed):
+        self.payload = payload
+        self.shape = shape
+        self.delta = delta
+        self.compressed = compressed
+
+    def __reduce__(self):
+        return decode, (self.payload, self.shape, self.delta, self.compressed)
+
+def encode(values, delta=False, compress=False):
+    """Encode a float array (NaN allowed); raises ValueError if a value is infinite or out of the int16 range."""
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    scaled = np.rint(values * codes_per_unit)
+    scaled[missing] = 0
+    if not np.all(np.abs(scaled) <= max_code):
+        raise ValueError("Values are infinite or outside the fixed-point range")
+    codes = scaled.astype(np.int16)
+    codes[missing] = nan_code
+
+    if delta:
+        # The differences wrap around in int16 and the cumulative sum in decode() wraps back, so this is exact
+        codes[..., 1:] = np.diff(codes, axis=-1)
+    payload = np.ascontiguousarray(codes).tobytes()
+    if compress:
+        payload = zlib.compress(payload, 6)
+    return EncodedArray(payload, codes.shape, delta, compress)
+
+def decode(payload, shape, delta=False, compressed=False):
+    if compressed:
+        payload = zlib.decompress(payload)
+    codes = np.frombuffer(payload, dtype=np.int16).reshape(shape)
+    if delta:
+        codes = np.cumsum(codes, axis=-1, dtype=np.int16)
+    values = np.divide(codes, codes_per_unit, dtype=np.float64)
+    values[codes == nan_code] = np.nan
+    return values
+
+def pack(data, codec=None):
+    """Replace the float arrays in the (nested) tuple or list data by their encoded form, for pickling.
+
+    Arrays that do not fit the fixed-point range are kept as they are.
+    """
+    codec = codec or get_cache_codec()
+    if codec == "none":
+        return data
+    if isinstance(data, (tuple, list)):
+        return type(data)(pack(item, codec) for item in data)
+    if isinstance(data, np.ndarray) and data.dtype.kind == "f" and data.size > 0:
+        try:
+            encoded = encode(data, delta=codec == "int16-delta-zlib", compress=codec == "int16-delta-zlib")
+        except ValueError:
+            count("cache.codec_fallback")
+            return data
+        count("cache.codec_encoded")
+        return encoded
+    return data
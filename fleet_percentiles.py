@@ -0,0 +1,236 @@
+import argparse
+import os
+import numpy as np
+import thermal_dynamics_HVB as viewer
+from data_fingerprint import current_fingerprints
+from incremental import compute_in_pool
+from run_index import load_file_ids
+
+# Histogram range and resolution: the sensors resolve about 0.1 °C within -40...+120 °C
+hist_min_c = -40.0
+hist_max_c = 120.0
+bin_width_c = 0.05
+
+default_percentiles = [5, 50, 95, 99]
+
+# Columns of the temperature matrix processed at a time, bounds the temporary memory per run
+chunk_size = 20000
+
+class SensorHistogramSketch:
+    """Per-sensor fixed-bin temperature histograms plus exact count/min/max/sum.
+
+    Sketches of different runs or workers are merged by adding them, the memory is fixed by the number of sensors.
+    A run cannot be taken out again, so run_fingerprints records what each run looked like when it was added.
+    """
+
+    def __init__(self):
+        self.n_bins = int(round((hist_max_c - hist_min_c) / bin_width_c))
+        self.sensor_identifiers = []
+        self._rows = {}
+        self.counts = np.zeros((0, self.n_bins), dtype=np.int64)
+        self.minimum = np.zeros(0)
+        self.maximum = np.zeros(0)
+        self.total = np.zeros(0)
+        self.runs = []
+        self.run_fingerprints = {}
+
+    def rows_for(self, sensor_identifiers):
+        """Row of each sensor in the sketch, adding rows for sensors not seen yet."""
+        new_sensors = [sensor for sensor in sensor_identifiers if sensor not in self._rows]
+        if new_sensors:
+            for sensor in new_sensors:
+                self._rows[sensor] = len(self.sensor_identifiers)
+                self.sensor_identifiers.append(sensor)
+            self.counts = np.vstack([self.counts, np.zeros((len(new_sensors), self.n_bins), dtype=np.int64)])
+            self.minimum = np.concatenate([self.minimum, np.full(len(new_sensors), np.inf)])
+            self.maximum = np.concatenate([self.maximum, np.full(len(new_sensors), -np.inf)])
+            self.total = np.concatenate([self.total, np.zeros(len(new_sensors))])
+        return np.array([self._rows[sensor] for sensor in sensor_identifiers], dtype=np.int64)
+
+    def add(self, temperatures, sensor_identifiers):
+        """Add a (sensor x time) temperature matrix, chunk by chunk along the time axis."""
+        rows = self.rows_for(sensor_identifiers)
+        for start in range(0, temperatures.shape[1], chunk_size):
+            block = temperatures[:, start:start + chunk_size]
+            valid = np.isfinite(block)
+            bins = np.clip(((block - hist_min_c) / bin_width_c).astype(np.int64, copy=False), 0, self.n_bins - 1)
+            flat_index = (rows[:, None] * self.n_bins + bins)[valid]
+            self.counts += np.bincount(flat_index, minlength=self.counts.size).reshape(self.counts.shape)
+
+            with np.errstate(invalid="ignore"):
+                block_min = np.where(valid, block, np.inf).min(axis=1)
+                block_max = np.where(valid, block, -np.inf).max(axis=1)
+            self.minimum[rows] = np.minimum(self.minimum[rows], block_min)
+            self.maximum[rows] = np.maximum(self.maximum[rows], block_max)
+            self.total[rows] += np.where(valid, block, 0.0).sum(axis=1)
+
+    def merge(self, other):
+        """Add another sketch into this one."""
+        rows = self.rows_for(other.sensor_identifiers)
+        self.counts[rows] += other.counts
+        self.minimum[rows] = np.minimum(self.minimum[rows], other.minimum)
+        self.maximum[rows] = np.maximum(self.maximum[rows], other.maximum)
+        self.total[rows] += other.total
+        self.runs.extend(run for run in other.runs if run not in self.runs)
+        self.run_fingerprints.update(other.run_fingerprints)
+        return self
+
+    def sample_counts(self):
+        return self.counts.sum(axis=1)
+
+    def percentiles(self, percentiles):
+        """(sensor x percentile) matrix, linearly interpolated within the histogram bins."""
+        n = self.sample_counts()
+        cumulative = np.cumsum(self.counts, axis=1)
+        result = np.full((len(self.sensor_identifiers), len(percentiles)), np.nan)
+        for column, q in enumerate(percentiles):
+            target = q / 100.0 * n
+            bin_index = np.argmax(cumulative >= np.maximum(target, 1)[:, None], axis=1)
+            rows = np.arange(len(bin_index))
+            before = cumulative[rows, bin_index] - self.counts[rows, bin_index]
+            in_bin = np.maximum(self.counts[rows, bin_index], 1)
+            values = hist_min_c + (bin_index + np.clip((target - before) / in_bin, 0, 1)) * bin_width_c
+            # The edge bins also hold the clipped out-of-range values, the exact extremes bound the result
+            values = np.clip(values, self.minimum, self.maximum)
+            result[:, column] = np.where(n > 0, values, np.nan)
+        return result
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            counts=self.counts,
+            minimum=self.minimum,
+            maximum=self.maximum,
+            total=self.total,
+            sensor_numbers=np.array([sensor for sensor, _ in self.sensor_identifiers], dtype=np.int64),
+            bms_ids=np.array([str(bms_id) for _, bms_id in self.sensor_identifiers]),
+            runs=np.array(self.runs, dtype=str),
+            run_fingerprints=np.array([self.run_fingerprints.get(run, "") for run in self.runs], dtype=str),
+            bins=np.array([hist_min_c, hist_max_c, bin_width_c]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        sketch = cls()
+        with np.load(path) as stored:
+            if not np.allclose(stored["bins"], [hist_min_c, hist_max_c, bin_width_c]):
+                raise ValueError(f"{path} was written with different histogram bins")
+            sensor_identifiers = list(zip(stored["sensor_numbers"].tolist(), stored["bms_ids"].tolist()))
+            sketch.rows_for(sensor_identifiers)
+            sketch.counts[:] = stored["counts"]
+            sketch.minimum[:] = stored["minimum"]
+            sketch.maximum[:] = stored["maximum"]
+            sketch.total[:] = stored["total"]
+            sketch.runs = stored["runs"].tolist()
+            # Sketches written without fingerprints have none, so all their runs count as changed
+            if "run_fingerprints" in stored:
+                sketch.run_fingerprints = dict(zip(sketch.runs, stored["run_fingerprints"].tolist()))
+        return sketch
+
+def sketch_runs(db_path, lookup_table_path, fingerprints, quality_thresholds=None):
+    """Worker: sketch a batch of runs ({file_id: fingerprint}), one run in memory at a time."""
+    sketch = SensorHistogramSketch()
+    for file_id, fingerprint in fingerprints.items():
+        temperatures, sensor_identifiers, _, _, _ = viewer.load_run(db_path, lookup_table_path, file_id, quality_thresholds=quality_thresholds)
+        if len(temperatures) > 0:
+            sketch.add(temperatures, sensor_identifiers)
+        sketch.runs.append(file_id)
+        sketch.run_fingerprints[file_id] = fingerprint
+    return sketch
+
+def build_fleet_sketch(db_path, lookup_table_path, sketch_path=None, workers=None, runs_per_task=4, quality_thresholds=None):
+    """Sketch all runs of the lookup table in parallel. Runs already in the stored sketch are not read again.
+
+    Histograms can only be added to, so if a run in the stored sketch changed or was removed, the sketch is
+    rebuilt from all runs rather than keeping a histogram per run.
+    """
+    fingerprints = current_fingerprints(db_path, lookup_table_path, load_file_ids(lookup_table_path), quality=quality_thresholds)
+
+    sketch = SensorHistogramSketch()
+    if sketch_path and os.path.exists(sketch_path):
+        sketch = SensorHistogramSketch.load(sketch_path)
+        changed = [run for run in sketch.runs if sketch.run_fingerprints.get(run) != fingerprints.get(run)]
+        if changed:
+            print(f"{len(changed)} runs in the sketch changed or were removed, rebuilding it.")
+            sketch = SensorHistogramSketch()
+
+    todo = {file_id: fingerprint for file_id, fingerprint in fingerprints.items() if file_id not in sketch.runs}
+    print(f"{len(sketch.runs)} runs already in the sketch, {len(todo)} to add.")
+
+    file_ids = list(todo)
+    # One task per batch of runs, named after its runs in the progress output
+    tasks = {}
+    for start in range(0, len(file_ids), runs_per_task):
+        batch = {file_id: todo[file_id] for file_id in file_ids[start:start + runs_per_task]}
+        tasks[", ".join(batch)] = (db_path, lookup_table_path, batch, quality_thresholds)
+    for batch_sketch in compute_in_pool(sketch_runs, tasks, workers, span_name="percentiles.sketch", action="sketching").values():
+        sketch.merge(batch_sketch)
+
+    if sketch_path:
+        sketch.save(sketch_path)
+    return sketch
+
+def percentile_table(sketch, percentiles=default_percentiles):
+    import pandas as pd
+
+    values = sketch.percentiles(percentiles)
+    n = sketch.sample_counts()
+    table = pd.DataFrame({
+        "SensorNumber": [sensor for sensor, _ in sketch.sensor_identifiers],
+        "BMS_ID": [bms_id for _, bms_id in sketch.sensor_identifiers],
+        "count": n,
+        "min": np.where(n > 0, sketch.minimum, np.nan),
+        "mean": np.where(n > 0, sketch.total / np.maximum(n, 1), np.nan),
+        "max": np.where(n > 0, sketch.maximum, np.nan),
+    })
+    for column, q in enumerate(percentiles):
+        table[f"p{q}"] = values[:, column]
+    return table.sort_values(["BMS_ID", "SensorNumber"]).reset_index(drop=True)
+
+def plot_percentile_heatmap(sketch, percentile, vmin, vmax, output_path=None):
+    """Render one percentile per sensor in the battery layout, like a single frame of the viewer."""
+    import matplotlib.pyplot as plt
+
+    data = sketch.percentiles([percentile])  # (sensor x 1), column 0 is the "frame"
+    fig, axes = plt.subplots(2, 3, figsize=(15, 8))
+    axes = axes.flatten()
+    heatmap = viewer.plot_battery_layout(
+        data, sketch.sensor_identifiers, viewer.sensors_per_module_list, viewer.strings_count,
+        0, 1, axes, [None], viewer.custom_sensor_order, vmin=vmin, vmax=vmax, fig=fig)
+    fig.suptitle(f"p{percentile} temperature per sensor over {len(sketch.runs)} runs", fontsize=14)
+    colorbar = fig.colorbar(heatmap, ax=axes.tolist(), shrink=0.6)
+    colorbar.set_label(f"p{percentile} Temperature [°C]", fontsize=12)
+
+    if output_path:
+        fig.savefig(output_path, dpi=150)
+        print(f"Heatmap saved to {output_path}")
+    else:
+        plt.show()
+
+if __name__ == "__main__":
+    config_data = viewer.load_config("config.json") or {}
+
+    parser = argparse.ArgumentParser(description="Per-sensor temperature percentiles across all runs.")
+    parser.add_argument("--db-path", default=config_data.get("db_path", "mf4_data.db"))
+    parser.add_argument("--lookup-table-path", default=config_data.get("lookup_table_path", "db_lookup_table.parquet"))
+    parser.add_argument("--sketch", default=os.path.join("data", "fleet_sketch.npz"),
+                        help="Stored histograms; unchanged runs already in it are not read again")
+    parser.add_argument("--output", default="sensor_percentiles.parquet", help="Percentile table (.parquet or .csv)")
+    parser.add_argument("--percentiles", default=",".join(str(q) for q in default_percentiles))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--plot", type=float, default=None, help="Render this percentile as a battery layout heatmap")
+    parser.add_argument("--plot-output", default=None, help="Save the heatmap to this file instead of showing it")
+    args = parser.parse_args()
+
+    sketch = build_fleet_sketch(args.db_path, args.lookup_table_path, sketch_path=args.sketch, workers=args.workers,
+                                quality_thresholds=config_data.get("quality_thresholds"))
+    table = percentile_table(sketch, [float(q) if "." in q else int(q) for q in args.percentiles.split(",")])
+    if args.output.endswith(".parquet"):
+        table.to_parquet(args.output, index=False)
+    else:
+        table.to_csv(args.output, index=False)
+    print(f"Percentiles of {len(table)} sensors over {len(sketch.runs)} runs saved to {args.output}")
+
+    if args.plot is not None:
+        percentile = int(args.plot) if float(args.plot).is_integer() else args.plot
+        plot_percentile_heatmap(sketch, percentile, config_data.get("vmin", 15.0), config_data.get("vmax", 40.0), args.plot_output)
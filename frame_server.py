@@ -0,0 +1,292 @@
+import argparse
+import functools
+import io
+import json
+import os
+import re
+import threading
+import warnings
+from collections import OrderedDict, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+import numpy as np
+import thermal_dynamics_HVB as viewer
+from derived_signals import DerivedSignals
+from event_index import layer_grids
+from instrumentation import span, count
+from run_cache import RunCache
+from run_index import load_file_ids
+
+default_port = 8050
+
+# Rendered PNG frames kept in memory
+png_cache_size = 256
+
+# Largest number of frames returned by one time-window request
+max_window_frames = 3600
+
+# A run prepared for serving: the trimmed extract plus the per-layer sensor grids and per-sample series
+ServedRun = namedtuple("ServedRun", "temperatures sensor_identifiers inlet outlet flow grids series")
+
+index_page = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Battery Temperature Frames</title></head>
+<body style="font-family: sans-serif">
+<select id="run"></select> <input id="t" type="range" min="0" value="0" style="width: 50%"> <span id="label"></span>
+<div><img id="frame"></div><pre id="stats"></pre>
+<script>
+const run = document.getElementById("run"), t = document.getElementById("t");
+function show() {
+  const base = "/runs/" + encodeURIComponent(run.value) + "/frames/" + t.value;
+  document.getElementById("label").textContent = t.value + " s";
+  document.getElementById("frame").src = base + ".png";
+  fetch(base).then(r => r.json()).then(f => document.getElementById("stats").textContent = JSON.stringify(f.stats, null, 1));
+}
+function load() {
+  fetch("/runs/" + encodeURIComponent(run.value)).then(r => r.json()).then(info => { t.max = info.frames - 1; t.value = 0; show(); });
+}
+fetch("/runs").then(r => r.json()).then(runs => {
+  runs.forEach(id => run.add(new Option(id, id)));
+  load();
+});
+run.onchange = load;
+t.onchange = show;
+</script></body></html>
+"""
+
+def to_json_list(values, decimals=3):
+    """Array as nested lists with NaN as null, which the JSON spec does not allow as a number."""
+    values = np.asarray(np.round(np.asarray(values, dtype=float), decimals))
+    result = values.astype(object)
+    result[np.isnan(values)] = None
+    return result.tolist()
+
+# Per-sample series served with every frame: name in the response -> derived signal
+series_signals = {"inlet": "inlet", "outlet": "outlet", "flow": "flow", "heat_flow": "heat_flow", "mean": "cell_mean",
+                  "max": "cell_max", "min": "cell_min", "std": "cell_std", "layer_range": "layer_range", "cell_range": "cell_range"}
+
+def prepare_run(db_path, lookup_table_path, file_id, quality_thresholds=None):
+    """Load a run and compute what every frame request needs, so that a frame is only indexing."""
+    temperatures, sensor_identifiers, inlet, outlet, flow = viewer.load_run(
+        db_path, lookup_table_path, file_id, quality_thresholds=quality_thresholds)
+    if len(temperatures) == 0:
+        raise KeyError(file_id)
+
+    # Trimmed to the shortest signal, like the viewer, and computed by the same derived signals
+    derived = DerivedSignals((temperatures, sensor_identifiers, inlet, outlet, flow), file_id=file_id)
+    temperatures, inlet, outlet, flow = (derived[name] for name in ("temperatures", "inlet", "outlet", "flow"))
+    grids = layer_grids(sensor_identifiers, viewer.sensors_per_module_list, viewer.custom_sensor_order)
+    series = {name: derived[signal] for name, signal in series_signals.items()}
+    return ServedRun(temperatures, sensor_identifiers, inlet, outlet, flow, grids, series)
+
+class FrameServer:
+    """Run list, frame grids, statistics and rendered frames of the runs in the lookup table."""
+
+    def __init__(self, db_path, lookup_table_path, vmin=15.0, vmax=40.0, run_cache_mb=1024, quality_thresholds=None):
+        self.lookup_table_path = lookup_table_path
+        self.vmin = vmin
+        self.vmax = vmax
+        self.run_cache = RunCache(functools.partial(prepare_run, db_path, lookup_table_path, quality_thresholds=quality_thresholds),
+                                  memory_budget_mb=run_cache_mb)
+        self._png_cache = OrderedDict()
+        self._png_lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self._figure = None
+        self._run_ids = []
+        self._run_id_set = set()
+        self._lookup_mtime = None
+        self._run_ids_lock = threading.Lock()
+
+    def run_ids(self):
+        """Runs of the lookup table, read again only when the table was rewritten (e.g. by precompute.py)."""
+        mtime = os.path.getmtime(self.lookup_table_path)
+        with self._run_ids_lock:
+            if mtime != self._lookup_mtime:
+                self._run_ids = load_file_ids(self.lookup_table_path)
+                self._run_id_set = set(self._run_ids)
+                self._lookup_mtime = mtime
+            return self._run_ids
+
+    def run(self, file_id):
+        self.run_ids()
+        if file_id not in self._run_id_set:
+            raise KeyError(file_id)
+        return self.run_cache.get(file_id)
+
+    def run_info(self, file_id):
+        run = self.run(file_id)
+        return {
+            "file_id": file_id,
+            "frames": int(run.temperatures.shape[1]),
+            "sensors": [[int(sensor_number), bms_id] for sensor_number, bms_id in run.sensor_identifiers],
+            "layers": len(run.grids),
+            "vmin": self.vmin,
+            "vmax": self.vmax,
+        }
+
+    def frame(self, file_id, t_index):
+        """Layer grids (4 x 4 * modules, in the viewer's layout) and statistics of one frame."""
+        run = self.run(file_id)
+        column = run.temperatures[:, t_index]
+        layers = []
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            for grid in run.grids:
+                values = np.where(grid >= 0, column[grid], np.nan)
+                layers.append({
+                    "grid": to_json_list(values),
+                    "mean": to_json_list(np.nanmean(values)),
+                    "max": to_json_list(np.nanmax(values)),
+                    "min": to_json_list(np.nanmin(values)),
+                    "range": to_json_list(np.nanmax(values) - np.nanmin(values)),
+                    "std": to_json_list(np.nanstd(values)),
+                })
+        stats = {name: to_json_list(values[t_index]) for name, values in run.series.items()}
+        return {"file_id": file_id, "t_index": t_index, "layers": layers, "stats": stats}
+
+    def window(self, file_id, start, end, step=1, grids=False):
+        """Per-sample statistics (and optionally the layer grids) of the frames start, start + step, ... < end."""
+        run = self.run(file_id)
+        indices = np.arange(max(start, 0), min(end, run.temperatures.shape[1]), max(step, 1))
+        if len(indices) > max_window_frames:
+            raise ValueError(f"At most {max_window_frames} frames per request, use a larger step")
+        result = {"file_id": file_id, "t_index": indices.tolist(),
+                  "stats": {name: to_json_list(values[indices]) for name, values in run.series.items()}}
+        if grids:
+            # (layer, frame, row, column) in one fancy-indexing step per layer
+            result["grids"] = [to_json_list(np.where((grid >= 0)[..., None], run.temperatures[grid][..., indices], np.nan).transpose(2, 0, 1))
+                               for grid in run.grids]
+        return result
+
+    def frame_png(self, file_id, t_index):
+        key = (file_id, t_index)
+        with self._png_lock:
+            if key in self._png_cache:
+                self._png_cache.move_to_end(key)
+                count("server.png.hit")
+                return self._png_cache[key]
+        count("server.png.miss")
+        run = self.run(file_id)
+        png = self.render(run, file_id, t_index)
+        with self._png_lock:
+            self._png_cache[key] = png
+            while len(self._png_cache) > png_cache_size:
+                self._png_cache.popitem(last=False)
+        return png
+
+    def render(self, run, file_id, t_index):
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        # One figure is reused for all requests; matplotlib is not thread-safe, so rendering is serialized
+        with self._render_lock, span("server.render", file_id=file_id):
+            if self._figure is None:
+                fig, axes = plt.subplots(2, 3, figsize=(15, 8))
+                self._figure = (fig, axes.flatten(), [None])
+            fig, axes, cbar_list = self._figure
+            heatmap = viewer.plot_battery_layout(
+                run.temperatures, run.sensor_identifiers, viewer.sensors_per_module_list, viewer.strings_count,
+                t_index, run.temperatures.shape[1], axes, cbar_list, viewer.custom_sensor_order,
+                vmin=self.vmin, vmax=self.vmax, fig=fig)
+            fig.suptitle(f"{file_id}  t = {t_index} s", fontsize=14)
+            if cbar_list[0] is None:
+                colorbar = fig.colorbar(heatmap, ax=axes.tolist(), shrink=0.6)
+                colorbar.set_label("Temperature [°C]", fontsize=12)
+                cbar_list[0] = True
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format="png", dpi=80)
+        return buffer.getvalue()
+
+class FrameRequestHandler(BaseHTTPRequestHandler):
+    routes = [
+        (re.compile(r"^/$"), "index"),
+        (re.compile(r"^/runs$"), "runs"),
+        (re.compile(r"^/runs/(?P<file_id>[^/]+)$"), "run_info"),
+        (re.compile(r"^/runs/(?P<file_id>[^/]+)/frames/(?P<t_index>\d+)\.png$"), "frame_png"),
+        (re.compile(r"^/runs/(?P<file_id>[^/]+)/frames/(?P<t_index>\d+)$"), "frame"),
+        (re.compile(r"^/runs/(?P<file_id>[^/]+)/window$"), "window"),
+    ]
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        for route, name in self.routes:
+            match = route.match(url.path)
+            if match:
+                break
+        else:
+            return self.send_json({"error": f"Not found: {url.path}"}, status=404)
+
+        frame_server = self.server.frame_server
+        arguments = {key: unquote(value) for key, value in match.groupdict().items()}
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            with span("server.request", route=name):
+                if name == "index":
+                    return self.send_body(index_page.encode(), "text/html; charset=utf-8")
+                if name == "runs":
+                    return self.send_json(frame_server.run_ids())
+                if name == "run_info":
+                    return self.send_json(frame_server.run_info(arguments["file_id"]))
+
+                t_index = int(arguments.get("t_index", 0))
+                if name in ("frame", "frame_png"):
+                    frames = frame_server.run(arguments["file_id"]).temperatures.shape[1]
+                    if t_index >= frames:
+                        return self.send_json({"error": f"Frame {t_index} out of range (0-{frames - 1})"}, status=404)
+                if name == "frame":
+                    return self.send_json(frame_server.frame(arguments["file_id"], t_index))
+                if name == "frame_png":
+                    return self.send_body(frame_server.frame_png(arguments["file_id"], t_index), "image/png")
+                return self.send_json(frame_server.window(
+                    arguments["file_id"], int(query.get("start", 0)), int(query.get("end", max_window_frames)),
+                    int(query.get("step", 1)), grids=query.get("grids", "0") == "1"))
+        except KeyError as e:
+            self.send_json({"error": f"Unknown run: {e.args[0]}"}, status=404)
+        except ValueError as e:
+            self.send_json({"error": str(e)}, status=400)
+        except Exception as e:
+            print(f"Error serving {url.path}: {e}")
+            self.send_json({"error": str(e)}, status=500)
+
+    def send_json(self, payload, status=200):
+        self.send_body(json.dumps(payload).encode(), "application/json", status)
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests are counted in the trace instead of printed
+        count("server.requests")
+
+def make_server(frame_server, port=default_port):
+    """HTTP server bound to localhost only; port 0 picks a free port."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FrameRequestHandler)
+    server.daemon_threads = True
+    server.frame_server = frame_server
+    return server
+
+if __name__ == "__main__":
+    config_data = viewer.load_config("config.json") or {}
+
+    parser = argparse.ArgumentParser(description="Serve runs, frames and statistics over HTTP on localhost.")
+    parser.add_argument("--db-path", default=config_data.get("db_path", "mf4_data.db"))
+    parser.add_argument("--lookup-table-path", default=config_data.get("lookup_table_path", "db_lookup_table.parquet"))
+    parser.add_argument("--port", type=int, default=default_port)
+    args = parser.parse_args()
+
+    frame_server = FrameServer(args.db_path, args.lookup_table_path, config_data.get("vmin", 15.0), config_data.get("vmax", 40.0),
+                               run_cache_mb=config_data.get("run_cache_mb", 1024),
+                               quality_thresholds=config_data.get("quality_thresholds"))
+    server = make_server(frame_server, args.port)
+    print(f"Serving on http://127.0.0.1:{server.server_address[1]}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        frame_server.run_cache.shutdown()
@@ -1,22 +1,135 @@
 from asammdf import MDF
+import argparse
 import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Stage timings (BAT_TEMP_TRACE=1) come from the shared instrumentation module in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import span
+from generate_lookup_table import pattern
+
+# Spalten des Inventars, eine Zeile pro Kanal und Datei
+inventory_columns = [
+    "file_id", "file_path", "file_size", "file_mtime", "start_time", "group_index", "table_name", "group_comment",
+    "channel_name", "is_master", "source", "unit", "samples", "t_start", "t_end", "duration_s", "error",
+]
+
+def find_mf4_files(directory):
+    # Wie database_importer.find_mf4_files, aber unabhängig von der Groß-/Kleinschreibung der Endung
+    file_paths = []
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file.lower().endswith(".mf4"):
+                file_paths.append(os.path.join(root, file))
+    return sorted(file_paths)
+
+def scan_mf4_file(mf4_file):
+    """Inventory rows of one MF4 file, read from the block headers only.
+
+    Of the sample data only the first and last master value of every group is read, for the time span.
+    """
+    stat = os.stat(mf4_file)
+    file_info = {"file_id": os.path.basename(mf4_file), "file_path": os.path.abspath(mf4_file),
+                 "file_size": stat.st_size, "file_mtime": stat.st_mtime}
+    rows = []
+    try:
+        with span("inventory.file", file=file_info["file_id"]), MDF(mf4_file) as mdf:
+            start_time = mdf.header.start_time.isoformat()
+            for group_index, group in enumerate(mdf.groups):
+                samples = group.channel_group.cycles_nr
+                t_start = t_end = None
+                if samples:
+                    t_start = float(mdf.get_master(group_index, record_offset=0, record_count=1)[0])
+                    t_end = float(mdf.get_master(group_index, record_offset=samples - 1, record_count=1)[0])
+                master_index = mdf.masters_db.get(group_index)
+                acquisition_source = group.channel_group.acq_source
+
+                for channel_index, channel in enumerate(group.channels):
+                    source = channel.source or acquisition_source
+                    rows.append(dict(
+                        file_info,
+                        start_time=start_time,
+                        group_index=group_index,
+                        table_name=f"Group_{group_index}",  # Tabellenname, den database_importer.py vergibt
+                        group_comment=group.channel_group.comment or None,
+                        channel_name=channel.name,
+                        is_master=channel_index == master_index,
+                        source=source.name if source is not None else None,
+                        unit=channel.unit or None,
+                        samples=samples,
+                        t_start=t_start,
+                        t_end=t_end,
+                        duration_s=t_end - t_start if samples else None,
+                        error=None,
+                    ))
+    except Exception as e:
+        # Defekte Dateien landen mit der Fehlermeldung im Inventar, statt den ganzen Scan abzubrechen
+        rows = [dict(file_info, error=str(e))]
+    return rows
+
+def read_inventory(inventory_path):
+    import pandas as pd
+    if not os.path.exists(inventory_path):
+        return pd.DataFrame(columns=inventory_columns)
+    return pd.read_parquet(inventory_path)
+
+def scan_directory(directory, inventory_path, workers=None, force=False):
+    """Scan all MF4 files below directory in parallel and write one Parquet inventory.
+
+    Files whose size and modification time are unchanged since the last scan are taken from the existing inventory.
+    """
+    import pandas as pd
+
+    file_paths = find_mf4_files(directory)
+    previous = read_inventory(inventory_path)
+    unchanged = set()
+    if not force and not previous.empty:
+        known = previous.drop_duplicates("file_path").set_index("file_path")[["file_size", "file_mtime"]]
+        for file_path in file_paths:
+            path = os.path.abspath(file_path)
+            if path in known.index:
+                stat = os.stat(file_path)
+                if known.at[path, "file_size"] == stat.st_size and known.at[path, "file_mtime"] == stat.st_mtime:
+                    unchanged.add(path)
+    todo = [file_path for file_path in file_paths if os.path.abspath(file_path) not in unchanged]
+    print(f"{len(file_paths)} MF4 files, {len(todo)} to scan, {len(unchanged)} unchanged.")
+
+    rows = []
+    with span("inventory.scan", files=len(todo)), ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(scan_mf4_file, file_path): file_path for file_path in todo}
+        for done, future in enumerate(as_completed(futures), start=1):
+            rows.extend(future.result())
+            print(f"[{done}/{len(todo)}] {os.path.basename(futures[future])}")
+
+    inventory = pd.concat([previous[previous["file_path"].isin(unchanged)], pd.DataFrame(rows, columns=inventory_columns)],
+                          ignore_index=True)
+    inventory = inventory.sort_values(["file_path", "group_index", "channel_name"]).reset_index(drop=True)
+    inventory.to_parquet(inventory_path, index=False)
+    print(f"Inventory of {inventory['file_path'].nunique()} files saved to {inventory_path}")
+    return inventory
+
+def print_summary(inventory):
+    # Pro Datei: Gruppen, Kanäle, Zeitspanne und die Temperatursensoren, die in anderen Dateien vorkommen, hier aber fehlen
+    channels = inventory[inventory["channel_name"].notna()]
+    sensors = channels[channels["channel_name"].str.match(pattern)]
+    all_sensors = set(sensors["channel_name"])
+    for file_id, file_rows in inventory.groupby("file_id", sort=False):
+        if file_rows["error"].notna().any():
+            print(f"{file_id}: ERROR {file_rows['error'].dropna().iloc[0]}")
+            continue
+        file_sensors = set(sensors.loc[sensors["file_id"] == file_id, "channel_name"])
+        missing = sorted(all_sensors - file_sensors)
+        print(f"{file_id}: {file_rows['group_index'].nunique()} groups, {len(file_rows)} channels, "
+              f"{len(file_sensors)}/{len(all_sensors)} temperature sensors, "
+              f"{file_rows['duration_s'].max():.0f} s, {file_rows['file_size'].iloc[0] / 1e6:.1f} MB")
+        if missing:
+            print(f"    missing: {', '.join(missing)}")
 
 def extract_groups_and_signals_to_csv(mf4_file, csv_file):
-    # Öffne die MF4-Datei
-    mdf = MDF(mf4_file)
-    
-    # Liste aller Gruppen und Kanäle
-    groups_and_signals = []
-
-    # Iteriere durch alle Kanäle
-    for channel in mdf.iter_channels():
-        # Versuche, den Gruppennamen und den Kanalnamen zu extrahieren
-        try:
-            group_name = channel.source.name  # Holen des Gruppennamens (oft als Source bezeichnet)
-            signal_name = channel.name        # Kanalname
-            groups_and_signals.append([group_name, signal_name])
-        except AttributeError as e:
-            print(f"Error processing channel: {e}")
+    # Gruppen- und Kanalnamen einer Datei als CSV, jetzt nur aus den Headern statt über mdf.iter_channels()
+    groups_and_signals = [[row["source"], row["channel_name"]] for row in scan_mf4_file(mf4_file) if row.get("channel_name")]
 
     # Schreibe die Daten in eine CSV-Datei
     with open(csv_file, mode='w', newline='') as file:
@@ -26,7 +139,16 @@ def extract_groups_and_signals_to_csv(mf4_file, csv_file):
 
     print(f"Groups and signals successfully extracted to {csv_file}")
 
-# Beispielnutzung
-mf4_file = 'TCP0014_Run1_01.mf4'  # Pfad zur MF4-Datei
-csv_file = 'output_groups_signals.csv'  # Pfad zur CSV-Datei, die gespeichert wird
-extract_groups_and_signals_to_csv(mf4_file, csv_file)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inventory of all MF4 files in a directory, read from the file headers only.")
+    parser.add_argument("directory", nargs="?", default="testrun_logs", help="Directory with the MF4 files (searched recursively)")
+    parser.add_argument("--output", default="mf4_inventory.parquet", help="Inventory Parquet file")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Rescan all files")
+    parser.add_argument("--csv", nargs=2, metavar=("MF4_FILE", "CSV_FILE"), help="Only write the group and channel names of one file as CSV")
+    args = parser.parse_args()
+
+    if args.csv:
+        extract_groups_and_signals_to_csv(*args.csv)
+    else:
+        print_summary(scan_directory(args.directory, args.output, workers=args.workers, force=args.force))
@@ -0,0 +1,195 @@
+import argparse
+import os
+import re
+import sqlite3
+import sys
+
+# Stage timings (BAT_TEMP_TRACE=1) come from the shared instrumentation module in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import span, count
+
+# SQLite database the MF4 data is imported into
+db_path = "mf4_data.db"
+
+# The catalog is a separate database, so that the tools that walk all tables of mf4_data.db never see it
+catalog_schema = """
+CREATE TABLE IF NOT EXISTS channels (
+    channel_name TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    source TEXT,
+    unit TEXT,
+    PRIMARY KEY (channel_name, table_name)
+);
+CREATE INDEX IF NOT EXISTS channels_name_nocase ON channels (channel_name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS channel_runs (
+    channel_name TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    samples INTEGER,
+    PRIMARY KEY (channel_name, table_name, file_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS channel_search USING fts5(
+    channel_name, table_name, source, unit, content='channels', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS channels_insert AFTER INSERT ON channels BEGIN
+    INSERT INTO channel_search (rowid, channel_name, table_name, source, unit)
+    VALUES (new.rowid, new.channel_name, new.table_name, new.source, new.unit);
+END;
+CREATE TRIGGER IF NOT EXISTS channels_delete AFTER DELETE ON channels BEGIN
+    INSERT INTO channel_search (channel_search, rowid, channel_name, table_name, source, unit)
+    VALUES ('delete', old.rowid, old.channel_name, old.table_name, old.source, old.unit);
+END;
+CREATE TRIGGER IF NOT EXISTS channels_update AFTER UPDATE ON channels BEGIN
+    INSERT INTO channel_search (channel_search, rowid, channel_name, table_name, source, unit)
+    VALUES ('delete', old.rowid, old.channel_name, old.table_name, old.source, old.unit);
+    INSERT INTO channel_search (rowid, channel_name, table_name, source, unit)
+    VALUES (new.rowid, new.channel_name, new.table_name, new.source, new.unit);
+END;
+"""
+
+search_modes = ["substring", "prefix", "regex", "exact"]
+
+def default_catalog_path(db_path):
+    # mf4_data.db -> mf4_data_channels.db
+    return os.path.splitext(db_path)[0] + "_channels.db"
+
+def regexp(pattern, value):
+    return value is not None and re.search(pattern, value, re.IGNORECASE) is not None
+
+def connect_catalog(catalog_path):
+    conn = sqlite3.connect(catalog_path)
+    conn.executescript(catalog_schema)
+    conn.create_function("regexp", 2, regexp, deterministic=True)
+    return conn
+
+def add_channel(conn, channel_name, table_name, file_id=None, samples=None, source=None, unit=None):
+    """Add or update one channel; source and unit are kept if they are not given."""
+    conn.execute(
+        "INSERT INTO channels (channel_name, table_name, source, unit) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (channel_name, table_name) DO UPDATE SET "
+        "source = coalesce(excluded.source, source), unit = coalesce(excluded.unit, unit)",
+        (channel_name, table_name, source or None, unit or None))
+    if file_id is not None:
+        conn.execute(
+            "INSERT INTO channel_runs (channel_name, table_name, file_id, samples) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (channel_name, table_name, file_id) DO UPDATE SET samples = excluded.samples",
+            (channel_name, table_name, file_id, samples))
+
+def add_mdf_channels(conn, mdf, file_id):
+    """Record the channels of an MF4 file under the table names database_importer.py gives its groups."""
+    for group_index, group in enumerate(mdf.groups):
+        table_name = f"Group_{group_index}"
+        samples = group.channel_group.cycles_nr
+        acquisition_source = group.channel_group.acq_source
+        for channel in group.channels:
+            source = channel.source or acquisition_source
+            add_channel(conn, channel.name, table_name, file_id, samples,
+                        source=source.name if source is not None else None, unit=channel.unit)
+            count("catalog.channels")
+
+def scan_database(conn, db_path):
+    """Add all channels of mf4_data.db with the runs that have values in them (one pass per table)."""
+    db_conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        tables = [row[0] for row in db_conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
+        for table_name in tables:
+            columns = [column[1] for column in db_conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()]
+            if "file_id" not in columns:
+                continue
+            channels = [column for column in columns if column not in ("time", "file_id")]
+            if not channels:
+                continue
+            counts = ", ".join(f'COUNT("{channel}")' for channel in channels)
+            with span("catalog.scan_table", table=table_name):
+                rows = db_conn.execute(f'SELECT file_id, {counts} FROM "{table_name}" GROUP BY file_id').fetchall()
+            for channel in channels:
+                add_channel(conn, channel, table_name)
+            for file_id, *samples in rows:
+                for channel, channel_samples in zip(channels, samples):
+                    if channel_samples:
+                        add_channel(conn, channel, table_name, file_id, channel_samples)
+        conn.commit()
+    finally:
+        db_conn.close()
+
+def open_catalog(db_path, catalog_path=None):
+    """Catalog of db_path, (re)built from the database if it is missing or older than it."""
+    catalog_path = catalog_path or default_catalog_path(db_path)
+    is_stale = not os.path.exists(catalog_path) or (
+        os.path.exists(db_path) and os.path.getmtime(catalog_path) < os.path.getmtime(db_path))
+    conn = connect_catalog(catalog_path)
+    if is_stale and os.path.exists(db_path):
+        print(f"Building channel catalog {catalog_path} from {db_path}...")
+        with span("catalog.build"):
+            scan_database(conn, db_path)
+        os.utime(catalog_path)
+    return conn
+
+def search(conn, query, mode="substring", all_fields=False, limit=None):
+    """Channels matching query, as dicts with channel_name, table_name, source, unit, run_count and runs.
+
+    substring and prefix are case-insensitive; substring (3 characters or more) uses the full-text index.
+    all_fields also matches the table name, source and unit.
+    """
+    if mode not in search_modes:
+        raise ValueError(f"Unknown search mode {mode!r}, expected one of {search_modes}")
+    fields = ["channel_name", "table_name", "source", "unit"] if all_fields else ["channel_name"]
+
+    if mode == "substring" and len(query) >= 3:
+        phrase = '"' + query.replace('"', '""') + '"'
+        match = phrase if all_fields else f"channel_name : {phrase}"
+        condition, params = "c.rowid IN (SELECT rowid FROM channel_search WHERE channel_search MATCH ?)", [match]
+    elif mode in ("substring", "prefix"):
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = f"%{escaped}%" if mode == "substring" else f"{escaped}%"
+        condition = " OR ".join(f"c.{field} LIKE ? ESCAPE '\\'" for field in fields)
+        params = [pattern] * len(fields)
+    elif mode == "regex":
+        re.compile(query)  # Raise re.error for an invalid pattern before running the query
+        condition = " OR ".join(f"c.{field} REGEXP ?" for field in fields)
+        params = [query] * len(fields)
+    else:
+        condition = " OR ".join(f"c.{field} = ? COLLATE NOCASE" for field in fields)
+        params = [query] * len(fields)
+
+    sql = (
+        "SELECT c.channel_name, c.table_name, c.source, c.unit, COUNT(r.file_id), group_concat(r.file_id, ',') "
+        "FROM channels c LEFT JOIN channel_runs r ON r.channel_name = c.channel_name AND r.table_name = c.table_name "
+        f"WHERE {condition} GROUP BY c.rowid ORDER BY c.channel_name, c.table_name"
+    )
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    with span("catalog.search", mode=mode):
+        rows = conn.execute(sql, params).fetchall()
+    return [
+        {"channel_name": name, "table_name": table_name, "source": source, "unit": unit,
+         "run_count": run_count, "runs": sorted(runs.split(",")) if runs else []}
+        for name, table_name, source, unit, run_count, runs in rows
+    ]
+
+def print_results(results, show_runs=False):
+    for result in results:
+        line = f"{result['channel_name']:45s} {result['table_name']:12s} {result['source'] or '-':10s} {result['unit'] or '-':8s} {result['run_count']:5d} runs"
+        print(line)
+        if show_runs and result["runs"]:
+            print("    " + ", ".join(result["runs"]))
+    print(f"{len(results)} channels found.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and search the channel catalog of mf4_data.db.")
+    parser.add_argument("query", nargs="?", help="Text to search for in the channel names")
+    parser.add_argument("--db-path", default=db_path)
+    parser.add_argument("--catalog", default=None, help="Catalog file (default: <db name>_channels.db)")
+    parser.add_argument("--mode", choices=search_modes, default="substring")
+    parser.add_argument("--all-fields", action="store_true", help="Also match table name, source and unit")
+    parser.add_argument("--runs", action="store_true", help="List the runs of every channel")
+    parser.add_argument("--rebuild", action="store_true", help="Rescan the whole database")
+    args = parser.parse_args()
+
+    catalog_path = args.catalog or default_catalog_path(args.db_path)
+    if args.rebuild and os.path.exists(catalog_path):
+        os.remove(catalog_path)
+    conn = open_catalog(args.db_path, catalog_path)
+    if args.query is not None:
+        print_results(search(conn, args.query, args.mode, args.all_fields), args.runs)
+    conn.close()
@@ -1,38 +1,36 @@
 import sqlite3
 from asammdf import MDF
 import os
+import sys
 from tqdm import tqdm  # Import the tqdm library for progress display
 
+# Stage timings (BAT_TEMP_TRACE=1) come from the shared instrumentation module in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import span, count
+import channel_catalog
+
 # Directory containing the MF4 files
 logs_directory = "testrun_logs"
 
-# Check if the directory exists
-if not os.path.exists(logs_directory):
-    print(f"The directory '{logs_directory}' does not exist. Please check the path.")
-    exit()
-
-# Search for all MF4 files in the specified directory and its subdirectories
-file_paths = []
-for root, dirs, files in os.walk(logs_directory):
-    for file in files:
-        if file.endswith(".MF4"):
-            file_paths.append(os.path.join(root, file))
-
-# Check if any files were found
-if not file_paths:
-    print(f"No MF4 files found in the directory '{logs_directory}'.")
-    exit()
-
-# Connect to the SQLite database
+# SQLite database the MF4 data is imported into
 db_path = "mf4_data.db"
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
 
-# Error logging
-error_log = []
+# After importing new files, refresh the lookup table and build the caches of the new runs (see precompute.py)
+precompute_after_import = True
+lookup_table_path = "db_lookup_table.parquet"
+
+# Search for all MF4 files in the specified directory and its subdirectories
+def find_mf4_files(logs_directory):
+    file_paths = []
+    for root, dirs, files in os.walk(logs_directory):
+        for file in files:
+            if file.endswith(".MF4"):
+                file_paths.append(os.path.join(root, file))
+    return file_paths
 
 # Function to create or update a table for a group with a 'file_id' column
-def create_or_update_table(group_name, channels):
+def create_or_update_table(conn, group_name, channels, error_log):
+    cursor = conn.cursor()
     cursor.execute(f"PRAGMA table_info({group_name})")
     columns_info = cursor.fetchall()
 
@@ -43,7 +41,7 @@ def create_or_update_table(group_name, channels):
     else:
         # If the table exists, check if 'file_id' exists, and add it if not
         existing_columns = [col[1] for col in columns_info]
-        
+
         # Add 'file_id' column if it's missing
         if 'file_id' not in existing_columns:
             try:
@@ -66,10 +64,11 @@ def create_or_update_table(group_name, channels):
                 error_log.append(error_message)
 
 # Function to check if a file is already loaded based on 'file_id'
-def is_file_already_loaded(file_name):
+def is_file_already_loaded(conn, file_name):
+    cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
     tables = cursor.fetchall()
-    
+
     # Check all tables for this file_id
     for table in tables:
         table_name = table[0]
@@ -78,16 +77,11 @@ def is_file_already_loaded(file_name):
             return True
     return False
 
-# Process all MF4 files found in the directory
-for file_path in tqdm(file_paths, desc="Processing MF4 files", unit="file"):
+# Import a single MF4 file, returns the number of rows inserted
+def import_mf4_file(conn, file_path, error_log, catalog_conn=None):
+    cursor = conn.cursor()
     file_name = os.path.basename(file_path)  # Use filename as unique 'file_id'
-
-    # Check if the file has already been processed
-    if is_file_already_loaded(file_name):
-        print(f"File '{file_name}' is already loaded in the database. Skipping...")
-        continue
-
-    print(f"\nProcessing file: {file_name}")
+    rows_inserted = 0
 
     # Open the MDF file and clean up the timestamps
     with MDF(file_path) as mdf:
@@ -99,41 +93,47 @@ for file_path in tqdm(file_paths, desc="Processing MF4 files", unit="file"):
             channels = [channel.name for channel in group.channels]
 
             # Create or update the table for the group
-            create_or_update_table(group_name, channels)
+            with span("import.create_table", group=group_name):
+                create_or_update_table(conn, group_name, channels, error_log)
 
             # Dictionary to group data by timestamp
             data_by_timestamp = {}
 
             # Process each channel within the group
-            for channel in group.channels:
-                try:
-                    signal = mdf.get(channel.name, group=group_index)
-                    time_data = signal.timestamps  # Timestamps
-                    signal_data = signal.samples  # Signal values
-
-                    # Add data to the dictionary grouped by timestamp
-                    for time, value in zip(time_data, signal_data):
-                        if time not in data_by_timestamp:
-                            data_by_timestamp[time] = {}
-                        data_by_timestamp[time][channel.name] = value
-
-                except Exception as e:
-                    error_message = f"Error retrieving signal '{channel.name}' in group '{group_name}': {e}"
-                    print(error_message)
-                    error_log.append(error_message)
+            with span("import.read_signals", group=group_name):
+                for channel in group.channels:
+                    try:
+                        signal = mdf.get(channel.name, group=group_index)
+                        time_data = signal.timestamps  # Timestamps
+                        signal_data = signal.samples  # Signal values
+
+                        # Add data to the dictionary grouped by timestamp
+                        for time, value in zip(time_data, signal_data):
+                            if time not in data_by_timestamp:
+                                data_by_timestamp[time] = {}
+                            data_by_timestamp[time][channel.name] = value
+
+                    except Exception as e:
+                        error_message = f"Error retrieving signal '{channel.name}' in group '{group_name}': {e}"
+                        print(error_message)
+                        error_log.append(error_message)
 
             # Insert data into the database, grouped by timestamp
-            for time, channel_data in data_by_timestamp.items():
-                # Insert missing channels as None
-                values = [time, file_name] + [channel_data.get(channel, None) for channel in channels]
-                placeholders = ", ".join(["?"] * (len(channels) + 2))  # +2 for time and file_id
-                columns = ", ".join(["time", "file_id"] + channels)
-
-                # Use INSERT OR REPLACE to avoid duplicates for the same time and file_id
-                cursor.execute(f"INSERT OR REPLACE INTO {group_name} ({columns}) VALUES ({placeholders})", values)
+            with span("import.insert", group=group_name):
+                for time, channel_data in data_by_timestamp.items():
+                    # Insert missing channels as None
+                    values = [time, file_name] + [channel_data.get(channel, None) for channel in channels]
+                    placeholders = ", ".join(["?"] * (len(channels) + 2))  # +2 for time and file_id
+                    columns = ", ".join(["time", "file_id"] + channels)
+
+                    # Use INSERT OR REPLACE to avoid duplicates for the same time and file_id
+                    cursor.execute(f"INSERT OR REPLACE INTO {group_name} ({columns}) VALUES ({placeholders})", values)
+            rows_inserted += len(data_by_timestamp)
+            count("import.rows", len(data_by_timestamp))
 
             # Commit after each group
-            conn.commit()
+            with span("import.commit", group=group_name):
+                conn.commit()
             print(f"Data for group '{group_name}' from file '{file_name}' successfully inserted.")
 
             # Check the row count for the group
@@ -141,16 +141,73 @@ for file_path in tqdm(file_paths, desc="Processing MF4 files", unit="file"):
             row_count = cursor.fetchone()[0]
             print(f"Group {group_name} from file {file_name} has {row_count} rows.")
 
-# Commit changes and close the connection
-conn.commit()
-conn.close()
-
-# Save the error log if any errors occurred
-if error_log:
-    with open("error_log.txt", "w") as log_file:
-        for entry in error_log:
-            log_file.write(f"{entry}\n")
-
-print(f"MF4 data successfully exported to the database '{db_path}'.")
-if error_log:
-    print(f"Some errors occurred. Details can be found in 'error_log.txt'.")
\ No newline at end of file
+        # Record the file's channels with their source and unit in the channel catalog
+        if catalog_conn is not None:
+            with span("import.catalog"):
+                channel_catalog.add_mdf_channels(catalog_conn, mdf, file_name)
+                catalog_conn.commit()
+
+    return rows_inserted
+
+def main(logs_directory, db_path):
+    # Check if the directory exists
+    if not os.path.exists(logs_directory):
+        print(f"The directory '{logs_directory}' does not exist. Please check the path.")
+        return
+
+    file_paths = find_mf4_files(logs_directory)
+
+    # Check if any files were found
+    if not file_paths:
+        print(f"No MF4 files found in the directory '{logs_directory}'.")
+        return
+
+    # Connect to the SQLite database and its channel catalog
+    conn = sqlite3.connect(db_path)
+    catalog_conn = channel_catalog.connect_catalog(channel_catalog.default_catalog_path(db_path))
+
+    # Error logging
+    error_log = []
+    imported_files = 0
+
+    # Process all MF4 files found in the directory
+    for file_path in tqdm(file_paths, desc="Processing MF4 files", unit="file"):
+        file_name = os.path.basename(file_path)
+
+        # Check if the file has already been processed
+        if is_file_already_loaded(conn, file_name):
+            print(f"File '{file_name}' is already loaded in the database. Skipping...")
+            continue
+
+        print(f"\nProcessing file: {file_name}")
+        with span("import.file", file=file_name):
+            import_mf4_file(conn, file_path, error_log, catalog_conn)
+        imported_files += 1
+
+    # Commit changes and close the connection
+    conn.commit()
+    conn.close()
+    catalog_conn.close()
+
+    # Save the error log if any errors occurred
+    if error_log:
+        with open("error_log.txt", "w") as log_file:
+            for entry in error_log:
+                log_file.write(f"{entry}\n")
+
+    print(f"MF4 data successfully exported to the database '{db_path}'.")
+    if error_log:
+        print(f"Some errors occurred. Details can be found in 'error_log.txt'.")
+
+    if precompute_after_import and imported_files:
+        import precompute
+        config_data = precompute.viewer.load_config("config.json") or {}
+        # If the viewer reads several databases, the combined lookup table is refreshed
+        configured_db_path = config_data.get("db_path")
+        pipeline_db_path = configured_db_path if isinstance(configured_db_path, list) and db_path in configured_db_path else db_path
+        precompute.run_pipeline(pipeline_db_path, config_data.get("lookup_table_path", lookup_table_path),
+                                quality_thresholds=config_data.get("quality_thresholds"),
+                                event_thresholds=config_data.get("event_thresholds"))
+
+if __name__ == "__main__":
+    main(logs_directory, db_path)
@@ -1,35 +1,23 @@
-import sqlite3
+import sys
+from channel_catalog import open_catalog, search, print_results
 
-# Verbinden Sie sich mit Ihrer SQLite-Datenbank
-conn = sqlite3.connect('mf4_data.db')
-cursor = conn.cursor()
+# Pfad zur SQLite-Datenbank
+db_path = 'mf4_data.db'
 
-# Abrufen aller Tabellen aus der Datenbank
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-tables = cursor.fetchall()
+# Gesuchter Begriff, als Argument übergeben oder "vcu"
+keyword = sys.argv[1] if len(sys.argv) > 1 else 'vcu'
 
-# Suchen Sie nach "coolant" in allen Tabellen
-for table_name in tables:
-    table_name = table_name[0]
-    try:
-        # Prüfen, ob die Tabelle eine Spalte mit "coolant" im Namen hat
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = cursor.fetchall()
-        for column in columns:
-            column_name = column[1]
-            if 'vcu' in column_name.lower():
-                print(f'Column with "VOC" found in table {table_name}: {column_name}')
-                
-        # Prüfen, ob in den Daten selbst das Wort "coolant" vorkommt
-        cursor.execute(f"SELECT * FROM {table_name} WHERE CAST({column_name} AS TEXT) LIKE '%vcu%'")
-        results = cursor.fetchall()
-        if results:
-            print(f'Found coolant data in table {table_name}:')
-            for result in results:
-                print(result)
-                
-    except Exception as e:
-        print(f"Could not process table {table_name}: {e}")
+# Der Kanalkatalog wird beim ersten Aufruf (und nach Änderungen an der Datenbank) einmal aufgebaut,
+# danach ist die Suche ein Zugriff auf den Volltextindex statt eines Durchlaufs über alle Tabellen
+conn = open_catalog(db_path)
 
-# Schließen der Verbindung zur Datenbank
-conn.close()
\ No newline at end of file
+# Alle Kanäle, deren Name, Tabelle, Quelle oder Einheit den Begriff enthält (Groß-/Kleinschreibung egal)
+results = search(conn, keyword, mode='substring', all_fields=True)
+if results:
+    print(f'Channels with "{keyword}" found:')
+    print_results(results)
+else:
+    print(f'No channels with "{keyword}" found.')
+
+# Schließen der Verbindung zum Katalog
+conn.close()
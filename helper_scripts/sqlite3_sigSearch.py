@@ -1,39 +1,26 @@
-import sqlite3
+import sys
+from channel_catalog import open_catalog, search, print_results
 
-# Verbindung zur SQLite-Datenbank herstellen
+# Pfad zur SQLite-Datenbank
 db_path = 'mf4_data.db'
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
 
-# Hole alle Tabellennamen aus der Datenbank
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-tables = cursor.fetchall()
-
-# Variablenname des gesuchten Kanals
+# Variablenname des gesuchten Kanals; mit "--prefix" oder "--regex" wird stattdessen nach Anfang oder Muster gesucht
 target_column = 'VCU_AI_ClntFlow_Mean'
+mode = 'exact'
+for argument in sys.argv[1:]:
+    if argument in ('--prefix', '--regex'):
+        mode = argument[2:]
+    else:
+        target_column = argument
 
-# Iteriere durch alle Tabellen und suche nach der Spalte
-found = False
-for table in tables:
-    table_name = table[0]
-    
-    # Hole alle Spaltennamen der aktuellen Tabelle
-    cursor.execute(f"PRAGMA table_info({table_name});")
-    columns = cursor.fetchall()
-    
-    # Überprüfe, ob die gesuchte Spalte in der aktuellen Tabelle existiert
-    for column in columns:
-        column_name = column[1]
-        if target_column.lower() == column_name.lower():  # Vergleiche ohne Groß-/Kleinschreibung
-            print(f"Spalte '{target_column}' gefunden in Tabelle '{table_name}'")
-            found = False
-            break
-    
-    if found:
-        break
+# Suche im Kanalkatalog statt PRAGMA table_info über alle Tabellen (Groß-/Kleinschreibung egal)
+conn = open_catalog(db_path)
+results = search(conn, target_column, mode=mode)
 
-if not found:
+if results:
+    print_results(results, show_runs=True)
+else:
     print(f"Spalte '{target_column}' wurde in keiner Tabelle gefunden.")
 
 # Verbindung schließen
-conn.close()
\ No newline at end of file
+conn.close()
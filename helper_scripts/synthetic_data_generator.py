@@ -0,0 +1,276 @@
+import argparse
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# Channel names as they appear in the imported MF4 data
+temperature_channel_format = "moduleTemperature{sensor_number:02d}_BMS{bms_id}"
+inlet_channel = "VCU_AI_BatTempIn_Mean"
+outlet_channel = "VCU_AI_BatTempOut_Mean"
+flow_channel = "VCU_AI_ClntFlow_Mean"
+
+# Volumetric heat capacity of the 50/50 water-glycol coolant in J/(m^3*K),
+# same constants as calculation_heat_flux in thermal_dynamics_HVB.py
+coolant_heat_capacity = 0.5 * 4186 * 1000 + 0.5 * 3350 * 1070
+
+
+def synthetic_file_ids(run_count, prefix="SYN0001"):
+    """Return MF4-style file IDs for the synthetic runs."""
+    return [f"{prefix}_Run{run + 1}_01.MF4" for run in range(run_count)]
+
+
+def _first_order_response(signal, tau, dt):
+    # Response of a first-order lag (time constant tau) to the signal, via FFT convolution
+    kernel_length = min(len(signal), int(np.ceil(6 * tau / dt)) + 1)
+    kernel = np.exp(-np.arange(kernel_length) * dt / tau)
+    kernel /= kernel.sum()
+    size = len(signal) + kernel_length - 1
+    response = np.fft.irfft(np.fft.rfft(signal, size) * np.fft.rfft(kernel, size), size)
+    return response[:len(signal)]
+
+
+def generate_run(sensor_count=96, bms_ids=("01", "05"), sample_rate=1.0, duration=3600.0,
+                 gap_count=2, gap_duration=30.0, dropout_fraction=0.001, drift=0.05,
+                 resolution=0.1, seed=None):
+    """Generate one synthetic test run.
+
+    Returns a dict with the time base, the temperature channels, the inlet/outlet/flow
+    signals and the (channel, sensor number, BMS ID) list of the temperature sensors.
+    """
+    rng = np.random.default_rng(seed)
+    dt = 1.0 / sample_rate
+    time = np.arange(int(duration * sample_rate)) * dt
+    n_samples = len(time)
+
+    # Load profile: repeated charge/discharge blocks with random power levels
+    block_length = max(1, int(rng.uniform(300, 900) * sample_rate))
+    block_power = rng.uniform(0.0, 1.0, size=n_samples // block_length + 1)
+    load = np.repeat(block_power, block_length)[:n_samples]
+    pack_power = rng.uniform(2000, 6000)  # W at full load
+
+    # Coolant: slowly varying inlet temperature and flow in L/min
+    inlet = 20.0 + rng.uniform(-2, 2) + 1.5 * np.sin(2 * np.pi * time / max(duration, 1.0))
+    flow = np.clip(12.0 + rng.normal(0, 0.3, size=n_samples) + 2.0 * (load > 0.5), 0, None)
+    flow_m3_s = flow / 60000
+    heat = _first_order_response(load * pack_power, 120.0, dt)
+    outlet = inlet + heat / np.maximum(flow_m3_s * coolant_heat_capacity, 1e-9)
+
+    # Each sensor follows the inlet temperature plus a lagged, sensor-specific heating term
+    taus = np.array([300.0, 450.0, 600.0, 900.0])
+    lagged_load = np.array([_first_order_response(load, tau, dt) for tau in taus])
+
+    sensors = []
+    temperatures = {}
+    for bms_id in bms_ids:
+        for sensor_number in range(1, sensor_count + 1):
+            channel = temperature_channel_format.format(sensor_number=sensor_number, bms_id=bms_id)
+            gain = rng.normal(12.0, 2.0)
+            offset = rng.normal(0.0, 0.5)
+            drift_rate = rng.normal(0.0, drift) / 3600  # drift is given in degC per hour
+            values = (inlet + gain * lagged_load[rng.integers(len(taus))] + offset
+                      + drift_rate * time + rng.normal(0, 0.05, size=n_samples))
+            if resolution:
+                values = np.round(values / resolution) * resolution
+
+            # Single-sample dropouts of this sensor
+            values[rng.random(n_samples) < dropout_fraction] = np.nan
+
+            sensors.append((channel, sensor_number, bms_id))
+            temperatures[channel] = values
+
+    # Logger gaps: no rows at all for any group during these windows
+    keep = np.ones(n_samples, dtype=bool)
+    for _ in range(gap_count):
+        gap_start = rng.integers(0, max(1, n_samples))
+        keep[gap_start:gap_start + int(gap_duration * sample_rate)] = False
+
+    return {
+        "time": time[keep],
+        "temperatures": {channel: values[keep] for channel, values in temperatures.items()},
+        "inlet": inlet[keep],
+        "outlet": outlet[keep],
+        "flow": flow[keep],
+        "sensors": sensors,
+    }
+
+
+def group_layout(run, channels_per_group=8):
+    """Split the run's channels into importer-style groups (Group_0, Group_1, ...)."""
+    temperature_channels = [channel for channel, _, _ in run["sensors"]]
+    groups = []
+    for start in range(0, len(temperature_channels), channels_per_group):
+        groups.append((f"Group_{len(groups)}", temperature_channels[start:start + channels_per_group]))
+    # Inlet/outlet and flow come from separate VCU messages, as in the real logs
+    groups.append((f"Group_{len(groups)}", [inlet_channel, outlet_channel]))
+    groups.append((f"Group_{len(groups)}", [flow_channel]))
+    return groups
+
+
+def create_or_update_table(cursor, group_name, channels):
+    # Same schema as helper_scripts/database_importer.py
+    cursor.execute(f"PRAGMA table_info({group_name})")
+    existing_columns = [col[1] for col in cursor.fetchall()]
+    if not existing_columns:
+        columns = ", ".join([f"{channel} REAL" for channel in channels])
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {group_name} (time REAL, file_id TEXT, {columns}, PRIMARY KEY(time, file_id))")
+    else:
+        for channel in channels:
+            if channel not in existing_columns:
+                cursor.execute(f"ALTER TABLE {group_name} ADD COLUMN {channel} REAL")
+
+
+def write_run_to_db(conn, file_id, run, channels_per_group=8):
+    """Insert one generated run into the database. Returns the layout and the number of rows written."""
+    cursor = conn.cursor()
+    signals = dict(run["temperatures"])
+    signals[inlet_channel] = run["inlet"]
+    signals[outlet_channel] = run["outlet"]
+    signals[flow_channel] = run["flow"]
+
+    layout = group_layout(run, channels_per_group)
+    rows_written = 0
+    for group_index, (group_name, channels) in enumerate(layout):
+        create_or_update_table(cursor, group_name, channels)
+
+        # Each CAN message has its own small timestamp offset
+        values = np.column_stack([run["time"] + group_index * 1e-3] + [signals[channel] for channel in channels]).astype(object)
+        values[:, 1:][pd.isna(values[:, 1:])] = None
+        rows = [(row[0], file_id, *row[1:]) for row in values.tolist()]
+
+        placeholders = ", ".join(["?"] * (len(channels) + 2))
+        columns = ", ".join(["time", "file_id"] + channels)
+        cursor.executemany(f"INSERT OR REPLACE INTO {group_name} ({columns}) VALUES ({placeholders})", rows)
+        rows_written += len(rows)
+    conn.commit()
+    return layout, rows_written
+
+
+def channel_unit_and_source(channel):
+    """Unit and sending ECU of a generated channel, as recorded in the MF4 metadata."""
+    if channel == flow_channel:
+        return "L/min", "VCU"
+    if channel in (inlet_channel, outlet_channel):
+        return "°C", "VCU"
+    return "°C", channel.rsplit("_", 1)[-1]  # moduleTemperatureNN_BMS01 is sent by BMS01
+
+
+def write_run_to_mf4(mf4_path, run, channels_per_group=8):
+    """Write one generated run as an MF4 file with the same group layout, e.g. to feed database_importer.py."""
+    from asammdf import MDF, Signal
+    from asammdf.blocks.source_utils import Source
+
+    def make_signal(channel, timestamps):
+        unit, source = channel_unit_and_source(channel)
+        return Signal(signals[channel], timestamps, name=channel, unit=unit,
+                      source=Source(source, source, "", Source.SOURCE_ECU, Source.BUS_TYPE_CAN))
+
+    signals = dict(run["temperatures"])
+    signals[inlet_channel] = run["inlet"]
+    signals[outlet_channel] = run["outlet"]
+    signals[flow_channel] = run["flow"]
+
+    with MDF(version="4.10") as mdf:
+        for group_index, (group_name, channels) in enumerate(group_layout(run, channels_per_group)):
+            timestamps = run["time"] + group_index * 1e-3
+            mdf.append([make_signal(channel, timestamps) for channel in channels], comment=group_name)
+            # The importer adds every channel as a column next to its own 'time' column, so the master must not be called 'time'
+            mdf.groups[group_index].channels[mdf.masters_db[group_index]].name = "t"
+        saved_path = mdf.save(mf4_path, overwrite=True)
+
+    # asammdf lowercases the suffix, but the importer only picks up *.MF4 files
+    if os.path.abspath(saved_path) != os.path.abspath(mf4_path):
+        os.replace(saved_path, mf4_path)
+
+
+def build_lookup_table(layouts):
+    """Build the lookup table for {file_id: group layout}, in the format of generate_lookup_table.py."""
+    special_signals = {inlet_channel: 101, outlet_channel: 102, flow_channel: 103}
+    found_columns = []
+    for file_id, layout in layouts.items():
+        for group_name, channels in layout:
+            for channel in channels:
+                if channel in special_signals:
+                    found_columns.append((channel, group_name, special_signals[channel], None, file_id))
+                else:
+                    sensor_part, bms_part = channel.split("_BMS")
+                    sensor_number = int(sensor_part[len("moduleTemperature"):])
+                    found_columns.append((channel, group_name, sensor_number, bms_part, file_id))
+
+    df = pd.DataFrame(found_columns, columns=['Channel.Name', 'Table.Name', 'SensorNumber', 'BMS_ID', 'File.ID'])
+    return df.sort_values(by=['BMS_ID', 'SensorNumber']).reset_index(drop=True)
+
+
+def generate_synthetic_database(db_path, lookup_table_path, run_count=3, channels_per_group=8,
+                                file_id_prefix="SYN0001", seed=0, **run_options):
+    """Write run_count synthetic runs into db_path and the matching lookup table to lookup_table_path.
+
+    If db_path already exists, the runs are added to it and the lookup table covers all runs in the database.
+
+    run_options are passed on to generate_run. Returns the lookup table.
+    """
+    rng = np.random.default_rng(seed)
+    appending = os.path.exists(db_path)
+    conn = sqlite3.connect(db_path)
+    layouts = {}
+    total_rows = 0
+    try:
+        for file_id in synthetic_file_ids(run_count, file_id_prefix):
+            run = generate_run(seed=int(rng.integers(2**31)), **run_options)
+            layouts[file_id], rows_written = write_run_to_db(conn, file_id, run, channels_per_group)
+            total_rows += rows_written
+            print(f"Generated {file_id}: {len(run['time'])} samples, {len(run['sensors'])} sensors, {rows_written} rows")
+    finally:
+        conn.close()
+
+    if appending:
+        # The database also holds earlier runs, so the lookup table is rebuilt from all of it
+        from generate_lookup_table import generate_lookup_table
+        lookup_table = generate_lookup_table(db_path)
+    else:
+        lookup_table = build_lookup_table(layouts)
+    if lookup_table_path.endswith(".parquet"):
+        lookup_table.to_parquet(lookup_table_path, index=False)
+    else:
+        lookup_table.to_csv(lookup_table_path, index=False)
+    print(f"Wrote {total_rows} rows to '{db_path}' and the lookup table to '{lookup_table_path}'.")
+    return lookup_table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic battery test runs in the mf4_data.db schema.")
+    parser.add_argument("--db-path", default="synthetic_mf4_data.db")
+    parser.add_argument("--lookup-table-path", default="synthetic_lookup_table.parquet")
+    parser.add_argument("--runs", type=int, default=3, help="Number of runs to generate")
+    parser.add_argument("--sensors-per-bms", type=int, default=96)
+    parser.add_argument("--bms-ids", default="01,05", help="Comma-separated BMS IDs")
+    parser.add_argument("--sample-rate", type=float, default=1.0, help="Samples per second")
+    parser.add_argument("--duration", type=float, default=3600.0, help="Run length in seconds")
+    parser.add_argument("--gap-count", type=int, default=2, help="Logger gaps per run")
+    parser.add_argument("--gap-duration", type=float, default=30.0, help="Length of each gap in seconds")
+    parser.add_argument("--dropout-fraction", type=float, default=0.001, help="Fraction of single-sample sensor dropouts")
+    parser.add_argument("--drift", type=float, default=0.05, help="Std dev of the sensor drift in degC per hour")
+    parser.add_argument("--channels-per-group", type=int, default=8)
+    parser.add_argument("--file-id-prefix", default="SYN0001")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db_path):
+        print(f"Appending to existing database '{args.db_path}'.")
+
+    generate_synthetic_database(
+        args.db_path,
+        args.lookup_table_path,
+        run_count=args.runs,
+        channels_per_group=args.channels_per_group,
+        file_id_prefix=args.file_id_prefix,
+        seed=args.seed,
+        sensor_count=args.sensors_per_bms,
+        bms_ids=tuple(args.bms_ids.split(",")),
+        sample_rate=args.sample_rate,
+        duration=args.duration,
+        gap_count=args.gap_count,
+        gap_duration=args.gap_duration,
+        dropout_fraction=args.dropout_fraction,
+        drift=args.drift,
+    )
@@ -0,0 +1,47 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from instrumentation import span
+
+def read_results(output_path):
+    import pandas as pd
+    if not os.path.exists(output_path):
+        return pd.DataFrame()
+    if output_path.endswith(".parquet"):
+        return pd.read_parquet(output_path)
+    return pd.read_csv(output_path)
+
+def write_results(results, output_path):
+    if output_path.endswith(".parquet"):
+        results.to_parquet(output_path, index=False)
+    else:
+        results.to_csv(output_path, index=False)
+
+def order_by_runs(results, file_ids):
+    """Result table sorted like file_ids (the rows of one run keep their order)."""
+    if results.empty:
+        return results
+    order = {file_id: position for position, file_id in enumerate(file_ids)}
+    return results.sort_values("file_id", kind="stable", key=lambda ids: ids.map(order)).reset_index(drop=True)
+
+def unchanged_runs(fingerprints, stored_fingerprints, force=False):
+    """Runs whose stored result was computed from the same fingerprint as now, so it can be reused."""
+    if force:
+        return set()
+    return {file_id for file_id, fingerprint in fingerprints.items() if stored_fingerprints.get(file_id) == fingerprint}
+
+def compute_in_pool(worker, tasks, workers=None, span_name="batch", action="computing"):
+    """Call worker(*arguments) for every {key: arguments} in a process pool, printing the progress.
+
+    Returns {key: result} of the tasks that succeeded; failed tasks are reported and left out.
+    """
+    results = {}
+    with span(span_name, runs=len(tasks)), ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(worker, *arguments): key for key, arguments in tasks.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+                print(f"[{done}/{len(tasks)}] {key} done")
+            except Exception as e:
+                print(f"[{done}/{len(tasks)}] Error {action} {key}: {e}")
+    return results
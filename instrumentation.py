@@ -0,0 +1,159 @@
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import time
+
+# Tracing is switched on with BAT_TEMP_TRACE=<trace.json> (or =1 for trace.json),
+# cProfile with BAT_TEMP_PROFILE=<profile.prof>, debug output with BAT_TEMP_DEBUG=1.
+# When tracing is off, span() returns a shared no-op context manager and count() returns immediately.
+enabled = False
+debug_enabled = bool(os.environ.get("BAT_TEMP_DEBUG"))
+
+# Raw events are kept for a Chrome trace (chrome://tracing, Perfetto) up to this many, aggregates are always kept
+max_trace_events = 100000
+
+_trace_path = None
+_profile_path = None
+_profiler = None
+_start_time = time.perf_counter()
+_events = []
+_span_stats = {}
+_counters = {}
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _record(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+
+def _record(name, start, end, args):
+    duration = end - start
+    stats = _span_stats.get(name)
+    if stats is None:
+        _span_stats[name] = [1, duration, duration, duration]
+    else:
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = min(stats[2], duration)
+        stats[3] = max(stats[3], duration)
+
+    if len(_events) < max_trace_events:
+        _events.append({
+            "name": name,
+            "ph": "X",
+            "ts": (start - _start_time) * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": args,
+        })
+
+
+def span(name, **args):
+    """Time the enclosed block as a named span, e.g. `with span("sql.query", table=table_name):`."""
+    if not enabled:
+        return _null_span
+    return _Span(name, args)
+
+
+def record_span(name, start, end, **args):
+    """Record a span from two time.perf_counter() values taken elsewhere."""
+    if enabled:
+        _record(name, start, end, args)
+
+
+def count(name, value=1):
+    """Increase the named counter (cache hits, rows, frames, ...)."""
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def debug(message):
+    """Print diagnostic output only when BAT_TEMP_DEBUG is set."""
+    if debug_enabled:
+        print(message)
+
+
+def summary():
+    """Aggregated span timings and counters."""
+    return {
+        "spans": {
+            name: {"count": count_, "total_s": total, "mean_s": total / count_, "min_s": min_, "max_s": max_}
+            for name, (count_, total, min_, max_) in sorted(_span_stats.items(), key=lambda item: -item[1][1])
+        },
+        "counters": dict(sorted(_counters.items())),
+    }
+
+
+def print_summary():
+    result = summary()
+    print("\nStage timings:")
+    for name, stats in result["spans"].items():
+        print(f"  {name:40s} {stats['count']:7d} x  total {stats['total_s']:9.3f} s  mean {stats['mean_s'] * 1000:9.2f} ms  max {stats['max_s'] * 1000:9.2f} ms")
+    if result["counters"]:
+        print("Counters:")
+        for name, value in result["counters"].items():
+            print(f"  {name:40s} {value}")
+
+
+def write_trace(trace_path):
+    """Write the summary plus the raw events in Chrome trace format."""
+    with open(trace_path, "w") as f:
+        json.dump(dict(summary(), traceEvents=_events), f, indent=1)
+    print(f"Trace written to {trace_path}")
+
+
+def enable(trace_path="trace.json", profile_path=None):
+    """Switch tracing on; the trace (and profile) are written when the process exits."""
+    global enabled, _trace_path, _profile_path, _profiler
+    if not enabled:
+        atexit.register(_finish)
+    enabled = True
+    _trace_path = trace_path
+    if profile_path and _profiler is None:
+        _profile_path = profile_path
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def _finish():
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profile_path)
+        print(f"cProfile stats written to {_profile_path}")
+        pstats.Stats(_profiler).sort_stats("cumulative").print_stats(20)
+    print_summary()
+    if _trace_path:
+        write_trace(_trace_path)
+
+
+if os.environ.get("BAT_TEMP_TRACE") or os.environ.get("BAT_TEMP_PROFILE"):
+    _env_trace = os.environ.get("BAT_TEMP_TRACE")
+    enable(trace_path="trace.json" if _env_trace in (None, "", "1") else _env_trace,
+           profile_path=os.environ.get("BAT_TEMP_PROFILE"))
@@ -0,0 +1,338 @@
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import time
+import warnings
+import numpy as np
+import thermal_dynamics_HVB as viewer
+from instrumentation import span, count
+from run_index import natural_sort_key, resolve_db_path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "helper_scripts"))
+from generate_lookup_table import pattern, inlet_outlet_columns, coolant_flow_signal
+
+# Samples kept in memory; older samples only contribute to the running per-sensor statistics
+default_window = 3600
+
+# Heatmap refreshes per second
+default_refresh_hz = 1.0
+
+# A segment file is read once it has not been modified for this long
+segment_settle_s = 2.0
+
+# A signal lagging further behind the others is filled with NaN, so a dead sensor does not stall the view
+max_signal_lag = 30
+
+series_names = ["inlet", "outlet", "flow", "cell_range", "layer_range"]
+
+def signal_key(channel_name):
+    """(sensor number, BMS ID) of a temperature channel, 'inlet', 'outlet' or 'flow', or None for other channels."""
+    match = pattern.match(channel_name)
+    if match:
+        return (int(match.group(1)), match.group(2))
+    if channel_name == inlet_outlet_columns[0]:
+        return "inlet"
+    if channel_name == inlet_outlet_columns[1]:
+        return "outlet"
+    if channel_name == coolant_flow_signal:
+        return "flow"
+    return None
+
+class SqliteTail:
+    """New samples of one run in a SQLite database that is still being written to."""
+
+    def __init__(self, db_path, file_id):
+        self.db_path = db_path
+        self.file_id = file_id
+        # Read-only, so that the importer writing the database is never blocked by the viewer
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        self._schema_version = None
+        self._tables = {}
+        self._last_time = {}
+
+    def _discover(self):
+        # Tables and columns are only scanned again when the importer changed the schema
+        schema_version = self.conn.execute("PRAGMA schema_version").fetchone()[0]
+        if schema_version == self._schema_version:
+            return
+        self._schema_version = schema_version
+        owned = set()
+        self._tables = {}
+        for (table_name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+            columns = []
+            for column in self.conn.execute(f'PRAGMA table_info("{table_name}")').fetchall():
+                key = signal_key(column[1])
+                # A signal present in several tables is read from the first one only, like the extract functions do
+                if key is not None and key not in owned:
+                    columns.append((column[1], key))
+                    owned.add(key)
+            if columns:
+                self._tables[table_name] = columns
+
+    def poll(self):
+        """New non-NaN values per signal key since the last poll."""
+        self._discover()
+        new_values = {}
+        for table_name, columns in self._tables.items():
+            column_list = ", ".join(f'"{name}"' for name, _ in columns)
+            query = f'SELECT time, {column_list} FROM "{table_name}" WHERE file_id = ? AND time > ? ORDER BY time'
+            with span("sql.query", table=table_name):
+                rows = self.conn.execute(query, (self.file_id, self._last_time.get(table_name, -np.inf))).fetchall()
+            if not rows:
+                continue
+            block = np.array(rows, dtype=float)  # NULL becomes NaN
+            self._last_time[table_name] = block[-1, 0]
+            for column_index, (_, key) in enumerate(columns, start=1):
+                values = block[:, column_index]
+                new_values.setdefault(key, []).append(values[~np.isnan(values)])
+        return {key: np.concatenate(parts) for key, parts in new_values.items()}
+
+    def close(self):
+        self.conn.close()
+
+class Mf4SegmentTail:
+    """New samples from a directory of chunked MF4 segments, each read once it is complete."""
+
+    def __init__(self, directory, file_pattern="*.[mM][fF]4"):
+        self.directory = directory
+        self.file_pattern = file_pattern
+        self._read = set()
+
+    def _complete_segments(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, self.file_pattern)), key=natural_sort_key)
+        now = time.time()
+        return [path for path in paths if path not in self._read and now - os.path.getmtime(path) >= segment_settle_s]
+
+    def poll(self):
+        from asammdf import MDF
+
+        new_values = {}
+        for path in self._complete_segments():
+            with span("live.read_segment", file=os.path.basename(path)):
+                mdf = MDF(path)
+                try:
+                    segment_keys = set()
+                    for channel_name, occurrences in mdf.channels_db.items():
+                        key = signal_key(channel_name)
+                        if key is None or key in segment_keys:
+                            continue
+                        group_index, channel_index = occurrences[0]
+                        values = np.asarray(mdf.get(channel_name, group_index, channel_index).samples, dtype=float)
+                        new_values.setdefault(key, []).append(values[~np.isnan(values)])
+                        segment_keys.add(key)
+                finally:
+                    mdf.close()
+            self._read.add(path)
+            count("live.segments")
+        return {key: np.concatenate(parts) for key, parts in new_values.items()}
+
+    def close(self):
+        pass
+
+class LiveRun:
+    """Growing (sensor x time) matrix of a run being logged, with its range series and running per-sensor statistics.
+
+    Only the last `window` samples are kept; the buffers hold twice that and are compacted when full,
+    so appending is amortized O(new samples) and the window is always a contiguous view.
+    """
+
+    def __init__(self, window=default_window):
+        self.window = window
+        self.sensor_identifiers = []
+        self._rows = {}
+        self._pending = {}
+        self._layers = []
+        self._temperatures = np.full((0, 2 * window), np.nan)
+        self._series = np.full((len(series_names), 2 * window), np.nan)
+        self._end = 0
+        self.total_samples = 0
+
+        # Running statistics over the whole run, not only the window
+        self.sensor_min = np.zeros(0)
+        self.sensor_max = np.zeros(0)
+        self.sensor_sum = np.zeros(0)
+        self.sensor_count = np.zeros(0, dtype=np.int64)
+
+    def _add_sensors(self, new_sensors):
+        for sensor in new_sensors:
+            self._rows[sensor] = len(self.sensor_identifiers)
+            self.sensor_identifiers.append(sensor)
+        added = len(new_sensors)
+        self._temperatures = np.vstack([self._temperatures, np.full((added, self._temperatures.shape[1]), np.nan)])
+        self.sensor_min = np.concatenate([self.sensor_min, np.full(added, np.inf)])
+        self.sensor_max = np.concatenate([self.sensor_max, np.full(added, -np.inf)])
+        self.sensor_sum = np.concatenate([self.sensor_sum, np.zeros(added)])
+        self.sensor_count = np.concatenate([self.sensor_count, np.zeros(added, dtype=np.int64)])
+        self._layers = viewer.layer_sensor_rows(self.sensor_identifiers, viewer.sensors_per_module_list, viewer.custom_sensor_order)
+
+    def append(self, new_values):
+        """Add the values of a poll; returns the number of samples that became complete."""
+        new_sensors = [key for key in new_values if isinstance(key, tuple) and key not in self._rows]
+        if new_sensors:
+            self._add_sensors(new_sensors)
+        for key, values in new_values.items():
+            if len(values):
+                self._pending.setdefault(key, []).append(values)
+
+        # A sample is complete once every signal seen so far has it, the same trimming as the offline extract
+        lengths = {key: sum(len(values) for values in parts) for key, parts in self._pending.items()}
+        if not self.sensor_identifiers or not lengths:
+            return 0
+        n = min(lengths.get(key, 0) for key in list(self._rows) + [key for key in ("inlet", "outlet", "flow") if key in lengths])
+        n = max(n, max(lengths.values()) - max_signal_lag)
+        if n <= 0:
+            return 0
+
+        block = np.full((len(self.sensor_identifiers), n), np.nan)
+        series = np.full((len(series_names), n), np.nan)
+        for key in list(self._pending):
+            if not self._pending[key]:
+                continue
+            values = np.concatenate(self._pending[key])
+            self._pending[key] = [values[n:]] if len(values) > n else []
+            values = values[:n]
+            if isinstance(key, tuple):
+                block[self._rows[key], :len(values)] = values
+            else:
+                series[series_names.index(key), :len(values)] = values
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            series[3] = np.nanmax(block, axis=0) - np.nanmin(block, axis=0)
+            layer_means = [np.nanmean(block[rows], axis=0) for rows in self._layers if rows]
+            if layer_means:
+                series[4] = np.nanmax(layer_means, axis=0) - np.nanmin(layer_means, axis=0)
+            self.sensor_min = np.fmin(self.sensor_min, np.nanmin(block, axis=1))
+            self.sensor_max = np.fmax(self.sensor_max, np.nanmax(block, axis=1))
+        self.sensor_sum += np.nansum(block, axis=1)
+        self.sensor_count += np.count_nonzero(~np.isnan(block), axis=1)
+
+        self._write(block, series)
+        self.total_samples += n
+        count("live.samples", n)
+        return n
+
+    def _write(self, block, series):
+        n = block.shape[1]
+        if n > self.window:
+            block, series, n = block[:, -self.window:], series[:, -self.window:], self.window
+        if self._end + n > self._temperatures.shape[1]:
+            keep = min(self.window - n, self._end)
+            self._temperatures[:, :keep] = self._temperatures[:, self._end - keep:self._end]
+            self._series[:, :keep] = self._series[:, self._end - keep:self._end]
+            self._end = keep
+        self._temperatures[:, self._end:self._end + n] = block
+        self._series[:, self._end:self._end + n] = series
+        self._end += n
+
+    def window_data(self):
+        """(time, temperatures, series) of the kept window; views into the buffers, valid until the next append."""
+        start = max(self._end - self.window, 0)
+        length = self._end - start
+        time_axis = np.arange(self.total_samples - length, self.total_samples)
+        return time_axis, self._temperatures[:, start:self._end], self._series[:, start:self._end]
+
+def live_view(source, window=default_window, refresh_hz=default_refresh_hz, vmin=15.0, vmax=40.0, title=None, show=True):
+    """Follow the source and redraw the heatmap of the newest sample refresh_hz times per second."""
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec
+    from matplotlib.animation import FuncAnimation
+
+    live_run = LiveRun(window)
+
+    fig = plt.figure(figsize=(15, 10))
+    fig.text(0.95, 0.9, f"Live: {title}" if title else "Live", ha='right', va='top', fontsize=10, color='gray')
+    gs = gridspec.GridSpec(3, 3, height_ratios=[1, 1, 0.5])
+    axes = [fig.add_subplot(gs[i, j]) for i in range(2) for j in range(3)]
+    ax_additional = fig.add_subplot(gs[2, :])
+    plt.subplots_adjust(hspace=0.01, wspace=0.3, top=0.80)
+
+    line_overall, = ax_additional.plot([], [], label='Cell Temp \nRange', color='black')
+    line_layer_mean_range, = ax_additional.plot([], [], label='Range of Mean \nLayer Temps', color='red')
+    ax_additional.set_xlabel('Time [s]')
+    ax_additional.set_ylabel('Temperature Range [°C]')
+    ax_additional.set_title(f'Cell Temp Range and Range of Mean Layer Temps (last {window} s)')
+    ax_additional.legend(loc='upper left', bbox_to_anchor=(1.01, 1), borderaxespad=0)
+
+    status_text_obj = fig.text(0.03, 0.80, "Waiting for data...", fontsize=12, fontweight='bold', ha='left')
+    cbar_list = [None]
+
+    def refresh(frame):
+        with span("live.poll"):
+            new_values = source.poll()
+        with span("live.append"):
+            live_run.append(new_values)
+        if live_run.total_samples == 0:
+            return
+
+        with span("live.draw"):
+            time_axis, temperatures, series = live_run.window_data()
+            t_index = temperatures.shape[1] - 1
+            heatmap = viewer.plot_battery_layout(
+                temperatures, live_run.sensor_identifiers, viewer.sensors_per_module_list, viewer.strings_count,
+                t_index, temperatures.shape[1], axes, cbar_list, viewer.custom_sensor_order, vmin=vmin, vmax=vmax, fig=fig)
+
+            line_overall.set_data(time_axis, series[3])
+            line_layer_mean_range.set_data(time_axis, series[4])
+            ax_additional.set_xlim(time_axis[0], max(time_axis[-1], time_axis[0] + 1))
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                top = np.nanmax(series[3:5])
+                hottest = int(np.argmax(np.where(np.isfinite(live_run.sensor_max), live_run.sensor_max, -np.inf)))
+            ax_additional.set_ylim(0, top * 1.1 if np.isfinite(top) and top > 0 else 1)
+
+            inlet, outlet, flow = series[0, t_index], series[1, t_index], series[2, t_index]
+            heat_flow = viewer.calculation_heat_flux_over_time(flow, inlet, outlet)
+            sensor_number, bms_id = live_run.sensor_identifiers[hottest]
+            status_text_obj.set_text(
+                f"Samples: {live_run.total_samples} \n"
+                f"Cell Range: {series[3, t_index]:.2f}°C\nLayer Range: {series[4, t_index]:.2f}°C\n"
+                f"Inlet: {inlet:.2f} °C | Outlet: {outlet:.2f} °C\nCoolant Flow: {flow:.2f} L/min | Q_HVB: {heat_flow:.2f} W\n"
+                f"Run Max: {live_run.sensor_max[hottest]:.2f}°C (Sensor {sensor_number}, BMS {bms_id})\n"
+            )
+
+            if cbar_list[0] is None and heatmap is not None:
+                colorbar = fig.colorbar(heatmap, cax=fig.add_axes([0.92, 0.33, 0.02, 0.4]))
+                colorbar.set_label("Temperature [°C]", fontsize=12)
+                cbar_list[0] = True
+            fig.canvas.draw_idle()
+        count("live.frames")
+
+    ani = FuncAnimation(fig, refresh, interval=1000 / refresh_hz, cache_frame_data=False)
+    # Keep references for as long as the figure exists, like fig.viewer_widgets in the viewer
+    fig.live_state = {'run': live_run, 'refresh': refresh, 'animation': ani}
+    if show:
+        plt.show()
+    return fig, live_run
+
+if __name__ == "__main__":
+    config_data = viewer.load_config("config.json") or {}
+
+    parser = argparse.ArgumentParser(description="Follow a run while it is being logged.")
+    parser.add_argument("--db-path", default=config_data.get("db_path", "mf4_data.db"), help="SQLite database being written to")
+    parser.add_argument("--lookup-table-path", default=config_data.get("lookup_table_path", "db_lookup_table.parquet"),
+                        help="Tells which database holds the run if db_path lists several")
+    parser.add_argument("--file-id", default=config_data.get("file_id"), help="Run to follow in the database")
+    parser.add_argument("--mf4-dir", default=None, help="Follow a directory of MF4 segments instead of the database")
+    parser.add_argument("--window", type=int, default=default_window, help="Number of samples kept in memory")
+    parser.add_argument("--refresh-hz", type=float, default=default_refresh_hz, help="Heatmap refreshes per second")
+    args = parser.parse_args()
+
+    if args.mf4_dir:
+        source = Mf4SegmentTail(args.mf4_dir)
+        title = args.mf4_dir
+    else:
+        # With several databases in config.json, the run is followed in the one the lookup table routes it to
+        try:
+            db_path = resolve_db_path(args.db_path, args.lookup_table_path, args.file_id)
+        except (OSError, ValueError) as e:
+            parser.error(f"{e}. Give the database being written to with --db-path.")
+        source = SqliteTail(db_path, args.file_id)
+        title = args.file_id
+    try:
+        live_view(source, window=args.window, refresh_hz=args.refresh_hz,
+                  vmin=config_data.get("vmin", 15.0), vmax=config_data.get("vmax", 40.0), title=title)
+    finally:
+        source.close()
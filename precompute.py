@@ -0,0 +1,158 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import thermal_dynamics_HVB as viewer
+from data_fingerprint import load_data_fingerprints
+from instrumentation import span
+from run_index import db_paths
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "helper_scripts"))
+from generate_lookup_table import generate_combined_lookup_table, generate_lookup_table
+
+# What was last precomputed for each run, to find the new and changed runs after an import
+manifest_path = os.path.join("data", "precompute_manifest.json")
+
+# Bump when the pipeline builds something new, so that all runs are processed again
+pipeline_version = 1
+
+# Cache files of a run in the order they depend on each other: each must be newer than the ones before it.
+# The comparison matrix of run_comparison.py only exists once the run was compared.
+def cache_chain(file_id):
+    return [os.path.join("data", f"temp_data_{file_id}.pkl"), os.path.join("data", f"flow_data_{file_id}.pkl"),
+            os.path.join("data", f"quality_{file_id}.npz"), os.path.join("data", f"temp_matrix_{file_id}.npy"),
+            os.path.join("data", f"events_{file_id}.npz"), os.path.join("data", f"derived_{file_id}.npz")]
+
+def refresh_lookup_table(db_path, lookup_table_path, force=False):
+    """Regenerate the lookup table if a database is newer than it. Returns True if it was rewritten."""
+    if (not force and os.path.exists(lookup_table_path)
+            and os.path.getmtime(lookup_table_path) > max(os.path.getmtime(path) for path in db_paths(db_path))):
+        return False
+    with span("precompute.lookup_table"):
+        lookup_table = generate_lookup_table(db_path) if isinstance(db_path, str) else generate_combined_lookup_table(db_path)
+        if lookup_table_path.endswith(".parquet"):
+            lookup_table.to_parquet(lookup_table_path, index=False)
+        else:
+            lookup_table.to_csv(lookup_table_path, index=False)
+    return True
+
+def run_fingerprints(db_path, lookup_table_path, lookup_table):
+    """Fingerprint of every run: its data fingerprint (see data_fingerprint.py) and the pipeline version.
+
+    The data fingerprints are written to data/run_fingerprints.json on the way, where batch_kpi_analytics.py,
+    thermal_model.py, run_similarity.py and fleet_percentiles.py read them instead of scanning the databases again.
+    """
+    data_fingerprints = load_data_fingerprints(db_path, lookup_table_path, lookup_table)
+    return {file_id: hashlib.sha1(f"{data_fingerprint}:{pipeline_version}".encode()).hexdigest()
+            for file_id, data_fingerprint in data_fingerprints.items()}
+
+def read_manifest(path=manifest_path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def write_manifest(manifest, path=manifest_path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+def revalidate_caches(file_id):
+    """Mark the caches of an unchanged run as current again after the database was written to.
+
+    All caches are only valid while they are newer than the database, so any import makes them stale. When the
+    run's own data did not change, its caches still hold, so they are touched in dependency order instead of rebuilt.
+    The mtimes only say that a cache is current; which runs changed is decided by the fingerprints.
+    Returns False if the extract cache is missing and the run has to be processed.
+    """
+    chain = [filename for filename in cache_chain(file_id) if os.path.exists(filename)]
+    if not all(filename in chain for filename in cache_chain(file_id)[:2]):
+        return False
+    now = time.time_ns()
+    for position, filename in enumerate(chain):
+        os.utime(filename, ns=(now + position * 1_000_000, now + position * 1_000_000))
+    return True
+
+def precompute_run(db_path, lookup_table_path, file_id, quality_thresholds=None, event_thresholds=None):
+    """Worker: build the extract cache, quality mask, event index and stored derived signals of one run.
+
+    Returns the seconds spent in each stage.
+    """
+    from derived_signals import DerivedSignals, save_signals
+    from event_index import load_event_index
+
+    timings = {}
+    start_time = time.perf_counter()
+    run_data = viewer.load_run(db_path, lookup_table_path, file_id, force_refresh=True, quality_thresholds=quality_thresholds)
+    temperatures, sensor_identifiers = run_data[:2]
+    timings["extract_s"] = time.perf_counter() - start_time
+    if len(temperatures) == 0:
+        return timings
+
+    stage_start = time.perf_counter()
+    load_event_index(file_id, temperatures, sensor_identifiers, viewer.sensors_per_module_list, viewer.custom_sensor_order,
+                     thresholds=event_thresholds, force_refresh=True)
+    timings["events_s"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    save_signals(file_id, DerivedSignals(run_data))
+    timings["derived_s"] = time.perf_counter() - stage_start
+    return timings
+
+def run_pipeline(db_path, lookup_table_path, workers=None, force=False, quality_thresholds=None, event_thresholds=None):
+    """Bring the lookup table and the caches of all runs up to date, processing only new and changed runs in parallel."""
+    pipeline_start = time.perf_counter()
+    if refresh_lookup_table(db_path, lookup_table_path, force=force):
+        print(f"Lookup table {lookup_table_path} regenerated in {time.perf_counter() - pipeline_start:.1f} s")
+    lookup_table = viewer.load_lookup_table(lookup_table_path)
+
+    with span("precompute.fingerprints"):
+        fingerprints = run_fingerprints(db_path, lookup_table_path, lookup_table)
+    settings = {"quality": quality_thresholds, "events": event_thresholds}
+    manifest = read_manifest()
+    todo = []
+    for file_id, fingerprint in fingerprints.items():
+        entry = manifest.get(file_id, {})
+        if (not force and entry.get("fingerprint") == fingerprint and entry.get("settings") == settings
+                and revalidate_caches(file_id)):
+            continue
+        todo.append(file_id)
+
+    print(f"{len(fingerprints)} runs, {len(todo)} new or changed, {len(fingerprints) - len(todo)} unchanged.")
+    failed = 0
+    with span("precompute.runs", runs=len(todo)), ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(precompute_run, db_path, lookup_table_path, file_id, quality_thresholds, event_thresholds): file_id
+                   for file_id in todo}
+        for done, future in enumerate(as_completed(futures), start=1):
+            file_id = futures[future]
+            try:
+                timings = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(todo)}] Error precomputing {file_id}: {e}")
+                continue
+            manifest[file_id] = {"fingerprint": fingerprints[file_id], "settings": settings}
+            stages = ", ".join(f"{name[:-2]} {seconds:.2f} s" for name, seconds in timings.items())
+            print(f"[{done}/{len(todo)}] {file_id}: {stages}")
+
+    # Runs that are no longer in the database are dropped from the manifest
+    write_manifest({file_id: entry for file_id, entry in manifest.items() if file_id in fingerprints})
+    print(f"Precomputed {len(todo) - failed} runs in {time.perf_counter() - pipeline_start:.1f} s"
+          + (f", {failed} failed" if failed else ""))
+
+if __name__ == "__main__":
+    config_data = viewer.load_config("config.json") or {}
+
+    parser = argparse.ArgumentParser(description="Refresh the lookup table and build the caches of new and changed runs.")
+    parser.add_argument("--db-path", default=config_data.get("db_path", "mf4_data.db"))
+    parser.add_argument("--lookup-table-path", default=config_data.get("lookup_table_path", "db_lookup_table.parquet"))
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Regenerate the lookup table and process all runs")
+    args = parser.parse_args()
+
+    run_pipeline(args.db_path, args.lookup_table_path, workers=args.workers, force=args.force,
+                 quality_thresholds=config_data.get("quality_thresholds"), event_thresholds=config_data.get("event_thresholds"))
@@ -0,0 +1,135 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from instrumentation import span, count
+
+def run_nbytes(run_data, seen=None):
+    """Approximate memory footprint of an extracted run (the numpy arrays it holds, also inside dicts)."""
+    # An array held twice (e.g. inlet in a served run's series) is counted once
+    seen = set() if seen is None else seen
+    nbytes = 0
+    for item in run_data:
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, np.ndarray):
+            nbytes += item.nbytes
+        elif isinstance(item, dict):
+            nbytes += run_nbytes(item.values(), seen)
+        elif isinstance(item, (list, tuple)):
+            nbytes += 64 * len(item)
+    return nbytes
+
+class RunCache:
+    """In-process LRU cache of extracted runs, bounded by a memory budget.
+
+    loader(file_id) returns the run data; prefetch() loads runs on a background thread. A run is loaded only once
+    at a time: a get() of a run that is being loaded waits for that load, whether it is a prefetch or another get().
+    derived(file_id) returns the run's DerivedSignals, which stay with the run, count towards the budget
+    and are evicted with it.
+    """
+
+    def __init__(self, loader, memory_budget_mb=1024, prefetch_workers=1):
+        self.loader = loader
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._runs = OrderedDict()
+        self._sizes = {}
+        self._derived = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="run-prefetch")
+
+    def __contains__(self, file_id):
+        with self._lock:
+            return file_id in self._runs
+
+    def memory_usage(self):
+        with self._lock:
+            return self._memory_usage()
+
+    def _memory_usage(self):
+        return sum(self._sizes.values()) + sum(derived.nbytes for derived in self._derived.values())
+
+    def cached_ids(self):
+        with self._lock:
+            return list(self._runs)
+
+    def get(self, file_id):
+        """Return the run, from the cache, from a running prefetch, or by loading it now."""
+        with self._lock:
+            if file_id in self._runs:
+                self._runs.move_to_end(file_id)
+                count("run_cache.hit")
+                return self._runs[file_id]
+            future = self._pending.get(file_id)
+            if future is None:
+                future = self._pending[file_id] = Future()
+                loading = True
+            else:
+                loading = False
+
+        if not loading:
+            count("run_cache.prefetch_wait")
+            return future.result()
+
+        count("run_cache.miss")
+        return self._load(file_id, future, "run_cache.load")
+
+    def derived(self, file_id):
+        """DerivedSignals of the run, created on first use; the signals themselves are computed when first read."""
+        from derived_signals import DerivedSignals
+        run_data = self.get(file_id)
+        with self._lock:
+            derived = self._derived.get(file_id)
+            if derived is None:
+                derived = self._derived[file_id] = DerivedSignals(run_data, file_id=file_id)
+            return derived
+
+    def prefetch(self, file_ids):
+        """Start loading the given runs in the background, skipping those already cached or loading."""
+        for file_id in file_ids:
+            with self._lock:
+                if file_id in self._runs or file_id in self._pending:
+                    continue
+                future = self._pending[file_id] = Future()
+            task = self._executor.submit(self._load, file_id, future, "run_cache.prefetch")
+            task.add_done_callback(lambda task, file_id=file_id, future=future: task.cancelled() and self._cancel(file_id, future))
+
+    def _load(self, file_id, future, span_name):
+        # Loads the run and hands it (or the error) to everyone waiting on future
+        try:
+            with span(span_name, file_id=file_id):
+                run_data = self.loader(file_id)
+            self._store(file_id, run_data)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(file_id, None)
+        future.set_result(run_data)
+        return run_data
+
+    def _cancel(self, file_id, future):
+        # A prefetch dropped by shutdown() never runs, so its waiters are released here
+        with self._lock:
+            self._pending.pop(file_id, None)
+        future.cancel()
+
+    def _store(self, file_id, run_data):
+        nbytes = run_nbytes(run_data)
+        with self._lock:
+            self._runs[file_id] = run_data
+            self._runs.move_to_end(file_id)
+            self._sizes[file_id] = nbytes
+
+            # Evict least recently used runs until the budget is met, but always keep the newest one
+            while len(self._runs) > 1 and self._memory_usage() > self.memory_budget:
+                evicted_id, _ = self._runs.popitem(last=False)
+                self._sizes.pop(evicted_id)
+                self._derived.pop(evicted_id, None)
+                count("run_cache.evict")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
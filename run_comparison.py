@@ -0,0 +1,138 @@
+import json
+import os
+import warnings
+import numpy as np
+from instrumentation import span, count
+
+# Views of a comparison, in the order of the viewer's selector
+comparison_views = ["A", "B", "A - B"]
+
+def matrix_filenames(file_id):
+    return os.path.join("data", f"temp_matrix_{file_id}.npy"), os.path.join("data", f"temp_matrix_{file_id}.json")
+
+def open_run_memmap(db_path, lookup_table_path, file_id, quality_thresholds=None):
+    """Run like thermal_dynamics_HVB.load_run, but with the temperature matrix memory-mapped from data/temp_matrix_<file_id>.npy.
+
+    The .npy file holds the quality-masked matrix and is rewritten when it is older than the database, the extract
+    cache or the quality mask, or was written with other quality thresholds. Processes that map the same file share
+    its pages through the operating system's file cache instead of each holding a copy.
+    """
+    import thermal_dynamics_HVB as viewer
+    from data_quality import default_quality_thresholds
+    from run_index import resolve_db_path
+
+    db_path = resolve_db_path(db_path, lookup_table_path, file_id)
+    matrix_filename, info_filename = matrix_filenames(file_id)
+    settings = {"quality_thresholds": dict(default_quality_thresholds, **(quality_thresholds or {}))}
+    sources = [db_path, os.path.join("data", f"temp_data_{file_id}.pkl"), os.path.join("data", f"quality_{file_id}.npz")]
+
+    is_current = os.path.exists(matrix_filename) and os.path.exists(info_filename) and all(
+        os.path.getmtime(matrix_filename) > os.path.getmtime(source) for source in sources if os.path.exists(source))
+    info = None
+    if is_current:
+        with open(info_filename) as f:
+            info = json.load(f)
+        is_current = info.get("settings") == settings
+
+    if is_current:
+        count("matrix.hit")
+        inlet_temp, outlet_temp, flow = viewer.extract_inlet_outlet_flow(
+            db_path, file_id, lookup_table_path, cache_filename=os.path.join("data", f"flow_data_{file_id}.pkl"))
+        sensor_identifiers = [tuple(sensor_identifier) for sensor_identifier in info["sensor_identifiers"]]
+    else:
+        count("matrix.miss")
+        temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow = viewer.load_run(
+            db_path, lookup_table_path, file_id, quality_thresholds=quality_thresholds)
+        with span("matrix.write", file_id=file_id):
+            np.save(matrix_filename, np.asarray(temperatures, dtype=np.float64))
+            with open(info_filename, "w") as f:
+                json.dump({"sensor_identifiers": sensor_identifiers, "settings": settings}, f)
+
+    temperatures = np.load(matrix_filename, mmap_mode="r")
+    return temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow
+
+def heat_flow(signals):
+    from thermal_dynamics_HVB import calculation_heat_flux_over_time
+    inlet_temp, outlet_temp, flow = signals
+    return calculation_heat_flux_over_time(flow, inlet_temp, outlet_temp)
+
+class RunComparison:
+    """Two runs aligned on a common relative time base, with their difference A - B.
+
+    Sample t of the comparison is sample t of A and sample t + offset of B (offset in samples, may be negative).
+    The sensors are matched by identifier in A's order; sensors that B lacks are NaN in B and in the difference.
+    The A and B views are slices of the (memory-mapped) inputs; only the difference is held in memory.
+    """
+
+    def __init__(self, run_a, run_b, file_id_a, file_id_b, offset=0):
+        self.file_ids = (file_id_a, file_id_b)
+        self.offset = offset
+        temperatures_a, self.sensor_identifiers, *signals_a = run_a
+        temperatures_b, sensor_identifiers_b, *signals_b = run_b
+
+        # Like the viewer, each run ends with its shortest signal
+        length_a = min([temperatures_a.shape[1]] + [len(signal) for signal in signals_a])
+        length_b = min([temperatures_b.shape[1]] + [len(signal) for signal in signals_b])
+        start_a, start_b = max(0, -offset), max(0, offset)
+        self.total_frames = max(0, min(length_a - start_a, length_b - start_b))
+        window_a = slice(start_a, start_a + self.total_frames)
+        window_b = slice(start_b, start_b + self.total_frames)
+
+        with span("compare.align", samples=self.total_frames):
+            self.temperatures_a = temperatures_a[:, window_a]
+            row_of_b = {sensor_identifier: row for row, sensor_identifier in enumerate(sensor_identifiers_b)}
+            rows_b = np.array([row_of_b.get(sensor_identifier, -1) for sensor_identifier in self.sensor_identifiers], dtype=np.int64)
+            if np.array_equal(rows_b, np.arange(len(sensor_identifiers_b))):
+                self.temperatures_b = temperatures_b[:, window_b]  # Same sensors in the same order: stays a view
+            else:
+                self.temperatures_b = np.full(self.temperatures_a.shape, np.nan)
+                self.temperatures_b[rows_b >= 0] = temperatures_b[rows_b[rows_b >= 0], window_b]
+            self.signals_a = [np.asarray(signal[window_a], dtype=float) for signal in signals_a]
+            self.signals_b = [np.asarray(signal[window_b], dtype=float) for signal in signals_b]
+
+        with span("compare.delta", samples=self.total_frames):
+            self.delta = np.subtract(self.temperatures_a, self.temperatures_b)
+            self.signals_delta = [signal_a - signal_b for signal_a, signal_b in zip(self.signals_a, self.signals_b)]
+            self.heat_flow_delta = heat_flow(self.signals_a) - heat_flow(self.signals_b)
+            with warnings.catch_warnings():
+                # Samples where every sensor is NaN are expected and yield NaN
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                absolute_delta = np.abs(self.delta)
+                self.mean_delta = np.nanmean(self.delta, axis=0)
+                self.max_abs_delta = np.nanmax(absolute_delta, axis=0)
+                self.sensor_mean_delta = np.nanmean(self.delta, axis=1)
+                self.sensor_max_abs_delta = np.nanmax(absolute_delta, axis=1)
+
+        # Symmetric colour range of the difference heatmap, robust against single outliers
+        finite = self.max_abs_delta[np.isfinite(self.max_abs_delta)]
+        self.delta_limit = float(np.ceil(np.percentile(finite, 99))) if len(finite) else 1.0
+        self.delta_limit = max(self.delta_limit, 1.0)
+        self._derived = {}
+
+    def view(self, name):
+        """(temperatures, sensor identifiers, inlet, outlet, flow) of one of comparison_views."""
+        if name == "A":
+            return (self.temperatures_a, self.sensor_identifiers, *self.signals_a)
+        if name == "B":
+            return (self.temperatures_b, self.sensor_identifiers, *self.signals_b)
+        if name == "A - B":
+            return (self.delta, self.sensor_identifiers, *self.signals_delta)
+        raise ValueError(f"Unknown view {name!r}, expected one of {comparison_views}")
+
+    def derived(self, name):
+        """DerivedSignals of one of comparison_views, computed on first use and kept while the comparison is open."""
+        from derived_signals import DerivedSignals
+        if name not in self._derived:
+            self._derived[name] = DerivedSignals(self.view(name))
+        return self._derived[name]
+
+    def describe(self):
+        file_id_a, file_id_b = self.file_ids
+        shift = f", B shifted by {self.offset} s" if self.offset else ""
+        return f"A: {file_id_a}  B: {file_id_b}{shift}"
+
+def compare_runs(db_path, lookup_table_path, file_id_a, file_id_b, offset=0, quality_thresholds=None):
+    """RunComparison of two runs, read through their memory-mapped temperature matrices."""
+    run_a = open_run_memmap(db_path, lookup_table_path, file_id_a, quality_thresholds)
+    run_b = open_run_memmap(db_path, lookup_table_path, file_id_b, quality_thresholds)
+    return RunComparison(run_a, run_b, file_id_a, file_id_b, offset)
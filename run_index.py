@@ -0,0 +1,94 @@
+import json
+import os
+import re
+
+# Cached list of the runs in a lookup table, so settings.py and the viewer don't have to read the whole table
+run_index_path = os.path.join("data", "run_index.json")
+
+# Lookup table column with each run's source database, written when the table is generated from several databases
+db_path_column = 'DB.Path'
+
+def natural_sort_key(s):
+    # Split the string into parts with numbers as integers for natural sorting
+    return [int(text) if text.isdigit() else text for text in re.split(r'(\d+)', s)]
+
+def clean_file_id(file_id):
+    return str(file_id).strip("[]'\"")
+
+def read_run_index(lookup_table_path):
+    """Read the unique File.ID values, and each run's source database if the table has one, reading only those columns.
+
+    Returns the naturally sorted run IDs and {file_id: database path}.
+    """
+    if lookup_table_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        columns = ['File.ID'] + ([db_path_column] if db_path_column in pq.read_schema(lookup_table_path).names else [])
+        pairs = pq.read_table(lookup_table_path, columns=columns).group_by(columns).aggregate([]).to_pylist()
+    else:
+        import pandas as pd
+        header = pd.read_csv(lookup_table_path, nrows=0).columns
+        columns = ['File.ID'] + ([db_path_column] if db_path_column in header else [])
+        pairs = pd.read_csv(lookup_table_path, usecols=columns).drop_duplicates().to_dict("records")
+
+    # Clean the strings and apply natural sorting
+    sources = {}
+    for pair in pairs:
+        if pair['File.ID'] is not None:
+            sources.setdefault(clean_file_id(pair['File.ID']), pair.get(db_path_column))
+    file_ids = sorted(sources, key=natural_sort_key)
+    return file_ids, {file_id: source for file_id, source in sources.items() if isinstance(source, str)}
+
+def read_file_ids(lookup_table_path):
+    """Read the naturally sorted unique File.ID values from the lookup table."""
+    return read_run_index(lookup_table_path)[0]
+
+def load_run_index(lookup_table_path, index_path=run_index_path):
+    """Return {"file_ids": [...], "sources": {file_id: database}} of the lookup table, using the cached run index if it is up to date."""
+    stat = os.stat(lookup_table_path)
+    key = {"lookup_table_path": os.path.abspath(lookup_table_path), "mtime": stat.st_mtime, "size": stat.st_size}
+
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index.get("key") == key and "sources" in index:
+            return index
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    file_ids, sources = read_run_index(lookup_table_path)
+    index = {"key": key, "file_ids": file_ids, "sources": sources}
+    try:
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        with open(index_path, 'w') as f:
+            json.dump(index, f, indent=4)
+    except OSError as e:
+        print(f"Could not write run index {index_path}: {e}")
+    return index
+
+def load_file_ids(lookup_table_path, index_path=run_index_path):
+    """Return the naturally sorted run IDs of the lookup table, using the cached run index if it is up to date."""
+    return load_run_index(lookup_table_path, index_path)["file_ids"]
+
+def db_paths(db_path):
+    """The configured databases as a list; db_path is one path or a list of paths (e.g. one database per test bench)."""
+    return [db_path] if isinstance(db_path, str) else list(db_path)
+
+def resolve_db_path(db_path, lookup_table, file_id):
+    """The database that holds file_id.
+
+    With a single database that is db_path itself. With several, the run is routed through the lookup table's
+    DB.Path column (a path, read through the cached run index, or the loaded table), so only that one database
+    is opened, however many are registered.
+    """
+    if isinstance(db_path, str):
+        return db_path
+    if isinstance(lookup_table, str):
+        source = load_run_index(lookup_table)["sources"].get(file_id)
+    else:
+        rows = lookup_table[lookup_table['File.ID'] == file_id]
+        source = rows[db_path_column].iloc[0] if db_path_column in rows and len(rows) else None
+    if source is None:
+        if len(db_path) == 1:
+            return db_path[0]
+        raise ValueError(f"The lookup table does not say which database holds {file_id}; regenerate it from {db_paths(db_path)}")
+    return source
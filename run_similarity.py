@@ -0,0 +1,175 @@
+import argparse
+import os
+import time
+import warnings
+import numpy as np
+import thermal_dynamics_HVB as viewer
+from data_fingerprint import current_fingerprints
+from derived_signals import DerivedSignals
+from incremental import compute_in_pool, unchanged_runs
+from run_index import load_file_ids
+
+# Bump when the features change, so that the index is rebuilt
+feature_version = 1
+
+# Pack temperature histogram: fraction of all sensor samples per bin
+hist_edges_c = np.linspace(10.0, 60.0, 26)
+
+# Curves are resampled to this many points, so that runs of different length are comparable
+curve_points = 32
+
+# Per-sample derived signals that are resampled into curves
+curve_signals = ["cell_mean", "cell_max", "cell_range", "layer_range", "heat_flow"]
+
+# Feature blocks in the order of the feature vector, and their length
+feature_blocks = [("temperature_histogram", len(hist_edges_c) - 1)] + [(name, curve_points) for name in curve_signals]
+
+default_index_path = os.path.join("data", "run_similarity.npz")
+
+def resample_curve(values, points=curve_points):
+    """Mean of values over points equal parts of the run, NaN-aware."""
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return np.full(points, np.nan)
+    part = np.arange(len(values)) * points // len(values)
+    finite = np.isfinite(values)
+    sums = np.bincount(part, weights=np.where(finite, values, 0.0), minlength=points)
+    counts = np.bincount(part, weights=finite.astype(float), minlength=points)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+def run_features(run_data, file_id=None):
+    """Feature vector of one run, the blocks of feature_blocks concatenated."""
+    derived = DerivedSignals(run_data, file_id=file_id)
+    temperatures = derived["temperatures"]
+    histogram, _ = np.histogram(temperatures[np.isfinite(temperatures)], bins=hist_edges_c)
+    histogram = histogram / max(histogram.sum(), 1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        curves = [resample_curve(derived[name]) for name in curve_signals]
+    return np.concatenate([histogram] + curves)
+
+def extract_features(db_path, lookup_table_path, file_id, quality_thresholds=None):
+    """Worker: features of one run, loaded through the extract cache."""
+    run_data = viewer.load_run(db_path, lookup_table_path, file_id, quality_thresholds=quality_thresholds)
+    return run_features(run_data, file_id)
+
+class SimilarityIndex:
+    """Feature vectors of all runs and their nearest-neighbour search.
+
+    Every feature is standardized over the index, and every block weighted by 1 / sqrt(its length), so that
+    the histogram and each curve count equally. A query is one distance computation against all runs, which
+    for a few thousand runs of a few hundred features takes a few milliseconds.
+    """
+
+    def __init__(self, file_ids, features, fingerprints):
+        self.file_ids = list(file_ids)
+        self.features = np.asarray(features, dtype=float).reshape(len(self.file_ids), -1)
+        self.fingerprints = list(fingerprints)
+        self._prepare()
+
+    def _prepare(self):
+        weights = np.concatenate([np.full(length, 1.0 / np.sqrt(length)) for _, length in feature_blocks])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            mean = np.nanmean(self.features, axis=0) if len(self.file_ids) else np.zeros(len(weights))
+            std = np.nanstd(self.features, axis=0) if len(self.file_ids) else np.ones(len(weights))
+        self._mean = np.nan_to_num(mean)
+        self._scale = weights / np.where(np.nan_to_num(std) > 0, std, 1.0)
+        self._scaled = self.scale(self.features)
+        self._row_of = {file_id: row for row, file_id in enumerate(self.file_ids)}
+
+    def scale(self, features):
+        # Missing features (e.g. no coolant signals) sit at the index mean and add no distance
+        return np.nan_to_num((features - self._mean) * self._scale)
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def __contains__(self, file_id):
+        return file_id in self._row_of
+
+    def query(self, file_id=None, features=None, k=5):
+        """The k runs closest to a run of the index (or to a feature vector), as [(file_id, distance)], closest first."""
+        if features is None:
+            query = self._scaled[self._row_of[file_id]]
+        else:
+            query = self.scale(np.asarray(features, dtype=float))
+        distances = np.sqrt(np.einsum("rf,rf->r", self._scaled - query, self._scaled - query))
+        if file_id is not None and file_id in self._row_of:
+            distances[self._row_of[file_id]] = np.inf  # The run itself is not a result
+        k = min(k, np.count_nonzero(np.isfinite(distances)))
+        nearest = np.argpartition(distances, k - 1)[:k] if k > 0 else np.empty(0, dtype=int)
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [(self.file_ids[row], float(distances[row])) for row in nearest]
+
+    def save(self, path):
+        np.savez(path, file_ids=np.array(self.file_ids, dtype=str), features=self.features,
+                 fingerprints=np.array(self.fingerprints, dtype=str), version=feature_version)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            # Indexes of other feature versions, or without fingerprints, are rebuilt
+            if int(stored["version"]) != feature_version or "fingerprints" not in stored:
+                return cls([], np.empty((0, sum(length for _, length in feature_blocks))), [])
+            return cls(stored["file_ids"].tolist(), stored["features"], stored["fingerprints"].tolist())
+
+def build_index(db_path, lookup_table_path, index_path=default_index_path, workers=None, force=False, quality_thresholds=None):
+    """Extract the features of all runs in parallel and store them. Runs unchanged since the last build are kept."""
+    file_ids = load_file_ids(lookup_table_path)
+    fingerprints = current_fingerprints(db_path, lookup_table_path, file_ids, quality=quality_thresholds, version=feature_version)
+    previous = SimilarityIndex.load(index_path) if os.path.exists(index_path) else None
+
+    # Features are kept while the run's data and the quality thresholds are unchanged
+    stored_rows = {file_id: row for row, file_id in enumerate(previous.file_ids)} if previous is not None else {}
+    unchanged = unchanged_runs(fingerprints, {file_id: previous.fingerprints[row] for file_id, row in stored_rows.items()}, force)
+    features = {file_id: previous.features[stored_rows[file_id]] for file_id in unchanged}
+    todo = {file_id: (db_path, lookup_table_path, file_id, quality_thresholds) for file_id in file_ids if file_id not in unchanged}
+
+    print(f"{len(file_ids)} runs, {len(todo)} to index, {len(unchanged)} unchanged.")
+    features.update(compute_in_pool(extract_features, todo, workers, span_name="similarity.build", action="indexing"))
+
+    indexed = [file_id for file_id in file_ids if file_id in features]
+    index = SimilarityIndex(indexed, [features[file_id] for file_id in indexed], [fingerprints[file_id] for file_id in indexed])
+    index.save(index_path)
+    print(f"Similarity index of {len(index)} runs saved to {index_path}")
+    return index
+
+def load_index(index_path=default_index_path):
+    """Stored index, or None if it has not been built yet."""
+    if not os.path.exists(index_path):
+        return None
+    return SimilarityIndex.load(index_path)
+
+def print_similar(index, file_id, k):
+    start_time = time.perf_counter()
+    results = index.query(file_id, k=k)
+    elapsed = time.perf_counter() - start_time
+    print(f"Runs most similar to {file_id} ({elapsed * 1000:.2f} ms):")
+    for rank, (similar_id, distance) in enumerate(results, start=1):
+        print(f"{rank:3d}. {similar_id}  distance {distance:.3f}")
+
+if __name__ == "__main__":
+    config_data = viewer.load_config("config.json") or {}
+
+    parser = argparse.ArgumentParser(description="Index all runs by their thermal behaviour and find the runs most similar to a given one.")
+    parser.add_argument("--db-path", default=config_data.get("db_path", "mf4_data.db"))
+    parser.add_argument("--lookup-table-path", default=config_data.get("lookup_table_path", "db_lookup_table.parquet"))
+    parser.add_argument("--index", default=default_index_path, help="Stored feature vectors")
+    parser.add_argument("--query", default=None, metavar="FILE_ID", help="Print the runs most similar to this run (uses the stored index)")
+    parser.add_argument("-k", type=int, default=5, help="Number of similar runs to print")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Re-extract the features of all runs")
+    args = parser.parse_args()
+
+    if args.query and os.path.exists(args.index) and not args.force:
+        index = SimilarityIndex.load(args.index)
+    else:
+        index = build_index(args.db_path, args.lookup_table_path, args.index, workers=args.workers, force=args.force,
+                            quality_thresholds=config_data.get("quality_thresholds"))
+    if args.query:
+        if args.query in index:
+            print_similar(index, args.query, args.k)
+        else:
+            print(f"{args.query} is not in the index, rebuild it with: python run_similarity.py")
@@ -0,0 +1,155 @@
+import numpy as np
+from instrumentation import span, count
+
+# Samples combined per step of the pyramid
+pyramid_factor = 4
+
+# Levels are added until a row has at most this many points
+pyramid_min_points = 1000
+
+# Points drawn per line in the trace panel; the finest level that stays below this is used
+trace_max_points = 4000
+
+class DecimationPyramid:
+    """Min/max envelopes of the rows of a (rows x time) matrix at coarser and coarser time steps.
+
+    Level 0 is the row itself (low and high are the same array), level k holds the minimum and maximum of
+    every pyramid_factor**k samples. The levels of a row are built the first time it is drawn, which takes a few
+    milliseconds even for a 10-hour run. A window at any level is a slice, so drawing a trace copies
+    nothing from the run.
+    """
+
+    def __init__(self, matrix, factor=pyramid_factor, min_points=pyramid_min_points):
+        self.matrix = matrix
+        self.factor = factor
+        self.min_points = min_points
+        self.total_samples = matrix.shape[1]
+        self._levels = {}
+
+    def levels(self, row):
+        """[(low, high)] of one row, finest first."""
+        if row not in self._levels:
+            count("trace.pyramid_build")
+            low = high = self.matrix[row]
+            levels = [(low, high)]
+            while len(low) > self.min_points:
+                low, high = self._reduce(low, np.fmin), self._reduce(high, np.fmax)
+                levels.append((low, high))
+            self._levels[row] = levels
+        return self._levels[row]
+
+    def _reduce(self, values, reduction):
+        # Pad with NaN to a whole number of steps, fmin/fmax ignore NaN as long as one value is valid
+        steps = -(-len(values) // self.factor)
+        padded = np.full(steps * self.factor, np.nan)
+        padded[:len(values)] = values
+        return reduction.reduce(padded.reshape(steps, self.factor), axis=1)
+
+    @property
+    def nbytes(self):
+        # Level 0 belongs to the run
+        return sum(low.nbytes + high.nbytes for levels in self._levels.values() for low, high in levels[1:])
+
+    def window(self, row, start, stop, max_points=trace_max_points):
+        """(sample index, low, high) of one row between samples start and stop, at the finest level with at most max_points."""
+        start, stop = max(0, int(start)), min(self.total_samples, int(np.ceil(stop)))
+        levels = self.levels(row)
+        level = 0
+        while level + 1 < len(levels) and (stop - start) / self.factor ** level > max_points:
+            level += 1
+        size = self.factor ** level
+        first, last = start // size, -(-stop // size)
+        low, high = levels[level]
+        count(f"trace.level{level}")
+        return np.arange(first, last) * size, low[first:last], high[first:last]
+
+def sensor_row_at(grid, extent, x, y):
+    """Matrix row of the sensor drawn at (x, y) in a layer's heatmap, or None."""
+    x_start, x_end, y_start, y_end = extent
+    rows, columns = grid.shape
+    column = int(np.floor((x - x_start) / (x_end - x_start) * columns))
+    row = int(np.floor((y - y_start) / (y_end - y_start) * rows))  # The heatmap is drawn with origin='lower'
+    if not (0 <= row < rows and 0 <= column < columns) or grid[row, column] < 0:
+        return None
+    return int(grid[row, column])
+
+class SensorTracePanel:
+    """Window with the whole-run trace of one sensor and the coolant inlet/outlet temperatures.
+
+    The lines come from the run's decimation pyramids (see derived_signals.py) and are redrawn from a finer level
+    whenever the visible time range changes, so zooming into the trace shows the individual samples.
+    """
+
+    def __init__(self):
+        self.fig = None
+        self.derived = None
+        self.sensor_identifier = None
+
+    def show(self, derived, row, t_index):
+        import matplotlib.pyplot as plt
+
+        self.derived = derived
+        self.sensor_identifier = derived.sensor_identifiers[row]
+        self.row = row
+        if self.fig is None:
+            self.fig, self.ax = plt.subplots(figsize=(10, 4))
+            self.fig.canvas.mpl_connect('close_event', self.on_close)
+            self.band = None
+            self.line_sensor, = self.ax.plot([], [], color='black', linewidth=0.8, label='Sensor')
+            self.line_inlet, = self.ax.plot([], [], color='tab:blue', linewidth=0.8, label='Inlet')
+            self.line_outlet, = self.ax.plot([], [], color='tab:red', linewidth=0.8, label='Outlet')
+            self.time_line = self.ax.axvline(0, color='tab:orange', linewidth=1)
+            self.ax.set_xlabel('Time [s]')
+            self.ax.set_ylabel('Temperature [°C]')
+            self.ax.legend(loc='upper left')
+            self.ax.callbacks.connect('xlim_changed', lambda ax: self.redraw())
+
+        sensor_number, bms_id = self.sensor_identifier
+        self.ax.set_title(f"Sensor {sensor_number}, BMS {bms_id}")
+        with span("trace.show", sensor=sensor_number):
+            self.ax.set_xlim(0, max(derived.total_frames - 1, 1))  # Triggers redraw()
+            self.set_time(t_index)
+            self.ax.relim()
+            self.ax.autoscale_view(scalex=False)
+        self.fig.show()
+
+    def redraw(self):
+        if self.derived is None:
+            return
+        start, stop = self.ax.get_xlim()
+        stop += 1
+        time, low, high = self.derived["trace_pyramid"].window(self.row, start, stop)
+        self.line_sensor.set_data(time, high)
+        if self.band is not None:
+            self.band.remove()
+        # Where the samples are combined, the band shows the range between minimum and maximum
+        self.band = self.ax.fill_between(time, low, high, color='black', alpha=0.3, linewidth=0)
+        for row, line in enumerate((self.line_inlet, self.line_outlet)):
+            time, low, high = self.derived["coolant_pyramid"].window(row, start, stop)
+            line.set_data(time, (low + high) / 2)
+        self.fig.canvas.draw_idle()
+
+    def set_time(self, t_index):
+        if self.fig is not None:
+            self.time_line.set_xdata([t_index, t_index])
+            self.fig.canvas.draw_idle()
+
+    def set_run(self, derived, t_index):
+        """Follow a run switch: show the same sensor in the new run, if it has it."""
+        if self.fig is None:
+            return
+        if self.sensor_identifier in derived.sensor_identifiers:
+            self.show(derived, derived.sensor_identifiers.index(self.sensor_identifier), t_index)
+        else:
+            self.derived = None
+            for line in (self.line_sensor, self.line_inlet, self.line_outlet):
+                line.set_data([], [])
+            if self.band is not None:
+                self.band.remove()
+                self.band = None
+            self.ax.set_title(f"Sensor {self.sensor_identifier[0]}, BMS {self.sensor_identifier[1]}: not in this run")
+            self.fig.canvas.draw_idle()
+
+    def on_close(self, event):
+        self.fig = None
+        self.derived = None
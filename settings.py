@@ -1,21 +1,10 @@
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import ttk
-import pandas as pd
-import re
 import json
-
-def load_file_ids(lookup_table_path):
-    # Load lookup table (Parquet or CSV)
-    if lookup_table_path.endswith(".parquet"):
-        lookup_table = pd.read_parquet(lookup_table_path)
-    else:
-        lookup_table = pd.read_csv(lookup_table_path)
-
-    # Get unique file IDs, clean the strings, and apply natural sorting
-    file_ids = [str(file_id).strip("[]'\"") for file_id in lookup_table['File.ID'].unique()]
-    file_ids.sort(key=natural_sort_key)
-    return file_ids
+import time
+# Only the File.ID and DB.Path columns are read, and only if the cached run index is out of date
+from run_index import load_run_index
 
 def save_to_json(data, json_filename="config.json"):
     """Save dictionary to a JSON file."""
@@ -23,19 +12,26 @@ def save_to_json(data, json_filename="config.json"):
         json.dump(data, f, indent=4)
     print(f"Configuration saved to {json_filename}")
 
-def natural_sort_key(s):
-    # Split the string into parts with numbers as integers for natural sorting
-    return [int(text) if text.isdigit() else text for text in re.split(r'(\d+)', s)]
+def parse_db_paths(text):
+    # Several databases (e.g. one per test bench) are separated by ';' and saved as a list
+    paths = [path.strip() for path in text.split(";") if path.strip()]
+    return paths[0] if len(paths) == 1 else paths
 
 def update_variables():
+    from thermal_dynamics_HVB import load_config
+
+    # Settings that are not in the form (cache_codec, quality_thresholds, ...) are kept
+    config_data = load_config("config.json") or {}
+
     # Get values from the tkinter entries
-    config_data = {
-        "db_path": db_path_entry.get(),
+    config_data.update({
+        "db_path": parse_db_paths(db_path_entry.get()),
         "lookup_table_path": lookup_table_entry.get(),
         "file_id": file_id_var.get(),
         "vmin": float(vmin_entry.get()),
-        "vmax": float(vmax_entry.get())
-    }
+        "vmax": float(vmax_entry.get()),
+        "run_cache_mb": int(run_cache_entry.get())
+    })
 
     # Save the configuration data to a JSON file
     save_to_json(config_data)
@@ -53,70 +49,90 @@ def browse_file(entry_field):
     entry_field.delete(0, tk.END)
     entry_field.insert(0, filename)
 
-# Initial setup for default values
-db_path = "mf4_data.db"
-lookup_table_path = "db_lookup_table.parquet"  # or 'db_lookup_table.csv'
-file_id = "TCP0014_Run17_01.MF4"
-vmin = 15
-vmax = 40
-
-# tkinter setup
-root = tk.Tk()
-root.title("Heatmap Configuration")
-
-# DB Path input
-tk.Label(root, text="Database Path (db_path):").grid(row=0, column=0, sticky=tk.W)
-db_path_entry = tk.Entry(root, width=40)
-db_path_entry.grid(row=0, column=1)
-db_path_entry.insert(0, db_path)
-
-# Browse button for DB path
-browse_db_button = tk.Button(root, text="Browse", command=lambda: browse_file(db_path_entry))
-browse_db_button.grid(row=0, column=2)
-
-# Lookup Table Path input
-tk.Label(root, text="Lookup Table Path (lookup_table_path):").grid(row=1, column=0, sticky=tk.W)
-lookup_table_entry = tk.Entry(root, width=40)
-lookup_table_entry.grid(row=1, column=1)
-lookup_table_entry.insert(0, lookup_table_path)
-
-# Browse button for lookup table path
-browse_lookup_button = tk.Button(root, text="Browse", command=lambda: browse_file(lookup_table_entry))
-browse_lookup_button.grid(row=1, column=2)
-
-# File ID dropdown
-tk.Label(root, text="File ID:").grid(row=2, column=0, sticky=tk.W)
-file_id_var = tk.StringVar(root)
-
-# Load unique file IDs from the lookup table
-try:
-    file_ids = load_file_ids(lookup_table_path)
-    file_id_var.set(file_ids[0])  # Set default value
-    file_id_dropdown = ttk.Combobox(root, textvariable=file_id_var, values=file_ids)
-    file_id_dropdown.grid(row=2, column=1)
-except Exception as e:
-    print(f"Error loading file IDs: {e}")
-    file_id_dropdown = ttk.Combobox(root, textvariable=file_id_var, values=[])
-    file_id_dropdown.grid(row=2, column=1)
-
-# Min/Max heatmap values
-tk.Label(root, text="Heatmap Min Value (vmin):").grid(row=3, column=0, sticky=tk.W)
-vmin_entry = tk.Entry(root)
-vmin_entry.grid(row=3, column=1)
-vmin_entry.insert(0, str(vmin))
-
-tk.Label(root, text="Heatmap Max Value (vmax):").grid(row=4, column=0, sticky=tk.W)
-vmax_entry = tk.Entry(root)
-vmax_entry.grid(row=4, column=1)
-vmax_entry.insert(0, str(vmax))
-
-# Update button
-update_button = tk.Button(root, text="Save to JSON", command=update_variables)
-update_button.grid(row=5, column=1, pady=10)
-
-try:
-    root.mainloop()
-except Exception as e:
-    print(f"Error encountered: {e}")
-
-# After the tkinter window is closed, the variables will be updated and saved to a JSON file.
\ No newline at end of file
+def browse_databases(entry_field):
+    # Several databases can be selected at once, the runs of all of them are then listed together
+    filenames = filedialog.askopenfilenames(filetypes=[("SQLite Databases", "*.db")])
+    if filenames:
+        entry_field.delete(0, tk.END)
+        entry_field.insert(0, ";".join(filenames))
+
+if __name__ == "__main__":
+    # Initial setup for default values
+    db_path = "mf4_data.db"
+    lookup_table_path = "db_lookup_table.parquet"  # or 'db_lookup_table.csv'
+    file_id = "TCP0014_Run17_01.MF4"
+    vmin = 15
+    vmax = 40
+    run_cache_mb = 1024  # Memory budget for runs kept loaded in the viewer
+
+    # tkinter setup
+    root = tk.Tk()
+    root.title("Heatmap Configuration")
+
+    # DB Path input
+    tk.Label(root, text="Database Path(s) (db_path, separated by ';'):").grid(row=0, column=0, sticky=tk.W)
+    db_path_entry = tk.Entry(root, width=40)
+    db_path_entry.grid(row=0, column=1)
+    db_path_entry.insert(0, db_path)
+
+    # Browse button for DB path
+    browse_db_button = tk.Button(root, text="Browse", command=lambda: browse_databases(db_path_entry))
+    browse_db_button.grid(row=0, column=2)
+
+    # Lookup Table Path input
+    tk.Label(root, text="Lookup Table Path (lookup_table_path):").grid(row=1, column=0, sticky=tk.W)
+    lookup_table_entry = tk.Entry(root, width=40)
+    lookup_table_entry.grid(row=1, column=1)
+    lookup_table_entry.insert(0, lookup_table_path)
+
+    # Browse button for lookup table path
+    browse_lookup_button = tk.Button(root, text="Browse", command=lambda: browse_file(lookup_table_entry))
+    browse_lookup_button.grid(row=1, column=2)
+
+    # File ID dropdown
+    tk.Label(root, text="File ID:").grid(row=2, column=0, sticky=tk.W)
+    file_id_var = tk.StringVar(root)
+
+    # Load unique file IDs from the lookup table
+    try:
+        start_time = time.perf_counter()
+        # With a lookup table generated from several databases, the runs of all of them are listed
+        run_index = load_run_index(lookup_table_path)
+        file_ids = run_index["file_ids"]
+        databases = len(set(run_index["sources"].values())) or 1
+        print(f"Loaded {len(file_ids)} file IDs of {databases} database(s) in {time.perf_counter() - start_time:.3f} seconds")
+        file_id_var.set(file_ids[0])  # Set default value
+        file_id_dropdown = ttk.Combobox(root, textvariable=file_id_var, values=file_ids)
+        file_id_dropdown.grid(row=2, column=1)
+    except Exception as e:
+        print(f"Error loading file IDs: {e}")
+        file_id_dropdown = ttk.Combobox(root, textvariable=file_id_var, values=[])
+        file_id_dropdown.grid(row=2, column=1)
+
+    # Min/Max heatmap values
+    tk.Label(root, text="Heatmap Min Value (vmin):").grid(row=3, column=0, sticky=tk.W)
+    vmin_entry = tk.Entry(root)
+    vmin_entry.grid(row=3, column=1)
+    vmin_entry.insert(0, str(vmin))
+
+    tk.Label(root, text="Heatmap Max Value (vmax):").grid(row=4, column=0, sticky=tk.W)
+    vmax_entry = tk.Entry(root)
+    vmax_entry.grid(row=4, column=1)
+    vmax_entry.insert(0, str(vmax))
+
+    # Memory budget of the viewer's run cache
+    tk.Label(root, text="Run Cache Size in MB (run_cache_mb):").grid(row=5, column=0, sticky=tk.W)
+    run_cache_entry = tk.Entry(root)
+    run_cache_entry.grid(row=5, column=1)
+    run_cache_entry.insert(0, str(run_cache_mb))
+
+    # Update button
+    update_button = tk.Button(root, text="Save to JSON", command=update_variables)
+    update_button.grid(row=6, column=1, pady=10)
+
+    try:
+        root.mainloop()
+    except Exception as e:
+        print(f"Error encountered: {e}")
+
+    # After the tkinter window is closed, the variables will be updated and saved to a JSON file.
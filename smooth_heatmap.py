@@ -0,0 +1,70 @@
+import functools
+import numpy as np
+
+# Output pixels per sensor cell in each direction
+pixels_per_cell = 12
+
+# Radius of influence of a sensor, in cell spacings. Every pixel lies within half a cell diagonal of a sensor,
+# so each pixel gets at least one neighbour as long as this is above 0.71
+influence_radius_cells = 1.5
+
+class LayerInterpolator:
+    """Precomputed interpolation of one layer's sensor values onto a regular high-resolution pixel grid.
+
+    The weights are Franke-Little (modified Shepard) weights, w = ((R - d)+ / (R d))^2. They are zero beyond the
+    radius R, so every pixel only depends on the few sensors around it and the weight matrix is sparse. It is stored
+    in ELLPACK form: for every pixel the indices and weights of its neighbouring sensors, padded with weight 0.
+    Missing sensors (NaN) are skipped by renormalizing the weights of the others in the same mat-vec.
+    """
+
+    def __init__(self, positions, extent, shape, radius):
+        positions = np.asarray(positions, dtype=float)
+        x_start, x_end, y_start, y_end = extent
+        height, width = shape
+        pixel_x = x_start + (np.arange(width) + 0.5) * (x_end - x_start) / width
+        pixel_y = y_start + (np.arange(height) + 0.5) * (y_end - y_start) / height
+        pixels = np.column_stack([np.tile(pixel_x, height), np.repeat(pixel_y, width)])
+
+        distances = np.hypot(pixels[:, None, 0] - positions[None, :, 0], pixels[:, None, 1] - positions[None, :, 1])
+        distances = np.maximum(distances, 1e-9 * radius)  # A pixel exactly on a sensor takes (almost) only its value
+        weights = (np.clip(radius - distances, 0, None) / (radius * distances)) ** 2
+
+        # Keep only the non-zero weights of each pixel
+        neighbours = int(np.count_nonzero(weights, axis=1).max())
+        order = np.argsort(-weights, axis=1)[:, :neighbours]
+        self.indices = order
+        self.weights = np.take_along_axis(weights, order, axis=1)
+        self.shape = shape
+
+    @property
+    def nnz(self):
+        return int(np.count_nonzero(self.weights))
+
+    def field(self, values):
+        """High-resolution field (height x width) of the sensor values, NaN where no sensor value is near."""
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        # Weighted sum and sum of weights of the valid sensors as one mat-vec with two right-hand sides
+        right_hand_sides = np.column_stack([np.where(valid, values, 0.0), valid])
+        sums = np.einsum("pk,pkc->pc", self.weights, right_hand_sides[self.indices])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            field = sums[:, 0] / sums[:, 1]
+        return field.reshape(self.shape)
+
+def cell_centres(grid_shape, extent):
+    """Positions of the sensors of a (rows x columns) layer grid, the centres of their cells within extent."""
+    rows, columns = grid_shape
+    x_start, x_end, y_start, y_end = extent
+    cell_width = (x_end - x_start) / columns
+    cell_height = (y_end - y_start) / rows
+    row_index, column_index = np.divmod(np.arange(rows * columns), columns)
+    return np.column_stack([x_start + (column_index + 0.5) * cell_width, y_start + (row_index + 0.5) * cell_height])
+
+@functools.lru_cache(maxsize=None)
+def layer_interpolator(grid_shape, extent):
+    """Interpolator of a layer grid in the viewer's layout, built once per grid shape and extent."""
+    rows, columns = grid_shape
+    x_start, x_end, y_start, y_end = extent
+    spacing = max((x_end - x_start) / columns, (y_end - y_start) / rows)
+    return LayerInterpolator(cell_centres(grid_shape, extent), extent, (rows * pixels_per_cell, columns * pixels_per_cell),
+                             influence_radius_cells * spacing)
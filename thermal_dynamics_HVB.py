@@ -1,22 +1,29 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+import time
+process_start_time = time.perf_counter()
+
+# pandas, matplotlib and SQLAlchemy are imported inside the functions that need them,
+# so that config-only and cache-hit paths don't pay for them at startup
 import numpy as np
-from matplotlib.animation import FuncAnimation
-from matplotlib.widgets import Slider, Button
-from sqlalchemy import create_engine
 import json
 import pickle
 import os
-import time
+import argparse
+import functools
+import instrumentation
+import fixed_point
+from instrumentation import span, count, debug
+from run_index import resolve_db_path
 
 # Function to load configuration from JSON
 def load_config(json_filename="config.json"):
     """Load configuration from a JSON file."""
     try:
-        with open(json_filename, 'r') as f:
+        with span("config.load"), open(json_filename, 'r') as f:
             config_data = json.load(f)
         print(f"Configuration loaded from {json_filename}:")
         print(config_data)
+        # Encoding of newly written extract caches, see fixed_point.cache_codecs
+        fixed_point.set_cache_codec(config_data.get("cache_codec", fixed_point.default_cache_codec))
         return config_data
     except FileNotFoundError:
         print(f"Error: Configuration file {json_filename} not found.")
@@ -44,6 +51,10 @@ def cache_data(func):
         arg_names = func.__code__.co_varnames[:func.__code__.co_argcount]
         args_dict = dict(zip(arg_names, args))
         db_path = kwargs.get('db_path') or args_dict.get('db_path')
+        if db_path and not isinstance(db_path, str):
+            # With several databases, the cache is only compared with the one that holds the run
+            db_path = resolve_db_path(db_path, kwargs.get('lookup_table', args_dict.get('lookup_table')),
+                                      kwargs.get('file_id_value', args_dict.get('file_id_value')))
         
         # Check if cache exists and is up-to-date
         if cache_filename and os.path.exists(cache_filename) and not force_refresh:
@@ -51,23 +62,47 @@ def cache_data(func):
             db_mtime = os.path.getmtime(db_path) if db_path and os.path.exists(db_path) else 0
             if cache_mtime > db_mtime:
                 print(f"Loading data from cache: {cache_filename}")
-                with open(cache_filename, 'rb') as f:
+                count("cache.hit")
+                with span("cache.load", file=cache_filename), open(cache_filename, 'rb') as f:
                     return pickle.load(f)
-        
+
         # Call the function and cache its result
-        data = func(*args, **kwargs)
+        count("cache.miss")
+        with span(f"extract.{func.__name__}"):
+            data = func(*args, **kwargs)
         if cache_filename:
-            with open(cache_filename, 'wb') as f:
-                pickle.dump(data, f)
+            # With a fixed-point cache codec the arrays are encoded here and decoded by pickle.load itself
+            with span("cache.write", file=cache_filename), open(cache_filename, 'wb') as f:
+                pickle.dump(fixed_point.pack(data), f)
             print(f"Data cached to {cache_filename}")
         return data
     return wrapper
 
+def load_lookup_table(lookup_table_path, file_id=None):
+    """Load the lookup table from Parquet or CSV, only the rows of file_id if given."""
+    import pandas as pd
+
+    with span("lookup.load"):
+        if lookup_table_path.endswith('.parquet'):
+            filters = [('File.ID', '==', file_id)] if file_id is not None else None
+            return pd.read_parquet(lookup_table_path, filters=filters)
+        lookup_table = pd.read_csv(lookup_table_path)
+        if file_id is not None:
+            lookup_table = lookup_table[lookup_table['File.ID'] == file_id]
+        return lookup_table
+
 @cache_data
 def extract_temperatures_and_sensor_numbers(db_path, lookup_table, file_id_value, cache_filename=None, force_refresh=False):
+    import pandas as pd
+    from sqlalchemy import create_engine
+
     start_time = time.time()
-    # Use SQLAlchemy engine for better performance
-    engine = create_engine(f'sqlite:///{db_path}')
+    # The lookup table may also be given as a path, it is then only read on a cache miss
+    if isinstance(lookup_table, str):
+        lookup_table = load_lookup_table(lookup_table, file_id_value)
+
+    # Use SQLAlchemy engine for better performance, on the database that holds the run if several are given
+    engine = create_engine(f'sqlite:///{resolve_db_path(db_path, lookup_table, file_id_value)}')
     
     # Filter lookup table entries matching the current `file_id`
     signal_info = lookup_table[lookup_table['File.ID'] == file_id_value]
@@ -90,7 +125,8 @@ def extract_temperatures_and_sensor_numbers(db_path, lookup_table, file_id_value
 
         try:
             # Use pandas to read SQL query directly into a DataFrame
-            df = pd.read_sql_query(query, engine, params=(file_id_value,))
+            with span("sql.query", table=table_name):
+                df = pd.read_sql_query(query, engine, params=(file_id_value,))
             df.dropna(axis=0, how='all', inplace=True)  # Drop rows where all values are NaN
 
             # Process each signal
@@ -123,14 +159,20 @@ def extract_temperatures_and_sensor_numbers(db_path, lookup_table, file_id_value
     temperatures_array = np.array(all_temperatures_trimmed)
 
     end_time = time.time()
-    print(f"Temperature data extraction took {end_time - start_time:.2f} seconds")
+    debug(f"Temperature data extraction took {end_time - start_time:.2f} seconds")
 
     return temperatures_array, sensor_identifiers
 
 @cache_data
 def extract_inlet_outlet_flow(db_path, file_id_value, lookup_table, cache_filename=None, force_refresh=False):
+    import pandas as pd
+    from sqlalchemy import create_engine
+
     start_time = time.time()
-    engine = create_engine(f'sqlite:///{db_path}')
+    if isinstance(lookup_table, str):
+        lookup_table = load_lookup_table(lookup_table, file_id_value)
+
+    engine = create_engine(f'sqlite:///{resolve_db_path(db_path, lookup_table, file_id_value)}')
 
     inlet_temperature = []
     outlet_temperature = []
@@ -153,11 +195,12 @@ def extract_inlet_outlet_flow(db_path, file_id_value, lookup_table, cache_filena
             column_name = signal_entry['Channel.Name']
             query = f"SELECT {column_name} FROM {table_name} WHERE file_id = ?"
             try:
-                df = pd.read_sql_query(query, engine, params=(file_id_value,))
+                with span("sql.query", table=table_name):
+                    df = pd.read_sql_query(query, engine, params=(file_id_value,))
                 df.dropna(inplace=True)
                 if not df.empty:
                     signals[key]['data'] = df[column_name].values
-                    print(f"Found {key} data in table {table_name}")
+                    debug(f"Found {key} data in table {table_name}")
                     break  # Stop after finding data
             except Exception as e:
                 print(f"Error processing {key} data from table {table_name}: {e}")
@@ -168,22 +211,22 @@ def extract_inlet_outlet_flow(db_path, file_id_value, lookup_table, cache_filena
 
     # Debugging: Print the retrieved values
     if len(inlet_temperature) > 0:
-        print(f"Inlet Temperature: {inlet_temperature[:5]}...")  # Print first 5 for brevity
+        debug(f"Inlet Temperature: {inlet_temperature[:5]}...")  # Print first 5 for brevity
     else:
         print("No inlet temperature data found.")
 
     if len(outlet_temperature) > 0:
-        print(f"Outlet Temperature: {outlet_temperature[:5]}...")
+        debug(f"Outlet Temperature: {outlet_temperature[:5]}...")
     else:
         print("No outlet temperature data found.")
 
     if len(coolant_flow) > 0:
-        print(f"Coolant Flow: {coolant_flow[:5]}...")
+        debug(f"Coolant Flow: {coolant_flow[:5]}...")
     else:
         print("No coolant flow data found.")
 
     end_time = time.time()
-    print(f"Inlet/Outlet/Flow data extraction took {end_time - start_time:.2f} seconds")
+    debug(f"Inlet/Outlet/Flow data extraction took {end_time - start_time:.2f} seconds")
 
     return inlet_temperature, outlet_temperature, coolant_flow
 
@@ -208,21 +251,45 @@ def calculation_heat_flux(volumenstrom, temp_inlet, temp_outlet):
 
     return heat_flux
 
-def plot_battery_layout(data, sensor_identifiers, sensors_per_module_list, strings_count, t_index, total_frames, axes, cbar_list, custom_sensor_order, vmin=15, vmax=40, title="Battery Temperature Layout", fig=None):
+def calculation_heat_flux_over_time(flow, temp_inlet, temp_outlet):
+    """Vectorized calculation_heat_flux for whole signals, with the flow in L/min. Returns the heat flow in W."""
+    volumenstrom = np.asarray(flow, dtype=float) / 60000  # Convert from L/min to m^3/s
+    delta_t = np.asarray(temp_outlet, dtype=float) - np.asarray(temp_inlet, dtype=float)
+    # The heat flux is linear in both, so its value for 1 m^3/s and 1 K is the volumetric heat capacity of the coolant
+    return volumenstrom * delta_t * calculation_heat_flux(1.0, 0.0, 1.0)
+
+def layer_sensor_rows(sensor_identifiers, sensors_per_module_list, custom_sensor_order):
+    """Row indices into the temperature matrix of the sensors of each layer, following custom_sensor_order."""
+    row_of = {sensor_identifier: row for row, sensor_identifier in enumerate(sensor_identifiers)}
+    layers = []
+    start_index = 0
+    for sensors_per_module in sensors_per_module_list:
+        end_index = start_index + 4 * sensors_per_module * 4
+        layers.append([row_of[sensor] for sensor in custom_sensor_order[start_index:end_index] if sensor in row_of])
+        start_index = end_index
+    return layers
+
+@functools.lru_cache(maxsize=None)
+def load_background_image(background_image_path):
+    # Read once per process instead of once per frame
+    import matplotlib.pyplot as plt
+    return plt.imread(background_image_path)
+
+def plot_battery_layout(data, sensor_identifiers, sensors_per_module_list, strings_count, t_index, total_frames, axes, cbar_list, custom_sensor_order, vmin=15, vmax=40, title="Battery Temperature Layout", fig=None, smooth=False, layer_stats=None, unit="°C"):
     # Load the background image
     current_dir = os.path.dirname(os.path.abspath(__file__))
     background_image_path = os.path.join(current_dir, "coolingplate_edited.png")
       
     try:
-        background_img = plt.imread(background_image_path)
-        print(f"Background image loaded successfully from: {background_image_path}")
+        background_img = load_background_image(background_image_path)
+        debug(f"Background image loaded successfully from: {background_image_path}")
     except FileNotFoundError:
         print(f"Error: Background image not found at {background_image_path}")
         return
 
     # Get the image size for debugging
     image_height, image_width = background_img.shape[:2]
-    print(f"Background image dimensions: width={image_width}, height={image_height}")
+    debug(f"Background image dimensions: width={image_width}, height={image_height}")
     
     # Set the heatmap and background extent based on the image size
     white_area_width = 486
@@ -233,7 +300,7 @@ def plot_battery_layout(data, sensor_identifiers, sensors_per_module_list, strin
     y_end = y_start + white_area_height
     heatmap_extent = [x_start, x_end, y_start, y_end]
 
-    print(f"Heatmap extent: x_start={x_start}, x_end={x_end}, y_start={y_start}, y_end={y_end}")
+    debug(f"Heatmap extent: x_start={x_start}, x_end={x_end}, y_start={y_start}, y_end={y_end}")
     
     # Get the current data at the specific timestamp
     data_at_timestamp = data[:, t_index]
@@ -279,12 +346,16 @@ def plot_battery_layout(data, sensor_identifiers, sensors_per_module_list, strin
         reordered_layers.append(reordered_data_layer)
         reordered_sensor_numbers_layers.append(reordered_sensor_numbers_layer)
 
-        # Calculate layer-specific metrics
-        mean_temperature = np.nanmean(reordered_data_layer)
-        max_temperature = np.nanmax(reordered_data_layer)
-        min_temperature = np.nanmin(reordered_data_layer)
+        # Calculate layer-specific metrics, or take them from the precomputed derived signals (see derived_signals.py)
+        if layer_stats is not None:
+            mean_temperature, max_temperature, min_temperature, std_dev = (
+                layer_stats[name][layer] for name in ("layer_mean", "layer_max", "layer_min", "layer_std"))
+        else:
+            mean_temperature = np.nanmean(reordered_data_layer)
+            max_temperature = np.nanmax(reordered_data_layer)
+            min_temperature = np.nanmin(reordered_data_layer)
+            std_dev = np.nanstd(reordered_data_layer)
         temperature_range = max_temperature - min_temperature
-        std_dev = np.nanstd(reordered_data_layer)
 
         # Store metrics
         mean_temperatures.append(mean_temperature)
@@ -302,7 +373,12 @@ def plot_battery_layout(data, sensor_identifiers, sensors_per_module_list, strin
         ax.imshow(background_img, extent=[0, image_width, 0, image_height], aspect='auto', origin='lower', zorder=0)
 
         # Plot heatmap with some transparency so the background is visible
-        heatmap = ax.imshow(reordered_layers[string_index], cmap='coolwarm', interpolation='nearest', vmin=vmin, vmax=vmax, extent=heatmap_extent, alpha=1, origin='lower', zorder=1)
+        layer_image = reordered_layers[string_index]
+        if smooth:
+            # Smooth mode: field interpolated between the sensor positions with precomputed weights (one mat-vec per layer)
+            from smooth_heatmap import layer_interpolator
+            layer_image = layer_interpolator(layer_image.shape, tuple(heatmap_extent)).field(layer_image.ravel())
+        heatmap = ax.imshow(layer_image, cmap='coolwarm', interpolation='nearest', vmin=vmin, vmax=vmax, extent=heatmap_extent, alpha=1, origin='lower', zorder=1)
 
         # Add a title to each subplot to indicate the layer number and its metrics
         mean_temp = mean_temperatures[string_index]
@@ -311,7 +387,7 @@ def plot_battery_layout(data, sensor_identifiers, sensors_per_module_list, strin
         temp_range = temperature_ranges[string_index]
         std_dev = std_devs[string_index]
 
-        ax.set_title(f'Layer {string_index + 1}\nMean: {mean_temp:.2f}°C | Max: {max_temp:.2f}°C | Min: {min_temp:.2f}°C\nRange: {temp_range:.2f}°C | Std Dev: {std_dev:.2f}°C', fontsize=10, pad=10)
+        ax.set_title(f'Layer {string_index + 1}\nMean: {mean_temp:.2f}{unit} | Max: {max_temp:.2f}{unit} | Min: {min_temp:.2f}{unit}\nRange: {temp_range:.2f}{unit} | Std Dev: {std_dev:.2f}{unit}', fontsize=10, pad=10)
 
         # Remove axis ticks and labels
         ax.set_xticks([])
@@ -335,37 +411,35 @@ def plot_battery_layout(data, sensor_identifiers, sensors_per_module_list, strin
                 
                 if sensor_number is not None and not np.isnan(temp):
                     sensor_num, bms_id = sensor_number
-                    ax.text(annotation_x, annotation_y, f'Sensor {sensor_num}\n{temp:.1f}°C\nBMS {bms_id}',
+                    ax.text(annotation_x, annotation_y, f'Sensor {sensor_num}\n{temp:.1f}{unit}\nBMS {bms_id}',
                             ha='center', va='center', color='black', fontsize=6, zorder=2)  # Text overlaid on the heatmap
 
     return heatmap  # Return heatmap for colorbar creation
 
+def report_startup_time():
+    now = time.perf_counter()
+    instrumentation.record_span("startup.first_window", process_start_time, now)
+    print(f"Time to first window: {now - process_start_time:.2f} seconds")
+
 def interactive_battery_layout(
     data, sensor_identifiers, sensors_per_module_list, strings_count,
-    custom_sensor_order, inlet_temp, outlet_temp, flow, vmin, vmax
+    custom_sensor_order, inlet_temp, outlet_temp, flow, vmin, vmax,
+    file_id=None, show=True, run_ids=None, run_cache=None, event_thresholds=None, smooth=False, comparison=None
 ):
-    # Determine the minimum length among all data arrays
-    data_length = data.shape[1]
-    inlet_length = len(inlet_temp)
-    outlet_length = len(outlet_temp)
-    flow_length = len(flow)
-    min_length = min(data_length, inlet_length, outlet_length, flow_length)
-    
-    # Trim data arrays to the minimum length
-    data = data[:, :min_length]
-    inlet_temp = inlet_temp[:min_length]
-    outlet_temp = outlet_temp[:min_length]
-    flow = flow[:min_length]
-    
-    total_frames = min_length
-
+    import matplotlib.pyplot as plt
     import matplotlib.gridspec as gridspec
+    from matplotlib.animation import FuncAnimation
+    from matplotlib.widgets import Slider, Button, TextBox, RadioButtons
+    from event_index import load_event_index, layer_grids, EventIndex, event_dtype
+    from derived_signals import DerivedSignals
+    from sensor_trace import SensorTracePanel, sensor_row_at
 
     # Create a figure with a specified size
     fig = plt.figure(figsize=(15, 10))
 
     # Add the file name to the top right corner
-    fig.text(0.95, 0.9, f"Source File: {file_id}", ha='right', va='top', fontsize=10, color='gray')
+    source_text = comparison.describe() if comparison is not None else f"Source File: {file_id}"
+    source_text_obj = fig.text(0.95, 0.9, source_text, ha='right', va='top', fontsize=10, color='gray')
 
     # Define a GridSpec with 3 rows and 3 columns
     # Adjust 'height_ratios' to control the height of each row
@@ -390,77 +464,143 @@ def interactive_battery_layout(
     suptitle_text_obj = None
     subtitle_text_middle_obj = None
 
-    ax_slider = plt.axes([0.20, 0.02, 0.50, 0.04], facecolor='lightgoldenrodyellow')
+    # Initialize plots in 'ax_additional'
+    line_overall, = ax_additional.plot([], [], label='Cell Temp \nRange', color='black')
+    line_layer_mean_range, = ax_additional.plot([], [], label='Range of Mean \nLayer Temps', color='red')
+    event_markers, = ax_additional.plot([], [], '|', label='Events', color='tab:orange', markersize=10)
+
+    # Comparison mode: the largest difference between the runs is shown in every view
+    extra_ranges = []
+    if comparison is not None:
+        line_max_delta, = ax_additional.plot([], [], label='Max |A - B|', color='tab:purple')
+        extra_ranges = [(line_max_delta, comparison.max_abs_delta)]
+
+    ax_additional.set_xlabel('Time [s]')
+    ax_additional.set_ylabel('Temperature Range [°C]')
+    ax_additional.set_title('Cell Temp Range and Range of Mean Layer Temps Over Time')
+    ax_additional.legend(loc='upper left', bbox_to_anchor=(1.01, 1), borderaxespad=0)
+
+    # Run-dependent state, replaced by set_run_data when another run is selected
+    total_frames = 0
+    time = None
+    overall_temp_range_over_time = None
+    range_mean_layer_temps = None
+    events = None
+    derived = None
+    grids = None
+
+    # Whole-run trace of a sensor, opened by clicking its cell in the heatmap
+    trace_panel = SensorTracePanel()
+
+    def set_run_data(run_data, run_file_id, detect_events=True, run_derived=None):
+        nonlocal data, sensor_identifiers, inlet_temp, outlet_temp, flow, total_frames
+        nonlocal time, overall_temp_range_over_time, range_mean_layer_temps, events, derived, grids
+        data, sensor_identifiers, inlet_temp, outlet_temp, flow = run_data
+
+        # Threshold crossings of the whole run, detected once and cached next to the extract cache
+        if detect_events:
+            events = load_event_index(run_file_id, data, sensor_identifiers, sensors_per_module_list, custom_sensor_order, thresholds=event_thresholds)
+        else:
+            events = EventIndex(np.empty(0, dtype=event_dtype), sensor_identifiers)
+
+        # Derived signals of the run, trimmed to its shortest signal. Runs from the run cache share theirs with it,
+        # so they are computed once per run and not again when switching back to it
+        derived = run_derived or DerivedSignals(run_data, sensors_per_module_list=sensors_per_module_list,
+                                                custom_sensor_order=custom_sensor_order)
+        data, inlet_temp, outlet_temp, flow = (derived[name] for name in ("temperatures", "inlet", "outlet", "flow"))
+        total_frames = derived.total_frames
+
+        # Prepare time axis (adjust if you have actual time data)
+        time = np.arange(total_frames)
+
+        # Cell temperature range and range of the mean layer temperatures over time
+        overall_temp_range_over_time = derived["cell_range"]
+        range_mean_layer_temps = derived["layer_range"]
+        grids = layer_grids(sensor_identifiers, sensors_per_module_list, custom_sensor_order)
+        if trace_panel.fig is not None:
+            trace_panel.set_run(derived, min(int(slider.val), total_frames - 1))
+
+        events = events.truncate(total_frames)
+        event_times = np.unique(events.events['t_index'])
+        event_markers.set_data(event_times, np.zeros(len(event_times)))
+        event_text_obj.set_text(f"{len(events)} events")
+
+        ax_additional.set_xlim(time[0], time[-1])
+        ax_additional.set_ylim(0, max([np.nanmax(overall_temp_range_over_time), np.nanmax(range_mean_layer_temps)]
+                                      + [np.nanmax(values) for _, values in extra_ranges]) * 1.1)
+
+    event_text_obj = fig.text(0.62, 0.07, "", ha='left', va='bottom', fontsize=9, color='tab:orange')
+    # In comparison mode the runs are aligned slices, their events are detected on the slice and not cached
+    if comparison is not None:
+        set_run_data(comparison.view('A'), None, run_derived=comparison.derived('A'))
+    else:
+        set_run_data((data, sensor_identifiers, inlet_temp, outlet_temp, flow), file_id,
+                     run_derived=run_cache.derived(file_id) if run_cache is not None and file_id in run_cache else None)
+
+    ax_slider = plt.axes([0.20, 0.02, 0.36, 0.04], facecolor='lightgoldenrodyellow')
     slider = Slider(ax_slider, 'Time [s]', 0, total_frames - 1, valinit=0, valstep=1)
 
     ax_button_play = plt.axes([0.05, 0.02, 0.1, 0.04])
     button_play = Button(ax_button_play, 'Play/Pause')
 
+    ax_button_prev_event = plt.axes([0.62, 0.02, 0.075, 0.04])
+    button_prev_event = Button(ax_button_prev_event, '< Event')
+
+    ax_button_next_event = plt.axes([0.70, 0.02, 0.075, 0.04])
+    button_next_event = Button(ax_button_next_event, 'Event >')
+
     ax_button_rw = plt.axes([0.78, 0.02, 0.1, 0.04])
     button_rw = Button(ax_button_rw, 'Rewind')
 
     ax_button_ff = plt.axes([0.89, 0.02, 0.1, 0.04])
     button_ff = Button(ax_button_ff, 'Fast Forward')
 
-    playing = [False]
-
-    # Prepare time axis (adjust if you have actual time data)
-    time = np.arange(total_frames)
-
-    # Compute overall cell temperature ranges over time
-    overall_max_temps = np.nanmax(data, axis=0)
-    overall_min_temps = np.nanmin(data, axis=0)
-    overall_temp_range_over_time = overall_max_temps - overall_min_temps
-
-    # Compute mean layer temperatures over time
-    layer_mean_temps = np.zeros((strings_count, total_frames))
-    for layer in range(strings_count):
-        start_idx = sum([sensors_per_module_list[i] * 4 * 4 for i in range(layer)])
-        end_idx = start_idx + sensors_per_module_list[layer] * 4 * 4
-        layer_data = data[start_idx:end_idx, :]
-        layer_mean_temps[layer, :] = np.nanmean(layer_data, axis=0)
-
-    # Compute the range of mean layer temperatures over time
-    max_mean_layer_temps = np.nanmax(layer_mean_temps, axis=0)
-    min_mean_layer_temps = np.nanmin(layer_mean_temps, axis=0)
-    range_mean_layer_temps = max_mean_layer_temps - min_mean_layer_temps
-
-    # Initialize plots in 'ax_additional'
-    line_overall, = ax_additional.plot([], [], label='Cell Temp \nRange', color='black')
-    line_layer_mean_range, = ax_additional.plot([], [], label='Range of Mean \nLayer Temps', color='red')
+    ax_button_smooth = plt.axes([0.58, 0.93, 0.1, 0.04])
+    button_smooth = Button(ax_button_smooth, 'Sensor Grid' if smooth else 'Smooth')
 
-    ax_additional.set_xlabel('Time [s]')
-    ax_additional.set_ylabel('Temperature Range [°C]')
-    ax_additional.set_title('Cell Temp Range and Range of Mean Layer Temps Over Time')
-    ax_additional.legend(loc='upper left', bbox_to_anchor=(1.01, 1), borderaxespad=0)
-    ax_additional.set_xlim(time[0], time[-1])
-    ax_additional.set_ylim(0, max(np.nanmax(overall_temp_range_over_time), np.nanmax(range_mean_layer_temps)) * 1.1)
+    playing = [False]
+    smooth_mode = [smooth]
+    view_mode = ['A']
 
     def update(val):
+        with span("frame.update"):
+            draw_frame(val)
+        count("frames")
+
+    def draw_frame(val):
         nonlocal suptitle_text_obj, subtitle_text_middle_obj
 
         t_index = int(slider.val)
-        heatmap = plot_battery_layout(
-            data,
-            sensor_identifiers,
-            sensors_per_module_list,
-            strings_count,
-            t_index,
-            total_frames,
-            axes,
-            cbar_list,
-            custom_sensor_order,
-            vmin=vmin,
-            vmax=vmax,
-            fig=fig
-        )
-
-        # Calculate overall metrics
-        overall_mean_temp = np.nanmean(data[:, t_index])
-        overall_max_temp = np.nanmax(data[:, t_index])
-        overall_min_temp = np.nanmin(data[:, t_index])
-        overall_temp_range = overall_max_temp - overall_min_temp
-        overall_std_dev = np.nanstd(data[:, t_index])
+        trace_panel.set_time(t_index)
+        showing_delta = comparison is not None and view_mode[0] == 'A - B'
+        if showing_delta:
+            frame_vmin, frame_vmax = -comparison.delta_limit, comparison.delta_limit
+        else:
+            frame_vmin, frame_vmax = vmin, vmax
+        with span("frame.plot_battery_layout"):
+            heatmap = plot_battery_layout(
+                data,
+                sensor_identifiers,
+                sensors_per_module_list,
+                strings_count,
+                t_index,
+                total_frames,
+                axes,
+                cbar_list,
+                custom_sensor_order,
+                vmin=frame_vmin,
+                vmax=frame_vmax,
+                fig=fig,
+                smooth=smooth_mode[0],
+                layer_stats={name: derived[name][:, t_index] for name in ("layer_mean", "layer_max", "layer_min", "layer_std")}
+            )
+
+        # Overall metrics, looked up in the derived signals of the whole run
+        overall_mean_temp = derived["cell_mean"][t_index]
+        overall_max_temp = derived["cell_max"][t_index]
+        overall_min_temp = derived["cell_min"][t_index]
+        overall_temp_range = overall_temp_range_over_time[t_index]
+        overall_std_dev = derived["cell_std"][t_index]
 
         # Update inlet, outlet, and flow display
         if len(inlet_temp) > t_index and inlet_temp[t_index] is not None:
@@ -474,27 +614,29 @@ def interactive_battery_layout(
             outlet_display = 'N/A'
 
         if len(flow) > t_index and flow[t_index] is not None:
-            flow_value = flow[t_index]
-            flow_m3_s = flow_value / 60000  # Convert from L/min to m^3/s
-            flow_display = f"{flow_value:.2f} L/min"
+            flow_display = f"{flow[t_index]:.2f} L/min"
         else:
             flow_display = 'N/A'
-            flow_m3_s = 0
 
-        # Calculate heat flow if all values are available
+        # Heat flow if all values are available
         if inlet_display != 'N/A' and outlet_display != 'N/A' and flow_display != 'N/A':
-            heat_flux = calculation_heat_flux(flow_m3_s, inlet_temp[t_index], outlet_temp[t_index])
+            heat_flux = derived["heat_flow"][t_index]
             heat_flow_display = f"Q_HVB: {heat_flux:.2f} W"
         else:
             heat_flow_display = "Q_HVB: N/A"
+        if showing_delta:
+            heat_flow_display = f"Q_HVB A - B: {comparison.heat_flow_delta[t_index]:.2f} W"
 
         # Update 'ax_additional' plots
         line_overall.set_data(time[:t_index + 1], overall_temp_range_over_time[:t_index + 1])
         line_layer_mean_range.set_data(time[:t_index + 1], range_mean_layer_temps[:t_index + 1])
+        for line, values in extra_ranges:
+            line.set_data(time[:t_index + 1], values[:t_index + 1])
 
         # Adjust axes limits if necessary
         ax_additional.set_xlim(time[0], time[-1])
-        ax_additional.set_ylim(0, max(np.nanmax(overall_temp_range_over_time), np.nanmax(range_mean_layer_temps)) * 1.1)
+        ax_additional.set_ylim(0, max([np.nanmax(overall_temp_range_over_time), np.nanmax(range_mean_layer_temps)]
+                                      + [np.nanmax(values) for _, values in extra_ranges]) * 1.1)
 
         # Rearranged and updated figure title with new metrics (left-aligned)
         suptitle_text = (
@@ -503,6 +645,8 @@ def interactive_battery_layout(
             f"Cell Range: {overall_temp_range:.2f}°C\nLayer Range: {range_mean_layer_temps[t_index]:.2f}°C\n"
             f"Std Dev: {overall_std_dev:.2f}°C\n"
         )
+        if comparison is not None:
+            suptitle_text = f"Showing: {view_mode[0]}\n" + suptitle_text
 
         # Update or create the first text object
         if suptitle_text_obj is None:
@@ -530,7 +674,11 @@ def interactive_battery_layout(
             cbar_ax = fig.add_axes([0.92, 0.33, 0.02, 0.4])
             colorbar = fig.colorbar(heatmap, cax=cbar_ax)
             colorbar.set_label("Temperature [°C]", fontsize=12)  # Add label to colorbar
-            cbar_list[0] = True
+            cbar_list[0] = colorbar
+        elif comparison is not None:
+            # The difference view has its own, symmetric colour range
+            cbar_list[0].update_normal(heatmap)
+            cbar_list[0].set_label("Temperature Difference A - B [K]" if showing_delta else "Temperature [°C]", fontsize=12)
 
     slider.on_changed(update)
 
@@ -549,9 +697,120 @@ def interactive_battery_layout(
         else:
             slider.set_val(0)
 
+    def toggle_smooth(event):
+        smooth_mode[0] = not smooth_mode[0]
+        button_smooth.label.set_text('Sensor Grid' if smooth_mode[0] else 'Smooth')
+        update(slider.val)
+
+    def select_view(label):
+        view_mode[0] = label
+        with span("compare.select_view", view=label):
+            set_run_data(comparison.view(label), None, detect_events=label != 'A - B', run_derived=comparison.derived(label))
+        event_text_obj.set_text(f"{len(events)} events" if label != 'A - B' else "")
+        update(slider.val)
+
+    def jump_to_event(position):
+        if position is None:
+            return
+        event_text_obj.set_text(events.describe(position))
+        slider.set_val(int(events.events['t_index'][position]))
+
+    def inspect_sensor(event):
+        # Ignore clicks while the zoom or pan tool is active
+        if event.inaxes not in axes or event.xdata is None or fig.canvas.widgetlock.locked() or not event.inaxes.images:
+            return
+        layer = axes.index(event.inaxes)
+        row = sensor_row_at(grids[layer], event.inaxes.images[-1].get_extent(), event.xdata, event.ydata)
+        if row is not None:
+            trace_panel.show(derived, row, int(slider.val))
+
+    fig.canvas.mpl_connect('button_press_event', inspect_sensor)
+
     button_play.on_clicked(toggle_play)
     button_ff.on_clicked(fast_forward)
     button_rw.on_clicked(rewind)
+    button_smooth.on_clicked(toggle_smooth)
+    button_prev_event.on_clicked(lambda event: jump_to_event(events.previous_event(int(slider.val))))
+    button_next_event.on_clicked(lambda event: jump_to_event(events.next_event(int(slider.val))))
+
+    # matplotlib only keeps weak references to widgets, keep them alive for as long as the figure when show=False
+    fig.viewer_widgets = {'slider': slider, 'play': button_play, 'rewind': button_rw, 'fast_forward': button_ff,
+                          'prev_event': button_prev_event, 'next_event': button_next_event, 'smooth': button_smooth}
+
+    # Comparison mode: one slider drives run A, run B and their difference
+    if comparison is not None:
+        from run_comparison import comparison_views
+        ax_view_selector = plt.axes([0.88, 0.79, 0.09, 0.08])
+        view_selector = RadioButtons(ax_view_selector, comparison_views)
+        view_selector.on_clicked(select_view)
+        fig.viewer_widgets['view'] = view_selector
+
+    # Run selector: switch between runs without restarting, backed by the in-process run cache
+    if run_cache is not None and run_ids:
+        run_ids = list(run_ids)
+        if file_id not in run_ids:
+            run_ids.append(file_id)
+        current_run = [run_ids.index(file_id)]
+
+        ax_button_prev_run = plt.axes([0.70, 0.93, 0.08, 0.04])
+        button_prev_run = Button(ax_button_prev_run, '< Prev Run')
+
+        ax_run_box = plt.axes([0.79, 0.93, 0.12, 0.04])
+        run_box = TextBox(ax_run_box, '', initial=file_id)
+
+        ax_button_next_run = plt.axes([0.92, 0.93, 0.07, 0.04])
+        button_next_run = Button(ax_button_next_run, 'Next Run >')
+
+        # Runs with similar thermal behaviour, from the index built by run_similarity.py (if it exists)
+        from run_similarity import load_index
+        similarity_index = load_index()
+        similar_text_obj = fig.text(0.95, 0.875, "", ha='right', va='top', fontsize=8, color='gray')
+
+        def show_similar(run_file_id):
+            if similarity_index is not None and run_file_id in similarity_index:
+                similar = ", ".join(similar_id for similar_id, _ in similarity_index.query(run_file_id, k=3))
+                similar_text_obj.set_text(f"Similar runs: {similar}")
+            else:
+                similar_text_obj.set_text("")
+
+        def switch_run(run_position):
+            run_position %= len(run_ids)
+            new_file_id = run_ids[run_position]
+            with span("run.switch", file_id=new_file_id):
+                run_data = run_cache.get(new_file_id)
+            if len(run_data[0]) == 0:
+                print(f"No temperature data found for {new_file_id}.")
+                run_box.set_val(run_ids[current_run[0]])
+                return
+
+            current_run[0] = run_position
+            set_run_data(run_data, new_file_id, run_derived=run_cache.derived(new_file_id))
+            source_text_obj.set_text(f"Source File: {new_file_id}")
+            show_similar(new_file_id)
+            if run_box.text != new_file_id:
+                run_box.set_val(new_file_id)
+
+            slider.valmax = total_frames - 1
+            slider.ax.set_xlim(slider.valmin, slider.valmax)
+            slider.set_val(min(int(slider.val), total_frames - 1))
+
+            # Load the neighbouring runs in the background so that stepping through runs is instant
+            run_cache.prefetch([run_ids[(run_position + 1) % len(run_ids)], run_ids[run_position - 1]])
+
+        def submit_run(text):
+            text = text.strip()
+            if text in run_ids and text != run_ids[current_run[0]]:
+                switch_run(run_ids.index(text))
+            elif text not in run_ids:
+                print(f"Unknown run: {text}")
+
+        button_prev_run.on_clicked(lambda event: switch_run(current_run[0] - 1))
+        button_next_run.on_clicked(lambda event: switch_run(current_run[0] + 1))
+        run_box.on_submit(submit_run)
+        show_similar(file_id)
+        fig.viewer_widgets.update({'prev_run': button_prev_run, 'next_run': button_next_run, 'run_box': run_box})
+
+        run_cache.prefetch([run_ids[(current_run[0] + 1) % len(run_ids)], run_ids[current_run[0] - 1]])
 
     def animate(i):
         if playing[0]:
@@ -562,19 +821,71 @@ def interactive_battery_layout(
 
     ani = FuncAnimation(fig, animate, interval=200)
 
-    update(0)
-    plt.show()
+    # Report the time from process start until the window is first drawn
+    def on_first_draw(event):
+        fig.canvas.mpl_disconnect(first_draw_cid)
+        report_startup_time()
 
-def main(db_path, lookup_table_path, file_id, vmin, vmax):
-    
-    # Load the lookup table from Parquet or CSV
-    if lookup_table_path.endswith('.parquet'):
-        lookup_table = pd.read_parquet(lookup_table_path)
-    else:
-        lookup_table = pd.read_csv(lookup_table_path)
+    first_draw_cid = fig.canvas.mpl_connect('draw_event', on_first_draw)
 
-    sensors_per_module_list = [2, 2, 2, 2, 2, 2]  # Adjust if necessary
-    strings_count = 6  # Total number of layers
+    update(0)
+    if show:
+        plt.show()
+    return fig, slider, ani
+
+# Battery layout: 6 layers (strings) with 2 modules of 4 x 4 sensors each
+sensors_per_module_list = [2, 2, 2, 2, 2, 2]  # Adjust if necessary
+strings_count = 6  # Total number of layers
+
+# Custom sensor order (update with actual sensor numbers and BMS_IDs)
+custom_sensor_order = [
+    # Layer 1
+    (1, '01'), (2, '01'), (3, '01'), (4, '01'), (5, '01'), (6, '01'), (7, '01'), (8, '01'),
+    (16, '01'), (15, '01'), (14, '01'), (13, '01'), (12, '01'), (11, '01'), (10, '01'), (9, '01'),
+    (17, '01'), (18, '01'), (19, '01'), (20, '01'), (21, '01'), (22, '01'), (23, '01'), (24, '01'),
+    (32, '01'), (31, '01'), (30, '01'), (29, '01'), (28, '01'), (27, '01'), (26, '01'), (25, '01'),
+
+    # Layer 2
+    (49, '01'), (50, '01'), (51, '01'), (52, '01'), (53, '01'), (54, '01'), (55, '01'), (56, '01'),
+    (64, '01'), (63, '01'), (62, '01'), (61, '01'), (60, '01'), (59, '01'), (58, '01'), (57, '01'),
+    (33, '01'), (34, '01'), (35, '01'), (36, '01'), (37, '01'), (38, '01'), (39, '01'), (40, '01'),
+    (48, '01'), (47, '01'), (46, '01'), (45, '01'), (44, '01'), (43, '01'), (42, '01'), (41, '01'),
+
+    # Layer 3
+    (65, '01'), (66, '01'), (67, '01'), (68, '01'), (69, '01'), (70, '01'), (71, '01'), (72, '01'),
+    (80, '01'), (79, '01'), (78, '01'), (77, '01'), (76, '01'), (75, '01'), (74, '01'), (73, '01'),
+    (81, '01'), (82, '01'), (83, '01'), (84, '01'), (85, '01'), (86, '01'), (87, '01'), (88, '01'),
+    (96, '01'), (95, '01'), (94, '01'), (93, '01'), (92, '01'), (91, '01'), (90, '01'), (89, '01'),
+
+    # Layer 4
+    (1, '05'), (2, '05'), (3, '05'), (4, '05'), (5, '05'), (6, '05'), (7, '05'), (8, '05'),
+    (16, '05'), (15, '05'), (14, '05'), (13, '05'), (12, '05'), (11, '05'), (10, '05'), (9, '05'),
+    (17, '05'), (18, '05'), (19, '05'), (20, '05'), (21, '05'), (22, '05'), (23, '05'), (24, '05'),
+    (32, '05'), (31, '05'), (30, '05'), (29, '05'), (28, '05'), (27, '05'), (26, '05'), (25, '05'),
+
+    # Layer 5
+    (49, '05'), (50, '05'), (51, '05'), (52, '05'), (53, '05'), (54, '05'), (55, '05'), (56, '05'),
+    (64, '05'), (63, '05'), (62, '05'), (61, '05'), (60, '05'), (59, '05'), (58, '05'), (57, '05'),
+    (33, '05'), (34, '05'), (35, '05'), (36, '05'), (37, '05'), (38, '05'), (39, '05'), (40, '05'),
+    (48, '05'), (47, '05'), (46, '05'), (45, '05'), (44, '05'), (43, '05'), (42, '05'), (41, '05'),
+
+    # Layer 6
+    (65, '05'), (66, '05'), (67, '05'), (68, '05'), (69, '05'), (70, '05'), (71, '05'), (72, '05'),
+    (80, '05'), (79, '05'), (78, '05'), (77, '05'), (76, '05'), (75, '05'), (74, '05'), (73, '05'),
+    (81, '05'), (82, '05'), (83, '05'), (84, '05'), (85, '05'), (86, '05'), (87, '05'), (88, '05'),
+    (96, '05'), (95, '05'), (94, '05'), (93, '05'), (92, '05'), (91, '05'), (90, '05'), (89, '05'),
+]
+
+def load_run(db_path, lookup_table_path, file_id, force_refresh=False, apply_quality=True, quality_thresholds=None):
+    """Extract one run (temperatures, sensor identifiers, inlet, outlet, flow), using the on-disk cache.
+
+    With apply_quality, samples flagged by the data-quality checks (see data_quality.py) are set to NaN,
+    so that every statistic computed from the run skips them. db_path may be a list of databases, the run is
+    then read from the one the lookup table routes it to.
+    """
+    # The lookup table is passed as a path and only read by the extract functions on a cache miss
+    lookup_table = lookup_table_path
+    db_path = resolve_db_path(db_path, lookup_table_path, file_id)
 
     # Define cache filenames
     temp_cache_filename = os.path.join("data", f"temp_data_{file_id}.pkl")
@@ -586,7 +897,7 @@ def main(db_path, lookup_table_path, file_id, vmin, vmax):
         lookup_table,
         file_id,
         cache_filename=temp_cache_filename,
-        force_refresh=False  # Force refresh to update cache
+        force_refresh=force_refresh  # Force refresh to update cache
     )
 
     # Extract inlet, outlet temperatures and coolant flow, using caching
@@ -595,50 +906,38 @@ def main(db_path, lookup_table_path, file_id, vmin, vmax):
         file_id,
         lookup_table,
         cache_filename=flow_cache_filename,
-        force_refresh=False  # Force refresh to update cache
+        force_refresh=force_refresh  # Force refresh to update cache
     )
 
-    # Custom sensor order (update with actual sensor numbers and BMS_IDs)
-    custom_sensor_order = [
-        # Layer 1
-        (1, '01'), (2, '01'), (3, '01'), (4, '01'), (5, '01'), (6, '01'), (7, '01'), (8, '01'),
-        (16, '01'), (15, '01'), (14, '01'), (13, '01'), (12, '01'), (11, '01'), (10, '01'), (9, '01'),
-        (17, '01'), (18, '01'), (19, '01'), (20, '01'), (21, '01'), (22, '01'), (23, '01'), (24, '01'),
-        (32, '01'), (31, '01'), (30, '01'), (29, '01'), (28, '01'), (27, '01'), (26, '01'), (25, '01'),
-        
-        # Layer 2
-        (49, '01'), (50, '01'), (51, '01'), (52, '01'), (53, '01'), (54, '01'), (55, '01'), (56, '01'),
-        (64, '01'), (63, '01'), (62, '01'), (61, '01'), (60, '01'), (59, '01'), (58, '01'), (57, '01'),
-        (33, '01'), (34, '01'), (35, '01'), (36, '01'), (37, '01'), (38, '01'), (39, '01'), (40, '01'),
-        (48, '01'), (47, '01'), (46, '01'), (45, '01'), (44, '01'), (43, '01'), (42, '01'), (41, '01'),
-
-        # Layer 3
-        (65, '01'), (66, '01'), (67, '01'), (68, '01'), (69, '01'), (70, '01'), (71, '01'), (72, '01'),
-        (80, '01'), (79, '01'), (78, '01'), (77, '01'), (76, '01'), (75, '01'), (74, '01'), (73, '01'),
-        (81, '01'), (82, '01'), (83, '01'), (84, '01'), (85, '01'), (86, '01'), (87, '01'), (88, '01'),
-        (96, '01'), (95, '01'), (94, '01'), (93, '01'), (92, '01'), (91, '01'), (90, '01'), (89, '01'),
-        
-        
-        
-        # Layer 4
-        (1, '05'), (2, '05'), (3, '05'), (4, '05'), (5, '05'), (6, '05'), (7, '05'), (8, '05'),
-        (16, '05'), (15, '05'), (14, '05'), (13, '05'), (12, '05'), (11, '05'), (10, '05'), (9, '05'),
-        (17, '05'), (18, '05'), (19, '05'), (20, '05'), (21, '05'), (22, '05'), (23, '05'), (24, '05'),
-        (32, '05'), (31, '05'), (30, '05'), (29, '05'), (28, '05'), (27, '05'), (26, '05'), (25, '05'),
-
-        # Layer 5
-        (49, '05'), (50, '05'), (51, '05'), (52, '05'), (53, '05'), (54, '05'), (55, '05'), (56, '05'),
-        (64, '05'), (63, '05'), (62, '05'), (61, '05'), (60, '05'), (59, '05'), (58, '05'), (57, '05'),
-        (33, '05'), (34, '05'), (35, '05'), (36, '05'), (37, '05'), (38, '05'), (39, '05'), (40, '05'),
-        (48, '05'), (47, '05'), (46, '05'), (45, '05'), (44, '05'), (43, '05'), (42, '05'), (41, '05'),
-
-        # Layer 6
-        (65, '05'), (66, '05'), (67, '05'), (68, '05'), (69, '05'), (70, '05'), (71, '05'), (72, '05'),
-        (80, '05'), (79, '05'), (78, '05'), (77, '05'), (76, '05'), (75, '05'), (74, '05'), (73, '05'),
-        (81, '05'), (82, '05'), (83, '05'), (84, '05'), (85, '05'), (86, '05'), (87, '05'), (88, '05'),
-        (96, '05'), (95, '05'), (94, '05'), (93, '05'), (92, '05'), (91, '05'), (90, '05'), (89, '05'),
-    ]
+    # The quality mask is computed once per run and cached next to the extract cache
+    if apply_quality and len(temperatures) > 0:
+        from data_quality import load_quality, apply_quality_mask, describe_quality
+        mask, quality_summary = load_quality(file_id, temperatures, quality_thresholds, force_refresh=force_refresh)
+        temperatures = apply_quality_mask(temperatures, mask)
+        print(f"Data quality of {file_id}: {describe_quality(quality_summary)}")
+
+    return temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow
 
+def main(db_path, lookup_table_path, file_id, vmin, vmax, run_cache_mb=1024, event_thresholds=None, quality_thresholds=None, smooth=False,
+         compare_file_id=None, compare_offset=0):
+    from run_cache import RunCache
+    from run_index import load_file_ids
+
+    if compare_file_id:
+        compare_main(db_path, lookup_table_path, file_id, compare_file_id, compare_offset, vmin, vmax,
+                     event_thresholds=event_thresholds, quality_thresholds=quality_thresholds, smooth=smooth)
+        return
+
+    # Runs stay in memory (up to run_cache_mb) so switching back to them in the viewer is instant
+    run_cache = RunCache(functools.partial(load_run, db_path, lookup_table_path, quality_thresholds=quality_thresholds),
+                         memory_budget_mb=run_cache_mb)
+    temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow = run_cache.get(file_id)
+
+    try:
+        run_ids = load_file_ids(lookup_table_path)
+    except (OSError, ValueError) as e:
+        print(f"Could not load the run list, run switching is disabled: {e}")
+        run_ids = None
 
     if len(temperatures) > 0:
         interactive_battery_layout(
@@ -651,14 +950,49 @@ def main(db_path, lookup_table_path, file_id, vmin, vmax):
             outlet_temp,
             flow,
             vmin,  # Pass vmin
-            vmax   # Pass vmax
+            vmax,  # Pass vmax
+            file_id=file_id,
+            run_ids=run_ids,
+            run_cache=run_cache,
+            event_thresholds=event_thresholds,
+            smooth=smooth
         )
     else:
         print("No temperature data found.")
+    run_cache.shutdown()
+
+def compare_main(db_path, lookup_table_path, file_id_a, file_id_b, offset, vmin, vmax, event_thresholds=None, quality_thresholds=None, smooth=False):
+    """Viewer in comparison mode: run A, run B and A - B on a common time base, driven by one slider."""
+    from run_comparison import compare_runs
+
+    comparison = compare_runs(db_path, lookup_table_path, file_id_a, file_id_b, offset=offset, quality_thresholds=quality_thresholds)
+    if comparison.total_frames == 0:
+        print(f"No overlapping temperature data found for {file_id_a} and {file_id_b}.")
+        return
+    temperatures, sensor_identifiers, inlet_temp, outlet_temp, flow = comparison.view('A')
+    interactive_battery_layout(
+        temperatures, sensor_identifiers, sensors_per_module_list, strings_count, custom_sensor_order,
+        inlet_temp, outlet_temp, flow, vmin, vmax,
+        file_id=file_id_a, event_thresholds=event_thresholds, smooth=smooth, comparison=comparison
+    )
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Interactive battery temperature layout.")
+    parser.add_argument("--config", default="config.json", help="Configuration file written by settings.py")
+    parser.add_argument("--compare", default=None, metavar="FILE_ID",
+                        help="Compare the configured run (A) with this run (B) on a common time base")
+    parser.add_argument("--offset", type=int, default=0,
+                        help="In comparison mode, compare sample t of A with sample t + offset of B")
+    parser.add_argument("--trace", nargs="?", const="trace.json", default=None,
+                        help="Record stage timings and write them as a JSON trace (default: trace.json)")
+    parser.add_argument("--profile", default=None, help="Also run cProfile and write the stats to this file")
+    args = parser.parse_args()
+
+    if args.trace or args.profile:
+        instrumentation.enable(trace_path=args.trace or "trace.json", profile_path=args.profile)
+
     # Load configuration from JSON
-    config_data = load_config("config.json")
+    config_data = load_config(args.config)
     
     if config_data:
         db_path = config_data.get("db_path", "mf4_data.db")
@@ -666,8 +1000,13 @@ if __name__ == "__main__":
         file_id = config_data.get("file_id", "TCP0014_Run17_01.MF4").strip("'\"")  # Strip any extra quotes
         vmin = config_data.get("vmin", 15.0)
         vmax = config_data.get("vmax", 40.0)
+        run_cache_mb = config_data.get("run_cache_mb", 1024)
+        event_thresholds = config_data.get("event_thresholds")  # Optional overrides of event_index.default_event_thresholds
+        quality_thresholds = config_data.get("quality_thresholds")  # Optional overrides of data_quality.default_quality_thresholds
+        smooth = config_data.get("smooth_heatmap", False)  # Start in the interpolated heatmap mode
 
         # Pass the loaded values to the main function
-        main(db_path, lookup_table_path, file_id, vmin, vmax)
+        main(db_path, lookup_table_path, file_id, vmin, vmax, run_cache_mb=run_cache_mb, event_thresholds=event_thresholds,
+             quality_thresholds=quality_thresholds, smooth=smooth, compare_file_id=args.compare, compare_offset=args.offset)
     else:
         print("Error: Could not load configuration. Exiting.")
\ No newline at end of file
@@ -0,0 +1,156 @@
+import argparse
+import time
+import warnings
+import numpy as np
+import thermal_dynamics_HVB as viewer
+from data_fingerprint import current_fingerprints
+from incremental import compute_in_pool, order_by_runs, read_results, unchanged_runs, write_results
+from run_index import load_file_ids
+
+# Bump when the model or the fit changes, so that all runs are refitted
+model_version = 1
+
+# The viewer plots one sample per second
+sample_period_s = 1.0
+
+# Samples between the two temperatures of a fitted step; over a single sample the change is mostly the 0.1 °C resolution
+step_samples = 10
+
+# Steps with less coolant flow than this are left out, the plate is then not coupled to the inlet temperature
+min_flow_l_min = 1.0
+
+# Sensors with fewer valid steps than this get no parameters
+min_fit_steps = 60
+
+# Fitted parameters per sensor, in the order of the result table
+thermal_parameters = ["tau_s", "inlet_coupling_per_s", "heating_k_per_s", "steady_offset_c", "rmse_k_per_s", "r2", "steps"]
+
+def fit_lumped_model(temperatures, inlet_temp, flow, step=step_samples, min_flow=min_flow_l_min):
+    """Fit the lumped model dT/dt = k (T_inlet - T) + q to every sensor of a run at once.
+
+    k is the coupling to the coolant inlet (1/tau), q the heating rate the cell would have at inlet temperature.
+    Both come from the 2x2 normal equations of each sensor's least-squares fit, which are accumulated and solved
+    for all sensors together as array operations. Returns a dict of per-sensor arrays, keys thermal_parameters.
+    """
+    length = min(temperatures.shape[1], len(inlet_temp), len(flow))
+    n_sensors = temperatures.shape[0]
+    if length <= step:
+        return {name: np.full(n_sensors, np.nan) for name in thermal_parameters}
+
+    temperatures = temperatures[:, :length]
+    inlet_temp = np.asarray(inlet_temp[:length], dtype=float)
+    flow = np.asarray(flow[:length], dtype=float)
+
+    # Regressor and response of every step of every sensor (sensor x step)
+    x = inlet_temp[None, :-step] - temperatures[:, :-step]
+    y = (temperatures[:, step:] - temperatures[:, :-step]) / (step * sample_period_s)
+    with np.errstate(invalid="ignore"):
+        valid = np.isfinite(x) & np.isfinite(y) & (flow[:-step] >= min_flow)[None, :]
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+
+    n = np.count_nonzero(valid, axis=1).astype(float)
+    sum_x, sum_y = x.sum(axis=1), y.sum(axis=1)
+    sum_xx, sum_xy, sum_yy = np.einsum("st,st->s", x, x), np.einsum("st,st->s", x, y), np.einsum("st,st->s", y, y)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        determinant = n * sum_xx - sum_x ** 2
+        solvable = (n >= min_fit_steps) & (determinant > 1e-12 * np.maximum(n * sum_xx, 1e-300))
+        k = np.where(solvable, (n * sum_xy - sum_x * sum_y) / determinant, np.nan)
+        q = np.where(solvable, (sum_y - k * sum_x) / n, np.nan)
+
+        residual = np.maximum(sum_yy - k * sum_xy - q * sum_y, 0.0)
+        total = sum_yy - sum_y ** 2 / n
+        return {
+            "tau_s": np.where(k > 0, 1.0 / k, np.nan),
+            "inlet_coupling_per_s": k,
+            "heating_k_per_s": q,
+            "steady_offset_c": np.where(k > 0, q / k, np.nan),  # Temperature above the inlet once settled
+            "rmse_k_per_s": np.sqrt(residual / n),
+            "r2": np.where(total > 0, 1.0 - residual / total, np.nan),
+            "steps": n,
+        }
+
+def fit_run(db_path, lookup_table_path, file_id, fingerprint, quality_thresholds=None):
+    """Worker: load one run through the extract cache and fit the model to all of its sensors. Returns table rows."""
+    start_time = time.perf_counter()
+    temperatures, sensor_identifiers, inlet_temp, _, flow = viewer.load_run(
+        db_path, lookup_table_path, file_id, quality_thresholds=quality_thresholds)
+    parameters = fit_lumped_model(temperatures, inlet_temp, flow)
+    fit_s = time.perf_counter() - start_time
+    return [dict({"file_id": file_id, "SensorNumber": sensor_number, "BMS_ID": bms_id, "model_version": model_version,
+                  "fingerprint": fingerprint, "fit_s": fit_s},
+                 **{name: float(parameters[name][row]) for name in thermal_parameters})
+            for row, (sensor_number, bms_id) in enumerate(sensor_identifiers)]
+
+def fit_all_runs(db_path, lookup_table_path, output_path, workers=None, force=False, quality_thresholds=None):
+    """Fit the model to every run in the lookup table in parallel, reusing the parameters of unchanged runs."""
+    import pandas as pd
+
+    file_ids = load_file_ids(lookup_table_path)
+    fingerprints = current_fingerprints(db_path, lookup_table_path, file_ids, quality=quality_thresholds, version=model_version)
+    previous = read_results(output_path)
+
+    # A run is refitted if its data, the quality thresholds or the model changed since its parameters were stored
+    stored = dict(zip(previous["file_id"], previous["fingerprint"])) if "fingerprint" in previous else {}
+    unchanged = unchanged_runs(fingerprints, stored, force)
+    tables = [previous[previous["file_id"].isin(unchanged)]] if unchanged else []
+    todo = {file_id: (db_path, lookup_table_path, file_id, fingerprints[file_id], quality_thresholds)
+            for file_id in file_ids if file_id not in unchanged}
+
+    print(f"{len(file_ids)} runs, {len(todo)} to fit, {len(unchanged)} unchanged.")
+    fitted = compute_in_pool(fit_run, todo, workers, span_name="thermal_model.fit", action="fitting")
+    tables.extend(pd.DataFrame(rows) for rows in fitted.values())
+
+    results = order_by_runs(pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(), file_ids)
+    write_results(results, output_path)
+    print(f"Thermal parameters of {results['file_id'].nunique() if not results.empty else 0} runs saved to {output_path}")
+    return results
+
+def plot_parameter_heatmap(results, parameter, file_id=None, output_path=None):
+    """Render one fitted parameter per sensor in the battery layout, for one run or the median over all runs."""
+    import matplotlib.pyplot as plt
+
+    if file_id is not None:
+        results = results[results["file_id"] == file_id]
+    per_sensor = results.groupby(["SensorNumber", "BMS_ID"])[parameter].median()
+    sensor_identifiers = list(per_sensor.index)
+    data = per_sensor.to_numpy(dtype=float)[:, None]  # (sensor x 1), column 0 is the "frame"
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        vmin, vmax = np.nanpercentile(data, [2, 98]) if np.isfinite(data).any() else (0.0, 1.0)
+
+    fig, axes = plt.subplots(2, 3, figsize=(15, 8))
+    axes = axes.flatten()
+    heatmap = viewer.plot_battery_layout(
+        data, sensor_identifiers, viewer.sensors_per_module_list, viewer.strings_count,
+        0, 1, axes, [None], viewer.custom_sensor_order, vmin=vmin, vmax=vmax, fig=fig, unit="")
+    source = file_id if file_id is not None else f"median over {results['file_id'].nunique()} runs"
+    fig.suptitle(f"{parameter} per sensor, {source}", fontsize=14)
+    colorbar = fig.colorbar(heatmap, ax=axes.tolist(), shrink=0.6)
+    colorbar.set_label(parameter, fontsize=12)
+
+    if output_path:
+        fig.savefig(output_path, dpi=150)
+        print(f"Heatmap saved to {output_path}")
+    else:
+        plt.show()
+
+if __name__ == "__main__":
+    config_data = viewer.load_config("config.json") or {}
+
+    parser = argparse.ArgumentParser(description="Fit a lumped thermal model (time constant, inlet coupling) to every sensor of every run.")
+    parser.add_argument("--db-path", default=config_data.get("db_path", "mf4_data.db"))
+    parser.add_argument("--lookup-table-path", default=config_data.get("lookup_table_path", "db_lookup_table.parquet"))
+    parser.add_argument("--output", default="thermal_parameters.parquet", help="Parameter table (.parquet or .csv)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Refit all runs")
+    parser.add_argument("--plot", default=None, choices=thermal_parameters, help="Render this parameter as a battery layout heatmap")
+    parser.add_argument("--plot-file-id", default=None, help="Run to plot (default: median over all runs)")
+    parser.add_argument("--plot-output", default=None, help="Save the heatmap to this file instead of showing it")
+    args = parser.parse_args()
+
+    results = fit_all_runs(args.db_path, args.lookup_table_path, args.output, workers=args.workers, force=args.force,
+                           quality_thresholds=config_data.get("quality_thresholds"))
+    if args.plot and not results.empty:
+        plot_parameter_heatmap(results, args.plot, args.plot_file_id, args.plot_output)